@@ -0,0 +1,27 @@
+from collections import Counter
+
+
+def summarize_customers(customers):
+    """
+    Build the CustomerListView analytics block from already-fetched
+    ``annotated_customers()`` rows, so no extra query is issued per metric.
+    """
+    segment_distribution = Counter()
+    acquisition_trend = Counter()
+    spent_total = 0
+    spent_count = 0
+
+    for customer in customers:
+        segment_distribution[customer.segment] += 1
+        acquisition_trend[customer.signup_date.month] += 1
+        # Same semantics as Avg(): customers without transactions are ignored
+        if customer.total_spent is not None:
+            spent_total += customer.total_spent
+            spent_count += 1
+
+    return {
+        'total_customers': len(customers),
+        'segment_distribution': dict(segment_distribution),
+        'average_customer_value': spent_total / spent_count if spent_count else None,
+        'customer_acquisition_trend': dict(sorted(acquisition_trend.items())),
+    }
@@ -0,0 +1,163 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
+from django.db import connections, transaction
+from django.db.models import F, Max, Min
+
+from . import cache, rollups, snapshot
+from .models import Transaction
+
+METHODS = ('mad', 'zscore', 'iqr')
+DEFAULT_THRESHOLDS = {'mad': 3.5, 'zscore': 3.0, 'iqr': 1.5}
+DEFAULT_CHUNK_SIZE = 50000
+DEFAULT_MIN_TRANSACTIONS = 5
+
+FIELDS = ('transaction_id', 'customer_id', 'amount', 'is_anomalous', 'transaction_date', 'segment', 'category')
+
+
+def _group_quantile(values, starts, counts, q):
+    # ``values`` must be sorted within each group; linear interpolation like np.quantile
+    position = starts + q * (counts - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    fraction = position - lower
+    return values[lower] * (1 - fraction) + values[upper] * fraction
+
+
+def score(customer_ids, amounts, method='mad', threshold=None, min_transactions=DEFAULT_MIN_TRANSACTIONS):
+    """
+    Flag outlying amounts against each customer's own history.
+
+    ``customer_ids`` must be grouped (sorted) by customer. Returns a boolean
+    array aligned with ``amounts``. Customers with fewer than
+    ``min_transactions`` transactions are never flagged.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}'")
+    threshold = DEFAULT_THRESHOLDS[method] if threshold is None else threshold
+    size = len(amounts)
+    if not size:
+        return np.zeros(0, dtype=bool)
+
+    starts = np.flatnonzero(np.r_[True, customer_ids[1:] != customer_ids[:-1]])
+    counts = np.diff(np.r_[starts, size])
+    group = np.repeat(np.arange(len(starts)), counts)
+
+    if method == 'zscore':
+        mean = np.add.reduceat(amounts, starts) / counts
+        variance = np.add.reduceat(amounts ** 2, starts) / counts - mean ** 2
+        std = np.sqrt(np.maximum(variance, 0))[group]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            flags = np.abs(amounts - mean[group]) / std > threshold
+    else:
+        ordered = amounts[np.lexsort((amounts, group))]
+        if method == 'iqr':
+            q1 = _group_quantile(ordered, starts, counts, 0.25)[group]
+            q3 = _group_quantile(ordered, starts, counts, 0.75)[group]
+            spread = q3 - q1
+            flags = (spread > 0) & ((amounts < q1 - threshold * spread) | (amounts > q3 + threshold * spread))
+        else:
+            median = _group_quantile(ordered, starts, counts, 0.5)[group]
+            deviation = np.abs(amounts - median)
+            mad = _group_quantile(deviation[np.lexsort((deviation, group))], starts, counts, 0.5)[group]
+            # A MAD of zero (over half the amounts identical) falls back to the
+            # scaled mean absolute deviation
+            mean_deviation = (np.add.reduceat(deviation, starts) / counts)[group]
+            scale = np.where(mad > 0, mad / 0.6745, mean_deviation * 1.2533)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                flags = deviation / scale > threshold
+
+    return flags & (counts >= min_transactions)[group]
+
+
+def _customer_chunks(queryset, chunk_size):
+    # Chunks only break between customers so every customer is scored whole
+    chunk = []
+    for row in queryset.iterator(chunk_size=min(chunk_size, 10000)):
+        if len(chunk) >= chunk_size and row[1] != chunk[-1][1]:
+            yield chunk
+            chunk = []
+        chunk.append(row)
+    if chunk:
+        yield chunk
+
+
+def _score_range(first_customer, last_customer, method, threshold, min_transactions, chunk_size):
+    """Score one customer-id range; returns (scored, flagged, changed rows)."""
+    queryset = (
+        Transaction.objects
+        .filter(customer_id__gte=first_customer, customer_id__lte=last_customer)
+        .order_by('customer_id', 'transaction_id')
+        .values_list(
+            'transaction_id', 'customer_id', 'amount', 'is_anomalous', 'transaction_date',
+            F('customer__segment'), F('product__category'),
+        )
+    )
+    scored = flagged = 0
+    changed = []
+    for chunk in _customer_chunks(queryset, chunk_size):
+        customer_ids = np.fromiter((row[1] for row in chunk), dtype=np.int64, count=len(chunk))
+        amounts = np.fromiter((float(row[2]) for row in chunk), dtype=np.float64, count=len(chunk))
+        previous = np.fromiter((row[3] for row in chunk), dtype=bool, count=len(chunk))
+        flags = score(customer_ids, amounts, method, threshold, min_transactions)
+
+        scored += len(chunk)
+        flagged += int(flags.sum())
+        for index in np.flatnonzero(flags != previous):
+            row = dict(zip(FIELDS, chunk[index]))
+            row['is_anomalous'] = bool(flags[index])
+            changed.append(row)
+    return scored, flagged, changed
+
+
+def _score_range_in_worker(*args):
+    # Forked workers must not reuse connections inherited from the parent
+    connections.close_all()
+    return _score_range(*args)
+
+
+def apply_changes(changed, batch_size=1000):
+    """Write changed flags in batches and keep rollups/cache in step."""
+    with transaction.atomic():
+        # Only two target values exist, so a plain UPDATE ... WHERE pk IN (...)
+        # per batch and value is much cheaper than bulk_update's CASE per row
+        for flag in (True, False):
+            ids = [row['transaction_id'] for row in changed if row['is_anomalous'] is flag]
+            for start in range(0, len(ids), batch_size):
+                Transaction.objects.filter(transaction_id__in=ids[start:start + batch_size]).update(is_anomalous=flag)
+        rollups.record_anomaly_changes(changed)
+        if changed:
+            cache.bump_data_version()
+            snapshot.mark_rewritten(row['transaction_id'] for row in changed)
+
+
+def run(method='mad', threshold=None, min_transactions=DEFAULT_MIN_TRANSACTIONS,
+        chunk_size=DEFAULT_CHUNK_SIZE, workers=1, dry_run=False):
+    """
+    Re-score every transaction. With ``workers > 1`` the customer-id space is
+    split into ranges scored in a process pool; all writes happen here.
+    Returns a dict of counts.
+    """
+    bounds = Transaction.objects.aggregate(first=Min('customer_id'), last=Max('customer_id'))
+    if bounds['first'] is None:
+        return {'scored': 0, 'flagged': 0, 'changed': 0}
+
+    args = (method, threshold, min_transactions, chunk_size)
+    if workers > 1:
+        edges = np.linspace(bounds['first'], bounds['last'] + 1, workers + 1).astype(np.int64)
+        ranges = [(int(lo), int(hi) - 1) for lo, hi in zip(edges[:-1], edges[1:]) if hi > lo]
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+            results = list(pool.map(_score_range_in_worker, *zip(*[(lo, hi, *args) for lo, hi in ranges])))
+    else:
+        results = [_score_range(bounds['first'], bounds['last'], *args)]
+
+    changed = [row for _, _, rows in results for row in rows]
+    if not dry_run:
+        apply_changes(changed)
+    return {
+        'scored': sum(result[0] for result in results),
+        'flagged': sum(result[1] for result in results),
+        'changed': len(changed),
+    }
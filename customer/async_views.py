@@ -0,0 +1,69 @@
+"""
+Async variants of the dashboard endpoints.
+
+Each independent aggregate of a dashboard runs in its own worker thread and
+database connection, so a request takes about as long as its slowest query
+instead of the sum of all of them. They return the same data as the sync
+views and share their cache entries.
+
+The fan-out only pays off under ASGI; under WSGI Django runs async views in
+a one-off event loop per request. Serve the project with an ASGI server::
+
+    uvicorn customerinsights.asgi:application --workers 4
+
+and compare both paths with ``python manage.py benchmark_dashboards``.
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.renderers import JSONRenderer
+
+from . import cache, dashboards
+from .filters import FilterError
+from .replicas import replica_reads
+
+
+def _render(data, status=200):
+    # Same bytes as the APIView JSON responses
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+class AsyncDashboardView(View):
+    endpoint = None
+    plan = None
+
+    @replica_reads
+    async def get(self, request, *args, **kwargs):
+        version, day, updated_at = await sync_to_async(cache.response_watermark)()
+        tag = cache.etag(self.endpoint, request.GET, kwargs, version, day, 'application/json')
+        response = cache.not_modified(request, tag, updated_at)
+        if response is not None:
+            return response
+
+        key, data = await sync_to_async(cache.lookup)(self.endpoint, request.GET, kwargs, version, day)
+        if data is not None:
+            response = _render(data)
+            response['X-Cache'] = 'HIT'
+        else:
+            try:
+                plan = self.plan(request.GET)
+            except FilterError as exc:
+                response = _render({"error": str(exc)}, status=400)
+            else:
+                data = await dashboards.run_concurrently(plan)
+                await sync_to_async(cache.store)(key, data)
+                response = _render(data)
+            response['X-Cache'] = 'MISS'
+        if response.status_code == 200:
+            cache.set_validators(response, tag, updated_at)
+        return response
+
+
+class AsyncRevenueTrendsView(AsyncDashboardView):
+    endpoint = 'revenue-trends'
+    plan = staticmethod(dashboards.revenue_trends)
+
+
+class AsyncCustomerInsightsView(AsyncDashboardView):
+    endpoint = 'customer-insights'
+    plan = staticmethod(dashboards.customer_insights)
@@ -0,0 +1,119 @@
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Customer, Product
+from .urls import urlpatterns
+
+# Extra query strings exercised per route, on top of a bare request
+ROUTE_PARAMS = {
+    'customer-list': [
+        {'segment': 'High'},
+        {'period': 'month'},
+        {'date_from': '2000-01-01T00:00:00Z', 'date_to': '2100-01-01T00:00:00Z'},
+        {'has_anomalies': 'true'},
+        {'min_spent': '0', 'customer_name': 'a'},
+        {'customer_name': 'smith'},
+    ],
+    'customer-search': [{'q': 'al'}, {'q': 'smith', 'limit': '20'}, {'q': 'jhonson'}],
+    'customer-insights': [{'period': 'day'}, {'period': 'month'}],
+    'revenue-trends': [{'period': 'week'}, {'period': 'year'}],
+    'transaction-distribution': [{'period': 'month'}, {'period': 'week', 'periods': '12'}],
+    'cohort-retention': [{'segment': 'High'}, {'category': 'Loan', 'months': '6'}],
+    'transaction_history': [{'period': 'month'}, {'anomalous': 'true'}],
+}
+PERCENTILES = (50, 90, 99)
+
+
+def uncached_settings():
+    """Settings overrides under which every analytics cache lookup misses."""
+    return {
+        'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver', 'localhost'],
+        'CACHES': {
+            **settings.CACHES,
+            # Entries expire immediately
+            'benchmark': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'benchmark',
+                'TIMEOUT': 0,
+            },
+        },
+        'CUSTOMER_ANALYTICS_CACHE': 'benchmark',
+    }
+
+
+def route_requests():
+    """
+    Yield ``(route name, url, params)`` for every GET route in customer.urls
+    and its ROUTE_PARAMS variants, with URL arguments taken from the data.
+    Raises LookupError when there is no data to take them from.
+    """
+    customer = Customer.objects.filter(transactions__isnull=False).first() or Customer.objects.first()
+    product = Product.objects.first()
+    if customer is None or product is None:
+        raise LookupError("The database has no customers or products; seed it first.")
+    sample_kwargs = {
+        'customer_id': customer.pk,
+        'product_name': product.name,
+        'name': customer.profile_image.name or Customer._meta.get_field('profile_image').default,
+    }
+
+    for pattern in urlpatterns:
+        view_class = getattr(pattern.callback, 'view_class', None)
+        if view_class is not None and not hasattr(view_class, 'get'):
+            continue
+        if not set(pattern.pattern.converters) <= set(sample_kwargs):
+            continue  # Job routes need a job submitted first
+        kwargs = {name: sample_kwargs[name] for name in pattern.pattern.converters}
+        url = reverse(pattern.name, kwargs=kwargs)
+        for params in [{}] + ROUTE_PARAMS.get(pattern.name, []):
+            yield pattern.name, url, params
+
+
+def fetch(client, url, params):
+    """Request ``url`` and read the whole body, streamed or not; returns ``(response, body size)``."""
+    response = client.get(url, params)
+    if hasattr(response, 'streaming_content'):
+        return response, sum(len(chunk) for chunk in response.streaming_content)
+    return response, len(response.content)
+
+
+def measure(client, url, params, repeat):
+    """
+    Latency percentiles, query count, response size and peak Python memory
+    of one request. Queries the async views run on their worker pool are
+    not seen by this thread and so not counted.
+    """
+    with CaptureQueriesContext(connection) as ctx:
+        response, size = fetch(client, url, params)
+    queries = ctx.captured_queries
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fetch(client, url, params)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    # Separate pass, since tracing allocations slows the request down
+    tracemalloc.start()
+    try:
+        fetch(client, url, params)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        'status': response.status_code,
+        'queries': len(queries),
+        'bytes': size,
+        'peak_memory_kb': round(peak / 1024, 1),
+        'max_ms': round(max(timings), 3),
+    }
+    for percentile, value in zip(PERCENTILES, np.percentile(timings, PERCENTILES)):
+        result[f'p{percentile}_ms'] = round(float(value), 3)
+    return result
@@ -0,0 +1,199 @@
+import functools
+import hashlib
+import os
+from datetime import datetime, time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .models import DataVersion
+
+DATA_VERSION_NAME = 'analytics'
+
+
+def get_cache():
+    return caches[getattr(settings, 'CUSTOMER_ANALYTICS_CACHE', 'default')]
+
+
+def watermark(name=DATA_VERSION_NAME):
+    """``(version, updated_at)`` of the analytics data, read with one lookup on the unique name."""
+    return (
+        DataVersion.objects.filter(name=name).values_list('version', 'updated_at').first()
+        or (0, None)
+    )
+
+
+def current_data_version():
+    return watermark()[0]
+
+
+def response_watermark():
+    """
+    ``(version, day, last modified)`` that a response's cache entry and
+    validators derive from. Default windows resolve against the local
+    ``day``, so a response also changes at midnight: the last modified time
+    is never before the start of ``day``.
+    """
+    version, updated_at = watermark()
+    day = timezone.localdate()
+    midnight = timezone.make_aware(datetime.combine(day, time.min))
+    return version, day, max(updated_at, midnight) if updated_at else midnight
+
+
+def bump_data_version(name=DATA_VERSION_NAME):
+    """Invalidate every cached analytics response. Called from the model write signals."""
+    now = timezone.now()
+    if DataVersion.objects.filter(name=name).update(version=F('version') + 1, updated_at=now):
+        return
+    try:
+        with transaction.atomic():
+            DataVersion.objects.create(name=name, version=1, updated_at=now)
+    except IntegrityError:
+        DataVersion.objects.filter(name=name).update(version=F('version') + 1, updated_at=now)
+
+
+def _request_digest(endpoint, query_params, url_kwargs, *extra):
+    # Normalize: parameter order and repeated values must not change the digest
+    params = sorted((name, tuple(sorted(query_params.getlist(name)))) for name in query_params)
+    raw = repr((endpoint, params, sorted(url_kwargs.items()), *extra))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def cache_key(endpoint, query_params, url_kwargs, version, day):
+    # Default windows ("this week", the last N months) resolve against the
+    # local date, so entries of another ``day`` must not be served either
+    return f"analytics:{endpoint}:{version}:{_request_digest(endpoint, query_params, url_kwargs, day)}"
+
+
+def etag(endpoint, query_params, url_kwargs, version, day, media_type=''):
+    """Validator of a response on ``day``; the media type keeps JSON and browsable API renderings apart."""
+    return f'"{version}-{_request_digest(endpoint, query_params, url_kwargs, day, media_type)[:20]}"'
+
+
+def not_modified(request, tag, updated_at):
+    """The 304 response for a request whose validators still match, else None."""
+    last_modified = int(updated_at.timestamp()) if updated_at else None
+    response = get_conditional_response(request, etag=tag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, tag, updated_at)
+    return response
+
+
+def set_validators(response, tag, updated_at):
+    response['ETag'] = tag
+    if updated_at:
+        response['Last-Modified'] = http_date(updated_at.timestamp())
+    # Clients may keep the body but must revalidate, which the ETag makes cheap
+    patch_cache_control(response, no_cache=True)
+
+
+def _count(name):
+    cache = get_cache()
+    key = f"analytics-stats:{name}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def stats():
+    cache = get_cache()
+    hits = cache.get('analytics-stats:hits', 0)
+    misses = cache.get('analytics-stats:misses', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else None,
+        'data_version': current_data_version(),
+    }
+
+
+def lookup(endpoint, query_params, url_kwargs, version=None, day=None):
+    """Return ``(key, data)`` for a request today (or on ``day``); ``data`` is None on a miss."""
+    if version is None:
+        version = current_data_version()
+    key = cache_key(endpoint, query_params, url_kwargs, version, day or timezone.localdate())
+    data = get_cache().get(key)
+    _count('misses' if data is None else 'hits')
+    return key, data
+
+
+def store(key, data):
+    get_cache().set(key, data)
+
+
+def cached_response(endpoint):
+    """
+    Cache the data of successful responses of an APIView ``get`` method,
+    keyed on the endpoint, its normalized query parameters, the current
+    data version and the local date. Adds an ``X-Cache: HIT|MISS`` header.
+
+    Successful responses also carry an ETag and Last-Modified derived from
+    the same data version and date, and a request whose If-None-Match or
+    If-Modified-Since still matches gets a 304 after that single lookup.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            version, day, updated_at = response_watermark()
+            tag = etag(endpoint, request.query_params, kwargs, version, day, request.accepted_media_type)
+            response = not_modified(request, tag, updated_at)
+            if response is not None:
+                return response
+
+            key, data = lookup(endpoint, request.query_params, kwargs, version, day)
+            if data is not None:
+                response = Response(data)
+                response['X-Cache'] = 'HIT'
+            else:
+                response = method(view, request, *args, **kwargs)
+                if response.status_code == 200:
+                    store(key, response.data)
+                response['X-Cache'] = 'MISS'
+            if response.status_code == 200:
+                set_validators(response, tag, updated_at)
+            return response
+        return wrapper
+    return decorator
+
+
+class LRUFileBasedCache(FileBasedCache):
+    """
+    FileBasedCache that evicts least recently used entries instead of a
+    random sample once MAX_ENTRIES is reached. A hit refreshes the entry's
+    mtime, which is what the cull orders by.
+    """
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, default, version)
+        if value is not default:
+            try:
+                os.utime(self._key_to_file(key, version))
+            except FileNotFoundError:
+                pass
+        return value
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        num_entries = len(filelist)
+        if num_entries < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            return self.clear()
+
+        def mtime(fname):
+            try:
+                return os.path.getmtime(fname)
+            except FileNotFoundError:
+                return 0
+
+        for fname in sorted(filelist, key=mtime)[:int(num_entries / self._cull_frequency)]:
+            self._delete(fname)
@@ -0,0 +1,146 @@
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from .models import ChurnScore, Customer, Transaction
+
+# Logistic model over RFM features; override with settings.CUSTOMER_CHURN_MODEL
+DEFAULT_MODEL = {
+    'intercept': -1.0,
+    'recency_months': 0.35,   # months since the last transaction (or signup)
+    'log_frequency': -0.6,    # log(1 + number of transactions)
+    'log_monetary': -0.15,    # log(1 + total spent), negative totals count as 0
+}
+GRAPH_POINTS = 12
+DEFAULT_BATCH_SIZE = 5000
+
+DEFAULT_CONFIG = {
+    # Scoring runs kept in ChurnScore; None keeps the whole history
+    'KEEP_RUNS': GRAPH_POINTS,
+}
+
+
+def get_model():
+    return {**DEFAULT_MODEL, **getattr(settings, 'CUSTOMER_CHURN_MODEL', {})}
+
+
+def get_config():
+    return {**DEFAULT_CONFIG, **getattr(settings, 'CUSTOMER_CHURN', {})}
+
+
+def rfm_features(now=None, customers=None):
+    """
+    Return ``(customer_ids, recency_days, frequency, monetary)`` arrays for
+    every customer (or those in the ``customers`` queryset), from one
+    grouped pass over Transaction.
+    """
+    now = now or timezone.now()
+    transactions = Transaction.objects.all()
+    if customers is None:
+        customers = Customer.objects.all()
+    else:
+        transactions = transactions.filter(customer_id__in=customers.values('customer_id'))
+
+    def days_since(moment):
+        return (now - moment).total_seconds() / 86400
+
+    # Customers who never transacted are as recent as their signup
+    signups = np.fromiter(
+        ((customer_id, days_since(signup_date)) for customer_id, signup_date in
+         customers.order_by('customer_id').values_list('customer_id', 'signup_date').iterator(chunk_size=10000)),
+        dtype=[('customer_id', np.int64), ('recency', np.float64)],
+    )
+    customer_ids = signups['customer_id']
+    recency = signups['recency'].copy()
+    frequency = np.zeros(len(signups), dtype=np.int64)
+    monetary = np.zeros(len(signups), dtype=np.float64)
+
+    totals = np.fromiter(
+        ((row['customer_id'], days_since(row['last']), row['frequency'], float(row['monetary'] or 0)) for row in
+         transactions
+         .values('customer_id')
+         .annotate(last=Max('transaction_date'), frequency=Count('transaction_id'), monetary=Sum('amount'))
+         .order_by()
+         .iterator(chunk_size=10000)),
+        dtype=[('customer_id', np.int64), ('recency', np.float64), ('frequency', np.int64), ('monetary', np.float64)],
+    )
+    positions = np.searchsorted(customer_ids, totals['customer_id'])
+    # Drop customers created between the two queries
+    found = positions < len(customer_ids)
+    found[found] = customer_ids[positions[found]] == totals['customer_id'][found]
+    positions, totals = positions[found], totals[found]
+    recency[positions] = totals['recency']
+    frequency[positions] = totals['frequency']
+    monetary[positions] = totals['monetary']
+    return customer_ids, np.maximum(recency, 0), frequency, monetary
+
+
+def predict(recency_days, frequency, monetary, model=None):
+    model = model or get_model()
+    logit = (
+        model['intercept']
+        + model['recency_months'] * (recency_days / 30.0)
+        + model['log_frequency'] * np.log1p(frequency)
+        + model['log_monetary'] * np.log1p(np.maximum(monetary, 0))
+    )
+    return 1.0 / (1.0 + np.exp(-logit))
+
+
+def prune(keep_runs):
+    """Delete the scores of all but the latest ``keep_runs`` runs; returns the rows deleted."""
+    # Every row of a run shares its scored_at
+    cutoff = (
+        ChurnScore.objects.order_by('-scored_at').values_list('scored_at', flat=True).distinct()
+        [keep_runs - 1:keep_runs].first()
+    )
+    if cutoff is None:
+        return 0
+    return ChurnScore.objects.filter(scored_at__lt=cutoff).delete()[0]
+
+
+def score_all(batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """
+    Score every customer and append one ChurnScore row each, dropping the
+    runs past ``CUSTOMER_CHURN['KEEP_RUNS']``. Returns the count.
+    """
+    now = now or timezone.now()
+    customer_ids, recency, frequency, monetary = rfm_features(now)
+    probability = predict(recency, frequency, monetary)
+
+    with transaction.atomic():
+        for start in range(0, len(customer_ids), batch_size):
+            stop = start + batch_size
+            ChurnScore.objects.bulk_create([
+                ChurnScore(
+                    customer_id=int(customer_id),
+                    scored_at=now,
+                    probability=round(float(p), 4),
+                    recency_days=round(float(r), 2),
+                    frequency=int(f),
+                    monetary=Decimal(f"{m:.2f}"),
+                )
+                for customer_id, p, r, f, m in zip(
+                    customer_ids[start:stop], probability[start:stop], recency[start:stop],
+                    frequency[start:stop], monetary[start:stop],
+                )
+            ])
+        if (keep_runs := get_config()['KEEP_RUNS']) is not None:
+            prune(keep_runs)
+    return len(customer_ids)
+
+
+def churn_summary(scores):
+    """``value``/``graph`` for the API from scores ordered newest first."""
+    scores = list(scores)
+    return {
+        "value": scores[0].probability if scores else None,
+        "graph": [score.probability for score in reversed(scores)],
+    }
+
+
+def latest_scores(customer_id, points=GRAPH_POINTS):
+    return ChurnScore.objects.filter(customer_id=customer_id).order_by('-scored_at')[:points]
@@ -0,0 +1,306 @@
+"""
+Signup-cohort retention.
+
+CohortActivity counts, per signup month (cohort), customer segment and
+product category, the customers who transacted in each later month. It is
+built in one pass over the transactions ordered by customer: each
+customer's active (month, category) pairs are collected while their rows
+stream by and counted once the next customer starts, so no customer is
+ever joined against another.
+
+New transactions are counted in as they arrive: a customer becomes active
+in a month (and category) when the new ones are all they have there.
+Updates, deletes and segment or category changes flag the months involved
+stale instead. CohortMonth records which months are built; ``refresh()``
+builds months that are new since the last build and rebuilds stale ones,
+so only those are scanned again. ``manage.py build_cohorts`` runs it in
+full; a read only rebuilds the few most recent, so it never waits on a
+large backlog. Cohort sizes come from the daily rollups.
+"""
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, F, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from . import replicas, windows
+from .filters import FilterError
+from .models import CohortActivity, CohortMonth, Customer, DailySegmentRollup, Transaction
+
+ANY_CATEGORY = '*'
+DEFAULT_COHORTS = 12
+DEFAULT_MONTHS = 12
+MAX_MONTHS = 120
+BATCH_SIZE = 1000
+
+DEFAULT_CONFIG = {
+    # Stale or new months a retention read rebuilds first, the most recent
+    # ones; None rebuilds them all
+    'READ_REBUILD_MONTHS': 2,
+}
+
+
+def get_config():
+    return {**DEFAULT_CONFIG, **getattr(settings, 'CUSTOMER_COHORTS', {})}
+
+
+def month_of(value):
+    return windows.period_start(value, 'month')
+
+
+def offset(cohort, month):
+    """Months from ``cohort`` to ``month``."""
+    return (month.year - cohort.year) * 12 + month.month - cohort.month
+
+
+def _count(rows):
+    """
+    ``Counter({(cohort, month, segment, category): customers})`` of rows
+    ``(customer_id, cohort, segment, month, category)`` ordered by customer.
+    """
+    counts = Counter()
+    for _, customer_rows in groupby(rows, key=itemgetter(0)):
+        active = set()
+        for _, cohort, segment, month, category in customer_rows:
+            if month < cohort:
+                continue  # Backdated before the signup; not part of any retention curve
+            active.add((cohort, month, segment or '', category or ''))
+            active.add((cohort, month, segment or '', ANY_CATEGORY))
+        counts.update(active)
+    return counts
+
+
+def _stream(transactions):
+    # Months are truncated by the database, in the current time zone like the rollups
+    return (
+        transactions
+        .order_by('customer_id')
+        .values_list(
+            'customer_id',
+            TruncMonth('customer__signup_date', output_field=DateField()),
+            'customer__segment',
+            TruncMonth('transaction_date', output_field=DateField()),
+            'product__category',
+        )
+        .iterator(chunk_size=5000)
+    )
+
+
+def _write(counts, months):
+    now = timezone.now()
+    with transaction.atomic():
+        CohortActivity.objects.filter(month__in=months).delete()
+        CohortActivity.objects.bulk_create(
+            (
+                CohortActivity(cohort=cohort, month=month, segment=segment, category=category, customers=customers)
+                for (cohort, month, segment, category), customers in counts.items()
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        CohortMonth.objects.bulk_create(
+            [CohortMonth(month=month) for month in months], ignore_conflicts=True, batch_size=BATCH_SIZE,
+        )
+        CohortMonth.objects.filter(month__in=months).update(stale=False, built_at=now)
+
+
+def build_months(months):
+    """(Re)build the activity of ``months`` (first days of months) with one pass over their transactions."""
+    months = sorted(set(months))
+    if not months:
+        return 0
+    # One range per run of consecutive months
+    condition = Q()
+    start = count = None
+    for month in months + [None]:
+        if start is not None and month == windows.shift(start, 'month', count):
+            count += 1
+            continue
+        if start is not None:
+            condition |= windows.Window(start, 'month', count).q('transaction_date')
+        start, count = month, 1
+    _write(_count(_stream(Transaction.objects.filter(condition))), months)
+    return len(months)
+
+
+def rebuild():
+    """Rebuild every month from a single pass over all transactions; returns the number of months."""
+    first = Transaction.objects.order_by('transaction_date').values_list('transaction_date', flat=True).first()
+    if first is None:
+        with transaction.atomic():
+            CohortActivity.objects.all().delete()
+            CohortMonth.objects.all().delete()
+        return 0
+    counts = _count(_stream(Transaction.objects.all()))
+    months = windows.Window(month_of(first), 'month', offset(month_of(first), month_of(timezone.now())) + 1).buckets()
+    # Future-dated transactions still count
+    months = sorted(set(months) | {month for _, month, _, _ in counts})
+    with transaction.atomic():
+        CohortMonth.objects.exclude(month__in=months).delete()
+        CohortActivity.objects.exclude(month__in=months).delete()
+        _write(counts, months)
+    return len(months)
+
+
+def refresh(limit=None):
+    """
+    Build the months since the last build and rebuild stale ones, or only
+    the ``limit`` most recent of them. Returns the number of months built.
+    """
+    with replicas.primary():
+        last = CohortMonth.objects.order_by('-month').values_list('month', flat=True).first()
+        current = month_of(timezone.now())
+        months = set(CohortMonth.objects.filter(stale=True).values_list('month', flat=True))
+        if last is not None and current > last:
+            months.update(windows.Window(windows.shift(last, 'month', 1), 'month', offset(last, current)).buckets())
+        months = sorted(months, reverse=True)[:limit]
+        return build_months(months)
+
+
+def _increment(increments):
+    with transaction.atomic():
+        for (cohort, month, segment, category), customers in increments.items():
+            keys = {'cohort': cohort, 'month': month, 'segment': segment, 'category': category}
+            if CohortActivity.objects.filter(**keys).update(customers=F('customers') + customers):
+                continue
+            try:
+                with transaction.atomic():
+                    CohortActivity.objects.create(**keys, customers=customers)
+            except IntegrityError:
+                # Another writer created the row in the meantime
+                CohortActivity.objects.filter(**keys).update(customers=F('customers') + customers)
+
+
+def record_transactions(rows):
+    """
+    Count new transactions, given dicts with their customer_id,
+    transaction_date and category, into the activity of their months.
+    Call after they are saved. Months not built yet are flagged instead.
+    """
+    batch = Counter(
+        (values['customer_id'], month_of(values['transaction_date']), values['category'] or '') for values in rows
+    )
+    states = dict(CohortMonth.objects.filter(month__in={month for _, month, _ in batch}).values_list('month', 'stale'))
+    mark_stale({month for _, month, _ in batch if month not in states})
+    batch = {key: count for key, count in batch.items() if states.get(key[1]) is False}
+    if not batch:
+        return
+
+    customer_ids = {customer_id for customer_id, _, _ in batch}
+    condition = Q()
+    for month in {month for _, month, _ in batch}:
+        condition |= windows.Window(month, 'month').q('transaction_date')
+    totals = Counter()
+    for row in (
+        Transaction.objects.filter(condition, customer_id__in=customer_ids)
+        .values('customer_id', 'product__category', month=TruncMonth('transaction_date', output_field=DateField()))
+        .annotate(transactions=Count('transaction_id'))
+        .order_by()
+    ):
+        totals[(row['customer_id'], row['month'], row['product__category'] or '')] += row['transactions']
+        totals[(row['customer_id'], row['month'], ANY_CATEGORY)] += row['transactions']
+    for (customer_id, month, _), count in list(batch.items()):
+        batch[(customer_id, month, ANY_CATEGORY)] = batch.get((customer_id, month, ANY_CATEGORY), 0) + count
+
+    customers = {
+        customer_id: (cohort, segment or '')
+        for customer_id, cohort, segment in Customer.objects.filter(customer_id__in=customer_ids).values_list(
+            'customer_id', TruncMonth('signup_date', output_field=DateField()), 'segment',
+        )
+    }
+    increments = Counter()
+    for (customer_id, month, category), count in batch.items():
+        cohort, segment = customers[customer_id]
+        # Active before only if they had other transactions there
+        if month >= cohort and totals[(customer_id, month, category)] == count:
+            increments[(cohort, month, segment, category)] += 1
+    _increment(increments)
+
+
+def mark_stale(months):
+    """Flag activity ``months`` for a rebuild; called for every write to their transactions."""
+    months = {month_of(month) for month in months}
+    if not months:
+        return
+    with transaction.atomic():
+        CohortMonth.objects.bulk_create(
+            [CohortMonth(month=month, stale=True) for month in months], ignore_conflicts=True,
+        )
+        CohortMonth.objects.filter(month__in=months, stale=False).update(stale=True)
+
+
+def mark_stale_transactions(queryset):
+    """Flag the months of the transactions in ``queryset``, e.g. after their customer or product changed."""
+    mark_stale(
+        queryset.annotate(day=TruncDate('transaction_date')).values_list('day', flat=True).distinct().order_by()
+    )
+
+
+def _cohort_sizes(first, end, segment):
+    sizes = DailySegmentRollup.objects.filter(day__gte=first, day__lt=end, category='')
+    if segment is not None:
+        sizes = sizes.filter(segment=segment)
+    return {
+        row['cohort']: row['customers']
+        for row in sizes.annotate(cohort=TruncMonth('day')).values('cohort').annotate(customers=Sum('new_customers'))
+    }
+
+
+def retention(params):
+    """
+    Retention matrix for CohortRetentionView: for each signup-month cohort
+    selected by ``period=month&periods=N`` (the last 12 by default) or a
+    custom date range, the customers active in each of the ``months``
+    months from signup on, optionally for one ``segment`` and product
+    ``category``.
+    """
+    window = windows.from_params(params, default='month', periods=('month',), count=DEFAULT_COHORTS)
+    try:
+        months = int(params.get('months', DEFAULT_MONTHS))
+    except ValueError:
+        raise FilterError("Invalid months")
+    if not 0 <= months <= MAX_MONTHS:
+        raise FilterError(f"months must be between 0 and {MAX_MONTHS}")
+    segment = params.get('segment')
+    category = params.get('category')
+
+    first = month_of(window.first_day)
+    cohorts = windows.Window(first, 'month', offset(first, month_of(window.last_day)) + 1)
+    current = month_of(timezone.now())
+    refresh(get_config()['READ_REBUILD_MONTHS'])
+
+    activity = CohortActivity.objects.filter(
+        cohort__gte=cohorts.first_day, cohort__lt=cohorts.end_day,
+        category=ANY_CATEGORY if category is None else category,
+    )
+    if segment is not None:
+        activity = activity.filter(segment=segment)
+    active = Counter()
+    for row in activity.values('cohort', 'month').annotate(customers=Sum('customers')).order_by():
+        active[(row['cohort'], row['month'])] += row['customers']
+    sizes = _cohort_sizes(cohorts.first_day, cohorts.end_day, segment)
+
+    rows = []
+    for cohort in cohorts.buckets():
+        if cohort > current:
+            break
+        size = sizes.get(cohort, 0)
+        counts = [
+            active[(cohort, windows.shift(cohort, 'month', index))]
+            for index in range(min(months, offset(cohort, current)) + 1)
+        ]
+        rows.append({
+            'cohort': cohort,
+            'customers': size,
+            'active': counts,
+            'retention': [count / size if size else None for count in counts],
+        })
+    return {
+        'segment': segment,
+        'category': category,
+        'months': months,
+        'cohorts': rows,
+    }
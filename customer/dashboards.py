@@ -0,0 +1,291 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Avg, Count, F, Sum
+from django.utils import timezone
+
+from . import snapshot, windows
+from .middleware import measure_queries
+from .models import Customer, DailyRollup, DailySegmentRollup, Transaction
+
+DEFAULT_WORKERS = 8
+
+# A dashboard "plan" is ``(queries, build)``: ``queries`` maps a name to a
+# callable running one independent query and returning materialized rows,
+# ``build`` turns ``{name: rows}`` into the response data. The sync views
+# run the queries one after another, the async views all at once.
+
+
+def run(plan):
+    queries, build = plan
+    return build({name: query() for name, query in queries.items()})
+
+
+_executor = None
+
+
+def get_executor():
+    # A fixed pool, so each worker opens its connection once and keeps it
+    # across requests; at most CUSTOMER_DASHBOARD_WORKERS extra connections
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'CUSTOMER_DASHBOARD_WORKERS', DEFAULT_WORKERS),
+            thread_name_prefix='dashboard',
+        )
+    return _executor
+
+
+def _in_worker(query):
+    def wrapper():
+        try:
+            with measure_queries():
+                return query()
+        except DatabaseError:
+            # Never reuse a connection that may be broken
+            connections.close_all()
+            raise
+    return wrapper
+
+
+def _snapshot_or(compute, fallback, load):
+    """A query computing its rows from the transaction snapshot, or with the ORM without one."""
+    def query():
+        current = load()
+        return fallback() if current is None else compute(current)
+    return query
+
+
+def _load_once():
+    # The queries of one plan may run at once; they share a single snapshot.load()
+    lock = threading.Lock()
+    loaded = []
+
+    def load():
+        with lock:
+            if not loaded:
+                loaded.append(snapshot.load())
+            return loaded[0]
+    return load
+
+
+async def run_concurrently(plan):
+    """Run every query of ``plan`` at once on the worker pool, one connection each."""
+    queries, build = plan
+    results = await asyncio.gather(*(
+        sync_to_async(_in_worker(query), thread_sensitive=False, executor=get_executor())()
+        for query in queries.values()
+    ))
+    return build(dict(zip(queries, results)))
+
+
+def revenue_trends(params):
+    """
+    Plan for RevenueTrendsView. Reads the daily rollups maintained by
+    customer.signals, so each query grows with the number of days in range
+    rather than with the number of transactions. Every bucket of the window
+    is listed, with zeros where nothing happened, and the summary compares
+    the window with the one before it.
+    """
+    window = windows.from_params(params, default='day')
+
+    daily_qs = DailyRollup.objects.filter(window.q_days('day'))
+    segment_qs = DailySegmentRollup.objects.filter(window.q_days('day'))
+    trunc_day = F('day') if window.period == 'day' else window.truncate('day')
+
+    queries = {
+        'customers': lambda: list(
+            daily_qs
+            .filter(new_customers__gt=0)
+            .annotate(period=trunc_day)
+            .values('period')
+            .annotate(new_customers=Sum('new_customers'))
+            .order_by('period')
+        ),
+        'revenue': lambda: list(
+            daily_qs
+            .filter(transaction_count__gt=0)
+            .annotate(period=trunc_day)
+            .values('period')
+            .annotate(
+                total_revenue=Sum('total_revenue'),
+                transaction_count=Sum('transaction_count'),
+                anomaly_count=Sum('anomaly_count')
+            )
+            .order_by('period')
+        ),
+        'segments': lambda: list(
+            segment_qs
+            .filter(new_customers__gt=0)
+            .annotate(period=trunc_day)
+            .values('period', 'segment')
+            .annotate(count=Sum('new_customers'))
+            .order_by('period', 'segment')
+        ),
+        'products': lambda: list(
+            segment_qs
+            .filter(transaction_count__gt=0)
+            .annotate(period=trunc_day)
+            .values('period', 'category')
+            .annotate(
+                revenue=Sum('total_revenue'),
+                transaction_count=Sum('transaction_count')
+            )
+            .order_by('period', 'category')
+        ),
+        # This window and the previous one in a single scan of the rollups
+        'totals': lambda: windows.compare(
+            DailyRollup.objects.all(), 'day', window, days=True,
+            total_customers=(Sum, 'new_customers'),
+            total_revenue=(Sum, 'total_revenue'),
+            transaction_count=(Sum, 'transaction_count'),
+            anomaly_count=(Sum, 'anomaly_count'),
+        ),
+    }
+
+    def as_period(value):
+        # Keep the datetime buckets the raw-table version returned for week/month/year
+        if window.period in ('week', 'month', 'year'):
+            return timezone.make_aware(datetime.combine(value, datetime.min.time()))
+        return value
+
+    def summarize(totals):
+        transaction_count = totals['transaction_count'] or 0
+        return {
+            'total_customers': totals['total_customers'] or 0,
+            'total_revenue': totals['total_revenue'] or 0,
+            'average_transaction': (totals['total_revenue'] / transaction_count) if transaction_count else 0,
+            'anomaly_rate': (
+                totals['anomaly_count'] / float(transaction_count) if transaction_count else 0
+            ) * 100  # Convert to percentage
+        }
+
+    def build(results):
+        cumulative_customers = []
+        running_total = 0
+        for item in windows.fill(results['customers'], window, {'new_customers': 0}):
+            running_total += item['new_customers']
+            cumulative_customers.append({
+                'period': as_period(item['period']),
+                'new_customers': item['new_customers'],
+                'cumulative_customers': running_total
+            })
+
+        empty_revenue = {'total_revenue': 0, 'transaction_count': 0, 'anomaly_count': 0}
+        revenue_trend = [
+            {
+                'period': as_period(item['period']),
+                'total_revenue': item['total_revenue'],
+                'average_transaction': (
+                    item['total_revenue'] / item['transaction_count'] if item['transaction_count'] else 0
+                ),
+                'transaction_count': item['transaction_count'],
+                'anomaly_count': item['anomaly_count'],
+            }
+            for item in windows.fill(results['revenue'], window, empty_revenue)
+        ]
+        segment_trend = [
+            {'period': as_period(item['period']), 'segment': item['segment'], 'count': item['count']}
+            for item in results['segments']
+        ]
+        product_trend = [
+            {
+                'period': as_period(item['period']),
+                'product__category': item['category'] or None,
+                'revenue': item['revenue'],
+                'transaction_count': item['transaction_count'],
+            }
+            for item in results['products']
+        ]
+
+        summary = summarize(results['totals']['current'])
+        previous = summarize(results['totals']['previous'])
+        summary['previous_period'] = previous
+        summary['changes'] = {
+            name: windows.change(summary[name], previous[name])
+            for name in ('total_customers', 'total_revenue', 'average_transaction', 'anomaly_rate')
+        }
+        # Growth runs between the first and last buckets with revenue, not the zero-filled gaps
+        if results['revenue']:
+            first_revenue = results['revenue'][0]['total_revenue']
+            last_revenue = results['revenue'][-1]['total_revenue']
+            revenue_growth = ((last_revenue - first_revenue) / first_revenue * 100) if first_revenue else 0
+            summary['revenue_growth'] = revenue_growth
+
+        return {
+            'period': window.name,
+            'start_date': window.first_day,
+            'end_date': window.last_day,
+            'summary': summary,
+            'customer_trends': {
+                'count_trend': cumulative_customers,
+                'segment_distribution': segment_trend
+            },
+            'revenue_trends': {
+                'revenue_by_period': revenue_trend,
+                'product_performance': product_trend
+            }
+        }
+
+    return queries, build
+
+
+def customer_insights(params):
+    """
+    Plan for CustomerInsightsView: this period, or the last ``periods`` of
+    them, against the same span right before. Each side of the comparison
+    comes from one conditional aggregate; average revenue comes from the
+    transaction snapshot when there is one.
+    """
+    window = windows.from_params(params, default='week')
+    previous = window.previous()
+    load = _load_once()
+
+    def average_revenue(current):
+        return {
+            'current': snapshot.average_amount(current, window.start, window.end),
+            'previous': snapshot.average_amount(current, previous.start, previous.end),
+        }
+
+    queries = {
+        'customers': lambda: windows.compare(
+            Customer.objects.all(), 'signup_date', window, customers=(Count, 'pk'),
+        ),
+        'revenue': _snapshot_or(
+            average_revenue,
+            lambda: {
+                label: values['average']
+                for label, values in windows.compare(
+                    Transaction.objects.all(), 'transaction_date', window, average=(Avg, 'amount'),
+                ).items()
+            },
+            load,
+        ),
+    }
+
+    def build(results):
+        current_period_customers = results['customers']['current']['customers']
+        last_period_customers = results['customers']['previous']['customers']
+        avg_revenue_this_period = results['revenue']['current'] or 0
+        avg_revenue_last_period = results['revenue']['previous'] or 0
+
+        return {
+            "period": window.name,
+            "start_date": window.first_day,
+            "end_date": window.last_day,
+            "wow_change": windows.change(current_period_customers, last_period_customers),
+            "average_revenue": {
+                "current": avg_revenue_this_period,
+                "last_period": avg_revenue_last_period,
+                "revenue_change_percentage": windows.change(avg_revenue_this_period, avg_revenue_last_period),
+            },
+            "current_period_customers": current_period_customers,
+            "last_period_customers": last_period_customers,
+        }
+
+    return queries, build
@@ -0,0 +1,78 @@
+from dateutil import parser
+from django.db.models import Count, Exists, Max, OuterRef, Sum
+
+from . import search, windows
+from .models import Customer, Transaction
+
+
+class FilterError(ValueError):
+    """Raised for query parameters that cannot be applied; the message is returned to the client."""
+
+
+def annotated_customers():
+    return Customer.objects.annotate(
+        total_transactions=Count('transactions'),
+        total_spent=Sum('transactions__amount'),
+        last_transaction_date=Max('transactions__transaction_date')
+    )
+
+
+def filter_customers(params, customers=None):
+    """
+    Apply the CustomerListView query parameters to ``customers`` (the
+    annotated queryset by default).
+
+    Transaction-based filters are expressed as EXISTS subqueries so they never
+    add a second join to the aggregated transactions: customers stay unique
+    and ``total_transactions`` keeps counting every transaction.
+    """
+    if customers is None:
+        customers = annotated_customers()
+
+    segment = params.get('segment')
+    date_from = params.get('date_from')
+    date_to = params.get('date_to')
+    min_spent = params.get('min_spent')
+    has_anomalies = params.get('has_anomalies')
+    customer_name = params.get('customer_name')
+
+    # Apply filters based on segment
+    if segment:
+        customers = customers.filter(segment=segment)
+
+    # Apply filters based on the specified period for signup_date
+    window = windows.from_params(params, default='all', allow_all=True)
+    if window is not None:
+        customers = customers.filter(window.q('signup_date'))
+
+    # Apply filters based on transaction dates if provided
+    if date_from and date_to:
+        try:
+            date_from = parser.isoparse(date_from)  # Parse ISO 8601 date format
+            date_to = parser.isoparse(date_to)
+        except ValueError:
+            raise FilterError("Invalid date format")
+        customers = customers.filter(Exists(Transaction.objects.filter(
+            customer=OuterRef('pk'),
+            transaction_date__range=[date_from, date_to],
+        )))
+
+    # Apply filters based on minimum spent amount if provided
+    if min_spent:
+        try:
+            customers = customers.filter(total_spent__gte=float(min_spent))
+        except ValueError:
+            raise FilterError("Invalid amount")
+
+    # Filter customers with anomalies in transactions if specified
+    if has_anomalies is not None:  # Check for presence of the parameter
+        customers = customers.filter(Exists(Transaction.objects.filter(
+            customer=OuterRef('pk'),
+            is_anomalous=True,
+        )))
+
+    # Substring match on the name, answered by the trigram search index
+    if customer_name:
+        customers = search.filter_name(customers, customer_name)
+
+    return customers
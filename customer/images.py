@@ -0,0 +1,107 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.urls import reverse
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Longest edge of each variant; requested sizes round up to the next bucket
+SIZES = (40, 80, 160, 320)
+FORMATS = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+DEFAULT_FORMAT = 'webp'
+QUALITY = 82
+VARIANT_DIR = 'variants'
+# Variant URLs only change content when an upload is overwritten in place,
+# and the ETag catches that on revalidation
+MAX_AGE = 30 * 24 * 3600
+
+
+class ImageError(ValueError):
+    """Raised for invalid variant requests; the message is returned to the client."""
+
+
+class ImageNotFound(ImageError):
+    pass
+
+
+def bucket(size):
+    """The smallest bucket at least ``size`` pixels, capped at the largest."""
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise ImageError(f"Invalid size. Use one of {', '.join(map(str, SIZES))}.")
+    if size < 1:
+        raise ImageError(f"Invalid size. Use one of {', '.join(map(str, SIZES))}.")
+    return next((candidate for candidate in SIZES if candidate >= size), SIZES[-1])
+
+
+def variant_urls(name, image_format=DEFAULT_FORMAT):
+    """``{size: url}`` for every bucket of the image stored as ``name``; no file access."""
+    if not name:
+        return None
+    base = reverse('image-variant', kwargs={'name': name.lstrip('/')})
+    return {str(size): f"{base}?size={size}&format={image_format}" for size in SIZES}
+
+
+def source_path(name):
+    root = os.path.realpath(settings.MEDIA_ROOT)
+    path = os.path.realpath(os.path.join(root, name))
+    # Never serve anything outside MEDIA_ROOT, nor the variants themselves
+    if not path.startswith(root + os.sep) or path.startswith(os.path.join(root, VARIANT_DIR) + os.sep):
+        raise ImageNotFound("Image not found")
+    if not os.path.isfile(path):
+        raise ImageNotFound("Image not found")
+    return path
+
+
+def content_hash(path):
+    """SHA-256 of the file, cached on its path, mtime and size so a request costs one stat."""
+    stat = os.stat(path)
+    key = 'image-hash:' + hashlib.sha1(f"{path}|{stat.st_mtime_ns}|{stat.st_size}".encode()).hexdigest()
+    digest = default_cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as source:
+            for block in iter(lambda: source.read(1 << 16), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        default_cache.set(key, digest, timeout=None)
+    return digest
+
+
+def variant(name, size, image_format):
+    """
+    Return ``(path, etag, source mtime)`` of the ``size`` bucket of the
+    image stored as ``name`` in ``image_format``, rendering it on first use.
+    Variants are named after the source's content hash, so identical
+    uploads share them and a changed upload never reuses a stale one.
+    """
+    if image_format not in FORMATS:
+        raise ImageError(f"Invalid format. Use one of {', '.join(FORMATS)}.")
+    size = bucket(size)
+    path = source_path(name)
+    digest = content_hash(path)
+    target = os.path.join(settings.MEDIA_ROOT, VARIANT_DIR, digest[:2], f"{digest}-{size}.{image_format}")
+
+    if not os.path.exists(target):
+        try:
+            with Image.open(path) as image:
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((size, size), Image.LANCZOS)
+                if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # Write then rename, so concurrent requests never see a partial file
+                handle, temporary = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+                try:
+                    with os.fdopen(handle, 'wb') as output:
+                        image.save(output, format=image_format.upper(), quality=QUALITY)
+                    os.replace(temporary, target)
+                except BaseException:
+                    os.unlink(temporary)
+                    raise
+        except (UnidentifiedImageError, OSError):
+            raise ImageNotFound("Image not found")
+    return target, f"{digest[:16]}-{size}-{image_format}", os.stat(path).st_mtime
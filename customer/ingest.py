@@ -0,0 +1,186 @@
+import csv
+import json
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache, cohorts, risk, rollups, sketches, snapshot
+from .models import Customer, Product, Transaction
+
+INGEST_FORMATS = ('csv', 'ndjson')
+DEFAULT_BATCH_SIZE = 5000
+KEPT_ERRORS = 100
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+FALSE_VALUES = {'', '0', 'false', 'f', 'no', 'n'}
+
+
+class IngestResult:
+    """
+    Counts of an ingest and its first ``kept_errors`` rejects. Every reject
+    is also written to ``errors_file`` (a text stream) as a CSV row of line
+    number, error and raw row as it happens, so memory does not grow with
+    the rejects.
+    """
+
+    def __init__(self, errors_file=None, kept_errors=KEPT_ERRORS):
+        self.ingested = 0
+        self.failed = 0
+        self.errors = []  # (line number, message, raw row)
+        self.kept_errors = kept_errors
+        self._writer = None
+        if errors_file is not None:
+            self._writer = csv.writer(errors_file)
+            self._writer.writerow(['line', 'error', 'row'])
+
+    def reject(self, line_number, message, row):
+        self.failed += 1
+        if len(self.errors) < self.kept_errors:
+            self.errors.append((line_number, message, row))
+        if self._writer is not None:
+            self._writer.writerow([line_number, message, json.dumps(row, default=str)])
+
+
+def read_rows(lines, input_format):
+    """Yield ``(line_number, raw_row_dict)`` from a text stream of CSV or NDJSON."""
+    if input_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = {'_raw': line.rstrip('\n')}
+        yield line_number, row
+
+
+def _clean(field_name, value):
+    return Transaction._meta.get_field(field_name).clean(value, None)
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value if value is not None else '').strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValidationError(f"'{value}' is not a boolean")
+
+
+def _parse_id(value, name):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f"{name} must be an integer")
+
+
+def _validate(row):
+    if not isinstance(row, dict) or '_raw' in row:
+        raise ValidationError("Row is not a JSON object")
+    customer_id = _parse_id(row.get('customer_id'), 'customer_id')
+    if customer_id is None:
+        raise ValidationError("customer_id is required")
+    transaction_date = _clean('transaction_date', row.get('transaction_date'))
+    if timezone.is_naive(transaction_date):
+        transaction_date = timezone.make_aware(transaction_date)
+    return {
+        'customer_id': customer_id,
+        'product_id': _parse_id(row.get('product_id'), 'product_id'),
+        'amount': _clean('amount', row.get('amount')),
+        'transaction_date': transaction_date,
+        'is_anomalous': _parse_bool(row.get('is_anomalous', False)),
+    }
+
+
+def _error_message(exc):
+    return '; '.join(exc.messages) if isinstance(exc, ValidationError) else str(exc)
+
+
+def ingest_batch(numbered_rows, result):
+    valid = []
+    for line_number, row in numbered_rows:
+        try:
+            valid.append((line_number, row, _validate(row)))
+        except ValidationError as exc:
+            result.reject(line_number, _error_message(exc), row)
+
+    # One lookup per batch for each foreign key
+    segments = dict(
+        Customer.objects.filter(customer_id__in={values['customer_id'] for _, _, values in valid})
+        .values_list('customer_id', 'segment')
+    )
+    products = {
+        product_id: (category, risk_factor)
+        for product_id, category, risk_factor in Product.objects.filter(
+            product_id__in={values['product_id'] for _, _, values in valid if values['product_id']}
+        ).values_list('product_id', 'category', 'risk_factor')
+    }
+
+    objects = []
+    rollup_rows = []
+    for line_number, row, values in valid:
+        if values['customer_id'] not in segments:
+            result.reject(line_number, f"Customer {values['customer_id']} does not exist", row)
+            continue
+        if values['product_id'] and values['product_id'] not in products:
+            result.reject(line_number, f"Product {values['product_id']} does not exist", row)
+            continue
+        objects.append(Transaction(**values))
+        category, risk_factor = products.get(values['product_id'], (None, None))
+        rollup_rows.append({
+            **values,
+            'segment': segments[values['customer_id']],
+            'category': category,
+            'risk_factor': risk_factor,
+        })
+
+    if not objects:
+        return
+    # bulk_create skips the model signals, so the rollups, sketches, cohort
+    # activity, risk exposures and the analytics cache version are maintained
+    # here, once per batch
+    with transaction.atomic():
+        Transaction.objects.bulk_create(objects, batch_size=len(objects))
+        rollups.record_transactions(rollup_rows)
+        sketches.record_transactions(rollup_rows)
+        cohorts.record_transactions(rollup_rows)
+        risk.record_transactions(rollup_rows)
+        snapshot.schedule_refresh()
+        cache.bump_data_version()
+    result.ingested += len(objects)
+
+
+def ingest(lines, input_format, batch_size=DEFAULT_BATCH_SIZE, on_batch=None, result=None):
+    """
+    Validate and insert transactions from a CSV/NDJSON text stream in batches
+    of ``batch_size`` rows, each batch in its own database transaction.
+    Columns: customer_id, product_id (optional), amount, transaction_date,
+    is_anomalous (optional). Rejects are recorded on ``result`` (a new
+    IngestResult by default). A stream that cannot be decoded or parsed
+    raises UnicodeDecodeError or csv.Error, with the batches before it
+    already committed and counted on ``result``.
+    """
+    if input_format not in INGEST_FORMATS:
+        raise ValueError(f"Unsupported format '{input_format}'")
+
+    result = result or IngestResult()
+    rows = read_rows(lines, input_format)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        ingest_batch(batch, result)
+        if on_batch:
+            on_batch(result)
+    return result
@@ -0,0 +1,304 @@
+"""
+Background jobs for reports too slow to compute within a request.
+
+Jobs are rows of the Job table; no broker is involved. A view submits one
+with ``submit()``, which validates the parameters right away, and answers
+with its id. ``manage.py run_jobs`` claims queued jobs and runs them in a
+process pool: each job's output is written gzip-compressed to
+``CUSTOMER_JOBS['DIR']`` and served from there until it expires.
+
+Workers report progress on the job row as they go. Cancelling sets the
+status to cancelled, and a running job stops at its next progress report.
+While a job runs the worker command keeps its heartbeat fresh; a job whose
+heartbeat is older than ``STALE_AFTER_SECONDS`` lost its worker and is
+marked failed.
+"""
+import gzip
+import logging
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+from multiprocessing import get_context
+
+import django
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from . import dashboards, exports
+from .filters import FilterError
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED, EXPIRED = 'queued', 'running', 'succeeded', 'failed', 'cancelled', 'expired'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+DEFAULT_CONFIG = {
+    'DIR': None,  # BASE_DIR / 'job_results'
+    'WORKERS': 2,
+    'POLL_SECONDS': 1.0,
+    'RESULT_TTL_SECONDS': 24 * 3600,
+    'STALE_AFTER_SECONDS': 60,
+    'PROGRESS_INTERVAL_SECONDS': 1.0,
+}
+
+
+def get_config():
+    config = {**DEFAULT_CONFIG, **getattr(settings, 'CUSTOMER_JOBS', {})}
+    config['DIR'] = str(config['DIR'] or settings.BASE_DIR / 'job_results')
+    return config
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job that was cancelled in the meantime."""
+
+
+# Job kinds: ``prepare(params)`` validates the parameters, raising
+# FilterError, and returns ``(content type, filename, produce)``, where
+# ``produce(report)`` yields the result as bytes and calls
+# ``report(done, total)`` along the way.
+
+def _revenue_trends(params):
+    queries, build = dashboards.revenue_trends(params)
+
+    def produce(report):
+        results = {}
+        for done, (name, query) in enumerate(queries.items()):
+            report(done, len(queries))
+            results[name] = query()
+        # Same bytes as the RevenueTrendsView response
+        yield JSONRenderer().render(build(results))
+
+    return 'application/json', '', produce
+
+
+def _customer_export(params):
+    export_format = params.get('output', 'csv')
+    if export_format not in exports.EXPORT_FORMATS:
+        raise FilterError("Invalid output format. Use csv or ndjson")
+    customers = exports.export_queryset(params)
+
+    def produce(report):
+        total = customers.count()
+
+        def rows():
+            # One query per page, so no read stays open across the progress
+            # writes (SQLite would lock those out)
+            done, last = 0, 0
+            while True:
+                report(done, total)
+                page = list(exports.export_rows(customers.filter(customer_id__gt=last)[:exports.CHUNK_SIZE]))
+                if not page:
+                    return
+                yield from page
+                done += len(page)
+                last = page[-1]['customer_id']
+
+        for line in exports.render(rows(), export_format):
+            yield line.encode()
+
+    return exports.EXPORT_FORMATS[export_format], f'customers.{export_format}', produce
+
+
+KINDS = {
+    'revenue-trends': _revenue_trends,
+    'customer-export': _customer_export,
+}
+
+
+def submit(kind, params):
+    """Queue a ``kind`` job for ``params`` (a dict or QueryDict); raises FilterError for invalid parameters."""
+    params = {name: value for name, value in params.items() if name != 'background'}
+    KINDS[kind](params)
+    return Job.objects.create(kind=kind, params=params)
+
+
+def describe(job):
+    return {
+        'id': str(job.pk),
+        'kind': job.kind,
+        'params': job.params,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'result_size': job.result_size,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'expires_at': job.expires_at,
+    }
+
+
+def result_path(job_id):
+    return os.path.join(get_config()['DIR'], f'{job_id}.gz')
+
+
+def read_result(path, chunk_size=64 * 1024):
+    """Yield the decompressed result stored at ``path``."""
+    with gzip.open(path, 'rb') as stored:
+        while chunk := stored.read(chunk_size):
+            yield chunk
+
+
+def cancel(job):
+    """Cancel ``job`` unless it already finished; returns whether it was."""
+    cancelled = Job.objects.filter(pk=job.pk, status__in=(QUEUED, RUNNING)).update(
+        status=CANCELLED, finished_at=timezone.now(),
+        expires_at=timezone.now() + timedelta(seconds=get_config()['RESULT_TTL_SECONDS']),
+    )
+    job.refresh_from_db()
+    return bool(cancelled)
+
+
+def _reporter(job_id, interval):
+    last = [0.0]
+
+    def report(done, total):
+        now = time.monotonic()
+        if now - last[0] < interval:
+            return
+        last[0] = now
+        try:
+            # Updates only a running job, so a cancelled one is noticed in the same query
+            updated = Job.objects.filter(pk=job_id, status=RUNNING).update(
+                progress=min(done / total, 1.0) if total else 0.0, heartbeat_at=timezone.now(),
+            )
+        except DatabaseError:
+            # Progress is best effort, e.g. while another process holds an SQLite write lock
+            logger.warning("Could not report progress of job %s", job_id, exc_info=True)
+            return
+        if not updated:
+            raise JobCancelled
+
+    return report
+
+
+def _finish(job_id, status, **fields):
+    now = timezone.now()
+    return Job.objects.filter(pk=job_id, status=RUNNING).update(
+        status=status, finished_at=now,
+        expires_at=now + timedelta(seconds=get_config()['RESULT_TTL_SECONDS']),
+        **fields,
+    )
+
+
+def execute(job_id):
+    """Run a claimed job and store its result; returns its final status."""
+    config = get_config()
+    job = Job.objects.get(pk=job_id)
+    path = result_path(job_id)
+    partial = path + '.tmp'
+    try:
+        content_type, filename, produce = KINDS[job.kind](job.params)
+        os.makedirs(config['DIR'], exist_ok=True)
+        with gzip.open(partial, 'wb') as output:
+            for chunk in produce(_reporter(job_id, config['PROGRESS_INTERVAL_SECONDS'])):
+                output.write(chunk)
+        os.replace(partial, path)
+    except JobCancelled:
+        status = CANCELLED
+    except Exception as exc:
+        logger.exception("Job %s (%s) failed", job_id, job.kind)
+        status = FAILED if _finish(job_id, FAILED, error=f"{type(exc).__name__}: {exc}") else CANCELLED
+    else:
+        finished = _finish(
+            job_id, SUCCEEDED, progress=1.0, content_type=content_type, filename=filename,
+            result_size=os.path.getsize(path),
+        )
+        status = SUCCEEDED if finished else CANCELLED
+    if status != SUCCEEDED:
+        for leftover in (partial, path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return status
+
+
+def _execute_in_worker(job_id):
+    try:
+        return execute(job_id)
+    finally:
+        connections.close_all()
+
+
+def claim(worker):
+    """Mark the oldest queued job as running for ``worker``; returns its id or None."""
+    while True:
+        job_id = Job.objects.filter(status=QUEUED).order_by('created_at').values_list('pk', flat=True).first()
+        if job_id is None:
+            return None
+        now = timezone.now()
+        # Another worker may claim the same job; only one update matches
+        if Job.objects.filter(pk=job_id, status=QUEUED).update(
+            status=RUNNING, worker=worker, started_at=now, heartbeat_at=now,
+        ):
+            return job_id
+
+
+def recover():
+    """Fail running jobs whose worker stopped sending heartbeats."""
+    cutoff = timezone.now() - timedelta(seconds=get_config()['STALE_AFTER_SECONDS'])
+    stale = list(Job.objects.filter(status=RUNNING, heartbeat_at__lt=cutoff).values_list('pk', flat=True))
+    for job_id in stale:
+        _finish(job_id, FAILED, error="The worker running this job stopped")
+    return len(stale)
+
+
+def expire(now=None):
+    """Delete the results of jobs past their expiry; returns the number of jobs expired."""
+    now = now or timezone.now()
+    expired = list(Job.objects.filter(status__in=FINISHED, expires_at__lte=now).values_list('pk', flat=True))
+    for job_id in expired:
+        if os.path.exists(result_path(job_id)):
+            os.remove(result_path(job_id))
+    Job.objects.filter(pk__in=expired).update(status=EXPIRED)
+    return len(expired)
+
+
+def work(workers=None, once=False, poll=None, on_event=None):
+    """
+    Run queued jobs in a pool of ``workers`` processes until interrupted, or
+    with ``once`` until the queue is empty. ``on_event(job_id, status)`` is
+    called when a job starts ('running') and when it finishes.
+    """
+    config = get_config()
+    workers = workers or config['WORKERS']
+    poll = config['POLL_SECONDS'] if poll is None else poll
+    name = f'{socket.gethostname()}:{os.getpid()}'
+    on_event = on_event or (lambda job_id, status: None)
+    # Spawned, not forked: the children must not share this process's connections
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'), initializer=django.setup) as pool:
+        running = {}
+        while True:
+            try:
+                recover()
+                expire()
+                if running:
+                    Job.objects.filter(pk__in=running.values(), status=RUNNING).update(heartbeat_at=timezone.now())
+            except DatabaseError:
+                # Retried on the next round, well within STALE_AFTER_SECONDS
+                logger.warning("Job housekeeping failed", exc_info=True)
+            while len(running) < workers:
+                job_id = claim(name)
+                if job_id is None:
+                    break
+                running[pool.submit(_execute_in_worker, job_id)] = job_id
+                on_event(job_id, RUNNING)
+            if not running:
+                if once:
+                    return
+                time.sleep(poll)
+                continue
+            done, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+            for future in done:
+                job_id = running.pop(future)
+                try:
+                    status = future.result()
+                except Exception as exc:
+                    # The worker process itself died
+                    _finish(job_id, FAILED, error=f"{type(exc).__name__}: {exc}")
+                    status = FAILED
+                on_event(job_id, status)
@@ -0,0 +1,95 @@
+import json
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from customer.benchmarks import measure, route_requests, uncached_settings
+from customer.models import Customer, Transaction
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Request every GET route in customer.urls (and its parameter variants) against the configured "
+        "database and write latency percentiles, query counts, response sizes and peak memory to JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help="Timed requests per route and parameter set.")
+        parser.add_argument('--output', default='benchmark-results.json')
+        parser.add_argument('--compare', help="Earlier results file to print p50 and query count changes against.")
+        parser.add_argument('--route', action='append', help="Only benchmark these route names (repeatable).")
+        parser.add_argument('--cached', action='store_true', help="Keep the analytics cache enabled.")
+
+    def handle(self, *args, **options):
+        baseline = {}
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as baseline_file:
+                    baseline = {(row['route'], row['params']): row for row in json.load(baseline_file)['results']}
+            except (OSError, ValueError, KeyError) as exc:
+                raise CommandError(f"Cannot read {options['compare']}: {exc}")
+
+        try:
+            requests = [
+                request for request in route_requests()
+                if not options['route'] or request[0] in options['route']
+            ]
+        except LookupError as exc:
+            raise CommandError(str(exc))
+
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+        if not options['cached']:
+            overrides = uncached_settings()
+
+        client = Client()
+        results = []
+        with override_settings(**overrides):
+            for name, url, params in requests:
+                params_key = '&'.join(f"{key}={value}" for key, value in sorted(params.items()))
+                result = {'route': name, 'params': params_key, 'url': url, **measure(client, url, params, options['repeat'])}
+                results.append(result)
+
+                line = (
+                    f"{name:<28} {params_key[:40]:<40} {result['status']} "
+                    f"p50 {result['p50_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms  "
+                    f"{result['queries']:3d} queries  {result['peak_memory_kb']:10.1f} KiB"
+                )
+                previous = baseline.get((name, params_key))
+                if previous:
+                    line += (
+                        f"  (p50 {result['p50_ms'] - previous['p50_ms']:+.2f} ms, "
+                        f"queries {result['queries'] - previous['queries']:+d})"
+                    )
+                self.stdout.write(line)
+
+        report = {
+            'meta': {
+                'commit': _commit(),
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'customers': Customer.objects.count(),
+                'transactions': Transaction.objects.count(),
+                'repeat': options['repeat'],
+                'cached': options['cached'],
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+            output.write('\n')
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}."))
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from customer.benchmarks import uncached_settings
+
+# name: (sync url, async url, period= values cycled through)
+ENDPOINTS = {
+    'revenue-trends': ('/api/revenue/trends/', '/api/async/revenue/trends/', ('day', 'week', 'month', 'year')),
+    'customer-insights': ('/api/customers/insights/', '/api/async/customers/insights/', ('day', 'week', 'month')),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare p50/p99 latency of the sync dashboard views, under the WSGI and the ASGI "
+        "handler, with their async variants, in-process and with the analytics cache bypassed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and path.")
+        parser.add_argument('--cached', action='store_true', help="Keep the analytics cache enabled.")
+
+    def handle(self, *args, **options):
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+        if not options['cached']:
+            overrides = uncached_settings()
+
+        count = options['requests']
+        with override_settings(**overrides):
+            for name, (sync_url, async_url, periods) in ENDPOINTS.items():
+                params = [{'period': period} for period in periods]
+                # The sync view under ASGI isolates the handler overhead from the fan-out
+                results = (
+                    ('sync/wsgi', self.time_sync(sync_url, params, count)),
+                    ('sync/asgi', asyncio.run(self.time_async(sync_url, params, count))),
+                    ('async/asgi', asyncio.run(self.time_async(async_url, params, count))),
+                )
+                for label, times in results:
+                    p50, p99 = np.percentile(times, [50, 99])
+                    self.stdout.write(f"{name:<18} {label:<11} p50 {p50:8.2f} ms   p99 {p99:8.2f} ms")
+
+    def time_sync(self, url, params, count):
+        client = Client()
+        client.get(url, params[0])  # warm up
+        times = []
+        for index in range(count):
+            started = time.perf_counter()
+            client.get(url, params[index % len(params)])
+            times.append((time.perf_counter() - started) * 1000)
+        return times
+
+    async def time_async(self, url, params, count):
+        client = AsyncClient()
+        await client.get(url, params[0])  # warm up
+        times = []
+        for index in range(count):
+            started = time.perf_counter()
+            await client.get(url, params[index % len(params)])
+            times.append((time.perf_counter() - started) * 1000)
+        return times
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from customer import cohorts
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the cohort activity tables for new and stale months, or all of them with --full. "
+        "Retention reads only rebuild the most recent ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rebuild every month in one pass over all transactions.")
+
+    def handle(self, *args, **options):
+        months = cohorts.rebuild() if options['full'] else cohorts.refresh()
+        self.stdout.write(self.style.SUCCESS(f"Built cohort activity for {months} month(s)."))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from customer import recommendations
+
+
+class Command(BaseCommand):
+    help = "Rebuild the top-N RecommendedService rows for every customer from product co-occurrence."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-n', type=int, default=recommendations.DEFAULT_TOP_N)
+        parser.add_argument('--chunk-size', type=int, default=recommendations.DEFAULT_CHUNK_SIZE,
+                            help="Customers scored per block.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        customers = recommendations.build(top_n=options['top_n'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote recommendations for {customers} customers in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,64 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from customer.benchmarks import fetch, route_requests
+
+# (EXPLAIN prefix, pattern matching a plan line that walks a whole table).
+# A SQLite "SCAN x USING INDEX" still visits every row, only in index order.
+EXPLAIN_SYNTAX = {
+    'sqlite': ('EXPLAIN QUERY PLAN ', re.compile(r'\bSCAN (?!CONSTANT ROW|\()\S+.*')),
+    'postgresql': ('EXPLAIN ', re.compile(r'Seq Scan on \S+')),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Request every customer API route against the configured (seeded) database, "
+        "EXPLAIN each SQL query it issues and report full scans."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail-on-scan', action='store_true', help="Exit with an error if any full scan is found.")
+        parser.add_argument('--verbose-plans', action='store_true', help="Print the full plan of every query.")
+
+    def handle(self, *args, **options):
+        if connection.vendor not in EXPLAIN_SYNTAX:
+            raise CommandError(f"EXPLAIN parsing is not supported for the '{connection.vendor}' backend.")
+        prefix, scan_pattern = EXPLAIN_SYNTAX[connection.vendor]
+
+        try:
+            requests = list(route_requests())
+        except LookupError as exc:
+            raise CommandError(str(exc))
+
+        client = Client(HTTP_HOST='localhost')
+        scans = 0
+        for name, url, params in requests:
+            with CaptureQueriesContext(connection) as ctx:
+                response, _ = fetch(client, url, params)
+            queries = ctx.captured_queries
+
+            self.stdout.write(f"{name} {params or ''} -> {response.status_code}, {len(queries)} queries")
+            for query in queries:
+                with connection.cursor() as cursor:
+                    cursor.execute(prefix + query['sql'])
+                    plan = [' '.join(str(col) for col in row) for row in cursor.fetchall()]
+                full_scans = [match.group(0) for match in map(scan_pattern.search, plan) if match]
+                if full_scans:
+                    scans += 1
+                    self.stdout.write(self.style.WARNING(f"  {'; '.join(full_scans)}: {query['sql'][:160]}"))
+                if options['verbose_plans']:
+                    for line in plan:
+                        self.stdout.write(f"    {line}")
+
+        if scans:
+            message = f"{scans} quer{'y' if scans == 1 else 'ies'} with full scans."
+            if options['fail_on_scan']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS("No full scans found."))
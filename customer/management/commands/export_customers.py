@@ -0,0 +1,48 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from customer import exports, windows
+from customer.filters import FilterError
+
+
+class Command(BaseCommand):
+    help = "Stream customers with their transaction aggregates to CSV or NDJSON, using the CustomerListView filters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-format', choices=sorted(exports.EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help="File to write to. Defaults to stdout.")
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE)
+        parser.add_argument('--segment')
+        parser.add_argument('--date-from', help="ISO 8601 datetime; requires --date-to.")
+        parser.add_argument('--date-to', help="ISO 8601 datetime; requires --date-from.")
+        parser.add_argument('--min-spent')
+        parser.add_argument('--has-anomalies', action='store_true')
+        parser.add_argument('--period', default='all', choices=windows.PERIODS + ('custom', 'all'),
+                            help="Signup period; custom takes --start-date and --end-date.")
+        parser.add_argument('--periods', type=int, help="How many periods back, the current one included.")
+        parser.add_argument('--start-date', help="YYYY-MM-DD; first signup day of a custom period.")
+        parser.add_argument('--end-date', help="YYYY-MM-DD; last signup day of a custom period.")
+        parser.add_argument('--customer-name')
+
+    def handle(self, *args, **options):
+        params = {
+            name: options[name]
+            for name in ('segment', 'date_from', 'date_to', 'min_spent', 'period', 'periods', 'start_date', 'end_date',
+                         'customer_name')
+            if options[name]
+        }
+        if options['has_anomalies']:
+            params['has_anomalies'] = 'true'
+
+        try:
+            customers = exports.export_queryset(params)
+        except FilterError as exc:
+            raise CommandError(str(exc))
+
+        chunks = exports.render(exports.export_rows(customers, chunk_size=options['chunk_size']), options['output_format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(chunks)
+        else:
+            sys.stdout.writelines(chunks)
@@ -0,0 +1,54 @@
+import csv
+import time
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+
+from customer import ingest
+
+
+class Command(BaseCommand):
+    help = "Bulk load transactions from a CSV or NDJSON file in batched inserts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or NDJSON file of transactions.")
+        parser.add_argument('--input-format', choices=ingest.INGEST_FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=ingest.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--errors-file', help="Write rejected rows with their line number and reason to this CSV file as they come.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['input_format'] or path.rsplit('.', 1)[-1].lower()
+        if input_format not in ingest.INGEST_FORMATS:
+            raise CommandError("Cannot tell the file format from its extension; pass --input-format")
+
+        started = time.monotonic()
+
+        def report(result):
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"{result.ingested} rows ingested, {result.failed} rejected "
+                f"({result.ingested / elapsed if elapsed else 0:.0f} rows/sec)"
+            )
+
+        errors_path = options['errors_file']
+        try:
+            with ExitStack() as files:
+                lines = files.enter_context(open(path, newline='', encoding='utf-8'))
+                errors_file = None
+                if errors_path:
+                    errors_file = files.enter_context(open(errors_path, 'w', newline='', encoding='utf-8'))
+                result = ingest.IngestResult(errors_file=errors_file)
+                ingest.ingest(lines, input_format, batch_size=options['batch_size'], on_batch=report, result=result)
+        except OSError as exc:
+            raise CommandError(str(exc))
+        except (UnicodeDecodeError, csv.Error) as exc:
+            raise CommandError(
+                f"Could not read {path}: {exc}. {result.ingested} rows were ingested before that, {result.failed} rejected."
+            )
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {result.ingested} rows ingested, {result.failed} rejected in {elapsed:.1f}s "
+            f"({result.ingested / elapsed if elapsed else 0:.0f} rows/sec)."
+        ))
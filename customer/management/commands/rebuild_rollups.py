@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from customer import rollups
+
+
+def _parse_day(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f"Invalid date '{value}'. Use YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily revenue/customer rollups from the raw Customer and Transaction tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day to rebuild (YYYY-MM-DD). Defaults to the beginning of history.")
+        parser.add_argument('--end', help="Last day to rebuild (YYYY-MM-DD). Defaults to today.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = _parse_day(options['start']) if options['start'] else None
+        end = _parse_day(options['end']) if options['end'] else None
+        if start and end and start > end:
+            raise CommandError("--start must not be after --end")
+
+        days = rollups.rebuild(start, end, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups for {days} day(s)."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from customer import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the customer search index, e.g. after customers were written without signals."
+
+    def handle(self, *args, **options):
+        indexed = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} customer(s)."))
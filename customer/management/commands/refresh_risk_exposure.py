@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from customer import risk
+
+
+class Command(BaseCommand):
+    help = "Recompute the materialized product risk exposure of every customer from their transactions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=risk.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        written = risk.refresh(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {written} exposures in {time.monotonic() - started:.1f}s."))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from customer import snapshot
+from customer.models import Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Bring the memory-mapped transaction snapshot up to date: re-export the segments with "
+        "changed or deleted rows and append new transactions, or rebuild it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Export every transaction again.")
+        parser.add_argument(
+            '--verify', action='store_true',
+            help="Rebuild when the exported row count no longer matches the table, e.g. after "
+                 "transactions committed out of id order on a concurrent database.",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        meta, rebuilt = snapshot.refresh(force_rebuild=options['rebuild'])
+        if options['verify'] and not rebuilt:
+            if Transaction.objects.filter(transaction_id__lte=meta['last_id']).count() != meta['rows']:
+                meta, rebuilt = snapshot.rebuild(), True
+        action = "Rebuilt" if rebuilt else "Updated"
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} the snapshot: {meta['rows']} transactions up to id {meta['last_id']} "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
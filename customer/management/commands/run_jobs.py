@@ -0,0 +1,30 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from customer import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (reports submitted with background=true) in a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help="Processes running jobs (default CUSTOMER_JOBS['WORKERS']).")
+        parser.add_argument('--poll', type=float, help="Seconds between checks for new jobs.")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        def on_event(job_id, status):
+            line = f"{job_id}: {status}"
+            if status == jobs.SUCCEEDED:
+                line = self.style.SUCCESS(line)
+            elif status == jobs.FAILED:
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+
+        # Stop on SIGTERM like on Ctrl-C: the pool shuts down with the command
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            jobs.work(workers=options['workers'], once=options['once'], poll=options['poll'], on_event=on_event)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
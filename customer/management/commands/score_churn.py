@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from customer import churn
+
+
+class Command(BaseCommand):
+    help = (
+        "Score churn probability for every customer from RFM features and append it to the score history, "
+        "keeping the latest CUSTOMER_CHURN['KEEP_RUNS'] runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=churn.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        scored = churn.score_all(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Scored {scored} customers in {time.monotonic() - started:.1f}s."))
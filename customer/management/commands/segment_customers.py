@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from customer import segmentation
+
+
+class Command(BaseCommand):
+    help = "Assign Customer.segment from recency/frequency/monetary quantiles, writing only changed rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help="Re-score only customers created or transacting since the last run.")
+        parser.add_argument('--dry-run', action='store_true', help="Report changes without writing them.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        run = segmentation.run(incremental=options['incremental'], dry_run=options['dry_run'])
+        mode = "incremental" if run.incremental else "full"
+        verb = "Would change" if options['dry_run'] else "Changed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {run.changed} of {run.scored} customers ({mode} run) in {time.monotonic() - started:.1f}s."
+        ))
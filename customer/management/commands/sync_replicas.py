@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from customer import replicas
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a replica heartbeat on the primary and copy the primary onto every SQLite replica in "
+        "CUSTOMER_REPLICAS['DATABASES']. Other replicas replicate by themselves and only need the heartbeat."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help="Repeat every this many seconds until interrupted.")
+
+    def handle(self, *args, **options):
+        aliases = replicas.get_config()['DATABASES']
+        if not aliases:
+            raise CommandError("No replicas configured in CUSTOMER_REPLICAS['DATABASES'].")
+        while True:
+            started = time.monotonic()
+            # Before the copy, so a replica's lag never reads lower than it is
+            replicas.heartbeat()
+            for alias in aliases:
+                if connections[alias].vendor == 'sqlite' and connections['default'].vendor == 'sqlite':
+                    replicas.copy_sqlite(alias)
+                    self.stdout.write(f"Copied the primary to {alias} in {time.monotonic() - started:.1f}s.")
+            if not options['interval']:
+                break
+            time.sleep(max(options['interval'] - (time.monotonic() - started), 0))
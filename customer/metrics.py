@@ -0,0 +1,108 @@
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label_names = label_names
+        self._series = {}  # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                    cumulative += bucket_count
+                    le = bound if bound == '+Inf' else _number(bound)
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, [('le', le)])} {cumulative}")
+                labels = _labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {_number(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# Per process: with several workers, scrape each one (or aggregate upstream)
+REQUESTS = Counter('customer_requests_total', "Requests by route, method and status.", ('route', 'method', 'status'))
+DURATION = Histogram('customer_request_duration_seconds', "Total request time.", DURATION_BUCKETS, ('route',))
+DB_TIME = Histogram('customer_request_db_seconds', "Time spent in SQL queries per request.", DURATION_BUCKETS, ('route',))
+RENDER_TIME = Histogram('customer_request_render_seconds', "Response rendering (serialization) time per request.",
+                        DURATION_BUCKETS, ('route',))
+QUERIES = Histogram('customer_request_queries', "SQL queries per request.", QUERY_BUCKETS, ('route',))
+SLOW_QUERIES = Counter('customer_slow_queries_total', "Queries slower than the configured threshold.", ('route',))
+SNAPSHOT_READS = Counter(
+    'customer_snapshot_reads_total',
+    "Transaction snapshot loads: served from it (in part from the database) or falling back to the database.",
+    ('outcome',),
+)
+
+REGISTRY = (REQUESTS, DURATION, DB_TIME, RENDER_TIME, QUERIES, SLOW_QUERIES, SNAPSHOT_READS)
+
+
+def observe_request(route, method, status, total, db_time, queries, render_time):
+    REQUESTS.inc(route, method, status)
+    DURATION.observe(total, route)
+    DB_TIME.observe(db_time, route)
+    RENDER_TIME.observe(render_time, route)
+    QUERIES.observe(queries, route)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,237 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import metrics, replicas
+
+logger = logging.getLogger('customer.instrumentation')
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'SLOW_QUERY_MS': 200,
+}
+
+
+def get_config():
+    return {**DEFAULT_CONFIG, **getattr(settings, 'CUSTOMER_INSTRUMENTATION', {})}
+
+
+# The RequestStats of the request being handled; contextvars follow it into
+# sync_to_async executor threads
+_current_stats = ContextVar('customer_request_stats', default=None)
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.route
+
+
+class RequestStats:
+    def __init__(self, request, slow_query_seconds):
+        self.request = request
+        self.slow_query_seconds = slow_query_seconds
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_started = None
+        self.render_time = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.queries += 1
+                self.db_time += elapsed
+            if elapsed >= self.slow_query_seconds:
+                route = route_name(self.request)
+                metrics.SLOW_QUERIES.inc(route)
+                logger.warning("Slow query (%.1f ms) in %s %s: %s", elapsed * 1000, self.request.method, route, sql)
+
+    def rendered(self, response):
+        self.render_time = time.perf_counter() - self.render_started
+
+    @contextmanager
+    def measuring(self):
+        """Count the queries run in this context while inside."""
+        # Connections opened before the middleware was loaded missed connection_created
+        for alias in connections:
+            _instrument(connections[alias])
+        token = _current_stats.set(self)
+        try:
+            yield
+        finally:
+            _current_stats.reset(token)
+
+
+def _execute(execute, sql, params, many, context):
+    # Installed once on every connection, in whichever thread opens it, and
+    # counts towards the request of the calling context. Async views run
+    # their queries in executor threads, so this can't be installed per
+    # request like connection.execute_wrapper() is meant to be
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def _instrument(connection, **kwargs):
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def measure_queries():
+    """
+    Count the queries run inside towards the current request, if it is
+    instrumented; for work the request hands to other threads, such as the
+    dashboard executor.
+    """
+    stats = _current_stats.get()
+    return nullcontext() if stats is None else stats.measuring()
+
+
+class _MeasuredStream:
+    # Streamed content keeps counting queries while the server iterates it,
+    # and reports the request once the response is closed
+    def __init__(self, content, stats, finish):
+        self.iterator = iter(content)
+        self.stats = stats
+        self.finish = finish
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.stats.measuring():
+            return next(self.iterator)
+
+    def close(self):
+        finish, self.finish = self.finish, None
+        if finish is not None:
+            finish()
+
+
+class InstrumentationMiddleware:
+    """
+    Count queries and time the database, response rendering and the whole
+    request. Adds a Server-Timing header, feeds the per-route histograms
+    served by the metrics endpoint and logs queries slower than
+    CUSTOMER_INSTRUMENTATION['SLOW_QUERY_MS'].
+
+    With CUSTOMER_INSTRUMENTATION['ENABLED'] false Django drops the
+    middleware at startup, so it costs nothing.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = config['SERVER_TIMING']
+        self.slow_query_seconds = config['SLOW_QUERY_MS'] / 1000
+        connection_created.connect(_instrument, dispatch_uid='customer_instrumentation')
+        # Under ASGI the stack stays async, and async views skip the thread hop
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        stats = request._instrumentation = RequestStats(request, self.slow_query_seconds)
+        with stats.measuring():
+            response = self.get_response(request)
+        return self.report(request, response, stats, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        stats = request._instrumentation = RequestStats(request, self.slow_query_seconds)
+        # The view's queries run in executor threads, whose connections are
+        # instrumented as they open
+        token = _current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.report(request, response, stats, started)
+
+    def report(self, request, response, stats, started):
+        total = time.perf_counter() - started
+
+        def finish():
+            metrics.observe_request(
+                route_name(request), request.method, response.status_code,
+                time.perf_counter() - started, stats.db_time, stats.queries, stats.render_time,
+            )
+
+        if response.streaming and not response.is_async:
+            # Measured until the server closes the response; Server-Timing,
+            # sent before the body, covers the view only
+            response.streaming_content = _MeasuredStream(response.streaming_content, stats, finish)
+        else:
+            finish()
+        if self.server_timing:
+            response['Server-Timing'] = (
+                f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+                f'render;dur={stats.render_time * 1000:.2f}, '
+                f'total;dur={total * 1000:.2f}'
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # Runs right before DRF renders the response data
+        stats = getattr(request, '_instrumentation', None)
+        if stats is not None:
+            stats.render_started = time.perf_counter()
+            response.add_post_render_callback(stats.rendered)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """
+    After a successful write request, pin the client's replica_reads views
+    to the primary for CUSTOMER_REPLICAS['MAX_LAG_SECONDS'], by when any
+    replica still in use has its writes. Dropped without replicas.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = replicas.get_config()
+        if not config['DATABASES']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.max_age = config['MAX_LAG_SECONDS']
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.pin(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.pin(request, await self.get_response(request))
+
+    def pin(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            response.set_cookie(replicas.PIN_COOKIE, '1', max_age=self.max_age, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Customer',
+            fields=[
+                ('customer_id', models.AutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('email', models.EmailField(max_length=254, unique=True)),
+                ('phone_number', models.CharField(max_length=15)),
+                ('address', models.TextField()),
+                ('date_of_birth', models.DateField()),
+                ('signup_date', models.DateTimeField(auto_now_add=True)),
+                ('segment', models.CharField(choices=[('High', 'High Value'), ('Low', 'Low Value'), ('Barely', 'Barely Active')], max_length=50)),
+                ('profile_image', models.ImageField(blank=True, default='customer_images/default.jpg', null=True, upload_to='customer_images/')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('product_id', models.AutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('description', models.TextField()),
+                ('category', models.CharField(choices=[('Loan', 'Loan'), ('Deposit', 'Deposit'), ('Banking', 'Mobile Banking')], max_length=50)),
+                ('risk_factor', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='products', to='customer.customer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecommendedService',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_name', models.CharField(max_length=100)),
+                ('recommendation_reason', models.TextField()),
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_service', to='customer.customer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Transaction',
+            fields=[
+                ('transaction_id', models.AutoField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('transaction_date', models.DateTimeField()),
+                ('is_anomalous', models.BooleanField(default=False)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='customer.customer')),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='customer.product')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0004_data_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChurnScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scored_at', models.DateTimeField()),
+                ('probability', models.FloatField()),
+                ('recency_days', models.FloatField()),
+                ('frequency', models.IntegerField()),
+                ('monetary', models.DecimalField(decimal_places=2, max_digits=18)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='churn_scores', to='customer.customer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', '-scored_at'], name='churn_customer_scored_idx')],
+            },
+        ),
+    ]
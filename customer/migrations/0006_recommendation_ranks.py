@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0005_churn_score'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recommendedservice',
+            options={'ordering': ['customer', 'rank']},
+        ),
+        migrations.AddField(
+            model_name='recommendedservice',
+            name='rank',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='recommendedservice',
+            name='score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='recommendedservice',
+            name='customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_services', to='customer.customer'),
+        ),
+        migrations.AddConstraint(
+            model_name='recommendedservice',
+            constraint=models.UniqueConstraint(fields=('customer', 'rank'), name='unique_recommendation_rank'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0006_recommendation_ranks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRiskExposure',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='risk_exposure', serialize=False, to='customer.customer')),
+                ('loan_exposure', models.FloatField(null=True)),
+                ('deposit_exposure', models.FloatField(null=True)),
+                ('banking_exposure', models.FloatField(null=True)),
+                ('overall_exposure', models.FloatField(null=True)),
+                ('transaction_volume', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-overall_exposure'], name='risk_overall_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0007_product_risk_exposure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SegmentationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('incremental', models.BooleanField(default=False)),
+                ('last_customer_id', models.BigIntegerField(default=0)),
+                ('last_transaction_id', models.BigIntegerField(default=0)),
+                ('edges', models.JSONField(default=dict)),
+                ('scored', models.IntegerField(default=0)),
+                ('changed', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
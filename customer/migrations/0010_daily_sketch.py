@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0009_data_version_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('segment', models.CharField(blank=True, max_length=50)),
+                ('transaction_count', models.IntegerField(default=0)),
+                ('amounts', models.BinaryField(default=b'')),
+                ('customers', models.BinaryField(default=b'')),
+                ('stale', models.BooleanField(default=False)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'segment'), name='unique_daily_sketch')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0010_daily_sketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CohortMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('stale', models.BooleanField(default=False)),
+                ('built_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CohortActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cohort', models.DateField()),
+                ('month', models.DateField()),
+                ('segment', models.CharField(blank=True, max_length=50)),
+                ('category', models.CharField(blank=True, max_length=50)),
+                ('customers', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month'], name='cohort_activity_month')],
+                'constraints': [models.UniqueConstraint(fields=('cohort', 'month', 'segment', 'category'), name='unique_cohort_activity')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    # An FTS5 trigram index of the customers' name, email and phone; SQLite only
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    customers = schema_editor.quote_name(apps.get_model('customer', 'Customer')._meta.db_table)
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS customer_search USING fts5(name, email, phone_number, tokenize='trigram')"
+    )
+    schema_editor.execute(
+        "INSERT INTO customer_search (rowid, name, email, phone_number) "
+        f"SELECT customer_id, name, email, phone_number FROM {customers}"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS customer_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0011_cohort_activity'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
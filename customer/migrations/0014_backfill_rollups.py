@@ -0,0 +1,72 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+COUNTERS = ('new_customers', 'transaction_count', 'total_revenue', 'anomaly_count')
+
+
+def backfill_rollups(apps, schema_editor):
+    # The rollups only counted writes made after 0002_daily_rollups; count
+    # the customers and transactions that existed before as well. A frozen
+    # copy of customer.rollups.rebuild() as of this migration.
+    Customer = apps.get_model('customer', 'Customer')
+    Transaction = apps.get_model('customer', 'Transaction')
+    DailyRollup = apps.get_model('customer', 'DailyRollup')
+    DailySegmentRollup = apps.get_model('customer', 'DailySegmentRollup')
+
+    per_day = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    per_segment = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+    transactions = (
+        Transaction.objects
+        .annotate(day=TruncDate('transaction_date'))
+        .values('day', 'customer__segment', 'product__category')
+        .annotate(
+            transaction_count=Count('transaction_id'),
+            total_revenue=Sum('amount'),
+            anomaly_count=Count('transaction_id', filter=Q(is_anomalous=True)),
+        )
+        .order_by()
+    )
+    for row in transactions.iterator():
+        key = (row['day'], row['customer__segment'] or '', row['product__category'] or '')
+        for name in ('transaction_count', 'total_revenue', 'anomaly_count'):
+            per_day[row['day']][name] += row[name]
+            per_segment[key][name] += row[name]
+
+    signups = (
+        Customer.objects
+        .annotate(day=TruncDate('signup_date'))
+        .values('day', 'segment')
+        .annotate(new_customers=Count('customer_id'))
+        .order_by()
+    )
+    for row in signups.iterator():
+        per_day[row['day']]['new_customers'] += row['new_customers']
+        per_segment[(row['day'], row['segment'] or '', '')]['new_customers'] += row['new_customers']
+
+    DailyRollup.objects.all().delete()
+    DailySegmentRollup.objects.all().delete()
+    DailyRollup.objects.bulk_create(
+        (DailyRollup(day=day, **counters) for day, counters in per_day.items()), batch_size=1000,
+    )
+    DailySegmentRollup.objects.bulk_create(
+        (
+            DailySegmentRollup(day=day, segment=segment, category=category, **counters)
+            for (day, segment, category), counters in per_segment.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0013_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
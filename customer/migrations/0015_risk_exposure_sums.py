@@ -0,0 +1,118 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:31
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Abs
+
+CATEGORY_PREFIXES = {'Loan': 'loan', 'Deposit': 'deposit', 'Banking': 'banking'}
+SUM_FIELDS = ('transaction_volume', 'transaction_count', 'weighted_volume') + tuple(
+    f'{prefix}_{name}' for prefix in CATEGORY_PREFIXES.values() for name in ('volume', 'weighted')
+)
+CENT = Decimal('0.01')
+
+
+def _exposure(model, customer_id, rows):
+    sums = dict.fromkeys(SUM_FIELDS, 0)
+    for row in rows:
+        # SQLite sums decimals as floats
+        volume = Decimal(row['volume'] or 0).quantize(CENT)
+        weighted = Decimal(row['weighted'] or 0).quantize(CENT * CENT)
+        sums['transaction_count'] += row['count']
+        sums['transaction_volume'] += volume
+        sums['weighted_volume'] += weighted
+        prefix = CATEGORY_PREFIXES.get(row['product__category'])
+        if prefix:
+            sums[f'{prefix}_volume'] += volume
+            sums[f'{prefix}_weighted'] += weighted
+    exposure = model(customer_id=customer_id, **sums)
+    for prefix in CATEGORY_PREFIXES.values():
+        volume, weighted = sums[f'{prefix}_volume'], sums[f'{prefix}_weighted']
+        setattr(exposure, f'{prefix}_exposure', round(float(weighted / volume), 4) if volume else None)
+    volume = sums['transaction_volume']
+    exposure.overall_exposure = round(float(sums['weighted_volume'] / volume), 4) if volume else None
+    return exposure
+
+
+def backfill_sums(apps, schema_editor):
+    # Recompute the rows with the sums that writes now adjust in place; a
+    # frozen copy of customer.risk.refresh() as of this migration
+    ProductRiskExposure = apps.get_model('customer', 'ProductRiskExposure')
+    Transaction = apps.get_model('customer', 'Transaction')
+    grouped = (
+        Transaction.objects
+        .filter(product__isnull=False)
+        .values('customer_id', 'product__category')
+        .annotate(
+            count=Count('pk'),
+            volume=Sum(Abs('amount')),
+            weighted=Sum(Abs('amount') * F('product__risk_factor')),
+        )
+        .order_by('customer_id')
+    )
+    ProductRiskExposure.objects.all().delete()
+    batch, current, rows = [], None, []
+    for row in grouped.iterator(chunk_size=10000):
+        if row['customer_id'] != current and rows:
+            batch.append(_exposure(ProductRiskExposure, current, rows))
+            rows = []
+            if len(batch) >= 2000:
+                ProductRiskExposure.objects.bulk_create(batch)
+                batch = []
+        current = row['customer_id']
+        rows.append(row)
+    if rows:
+        batch.append(_exposure(ProductRiskExposure, current, rows))
+    ProductRiskExposure.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0014_backfill_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productriskexposure',
+            name='banking_volume',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=18),
+        ),
+        migrations.AddField(
+            model_name='productriskexposure',
+            name='banking_weighted',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=22),
+        ),
+        migrations.AddField(
+            model_name='productriskexposure',
+            name='deposit_volume',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=18),
+        ),
+        migrations.AddField(
+            model_name='productriskexposure',
+            name='deposit_weighted',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=22),
+        ),
+        migrations.AddField(
+            model_name='productriskexposure',
+            name='loan_volume',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=18),
+        ),
+        migrations.AddField(
+            model_name='productriskexposure',
+            name='loan_weighted',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=22),
+        ),
+        migrations.AddField(
+            model_name='productriskexposure',
+            name='transaction_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='productriskexposure',
+            name='weighted_volume',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=22),
+        ),
+        migrations.RunPython(backfill_sums, migrations.RunPython.noop),
+    ]
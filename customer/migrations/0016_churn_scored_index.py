@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0015_risk_exposure_sums'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='churnscore',
+            index=models.Index(fields=['scored_at'], name='churn_scored_idx'),
+        ),
+    ]
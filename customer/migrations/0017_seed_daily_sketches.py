@@ -0,0 +1,29 @@
+from django.db import migrations
+from django.db.models.functions import TruncDate
+
+
+def seed_sketches(apps, schema_editor):
+    # The sketches only saw transactions written after 0010_daily_sketch;
+    # flag every day with transactions stale, so that refresh() builds it
+    # from all of them on its first read (`manage.py rebuild_sketches`
+    # builds them up front)
+    Transaction = apps.get_model('customer', 'Transaction')
+    DailySketch = apps.get_model('customer', 'DailySketch')
+    days = set(
+        Transaction.objects.annotate(day=TruncDate('transaction_date')).values_list('day', flat=True).distinct().order_by()
+    )
+    DailySketch.objects.bulk_create(
+        [DailySketch(day=day, segment='', stale=True) for day in days], batch_size=500, ignore_conflicts=True,
+    )
+    DailySketch.objects.update(stale=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0016_churn_scored_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_sketches, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+from django.db.models import DateField
+from django.db.models.functions import TruncMonth
+
+
+def seed_cohort_months(apps, schema_editor):
+    # Retention reads no longer build every month on the first one; flag the
+    # months with transactions that were never built stale, for
+    # `manage.py build_cohorts`
+    Transaction = apps.get_model('customer', 'Transaction')
+    CohortMonth = apps.get_model('customer', 'CohortMonth')
+    months = set(
+        Transaction.objects.annotate(month=TruncMonth('transaction_date', output_field=DateField()))
+        .values_list('month', flat=True).distinct().order_by()
+    )
+    CohortMonth.objects.bulk_create(
+        [CohortMonth(month=month, stale=True) for month in months], batch_size=500, ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0017_seed_daily_sketches'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_cohort_months, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,8 @@
+import uuid
+
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Lower
 
 # Create your models here.
 class Customer(models.Model):
@@ -16,6 +20,12 @@ class Customer(models.Model):
     ])
     profile_image = models.ImageField(upload_to='customer_images/', default='customer_images/default.jpg', null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['signup_date'], name='customer_signup_idx'),
+            models.Index(fields=['segment', 'signup_date'], name='customer_segment_signup_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -27,6 +37,12 @@ class Product(models.Model):
     category = models.CharField(max_length=50, choices=[('Loan', 'Loan'), ('Deposit', 'Deposit'), ('Banking', 'Mobile Banking')])
     risk_factor = models.DecimalField(max_digits=5, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            # Case-insensitive product lookups compare Lower(name)
+            models.Index(Lower('name'), name='product_name_lower_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -38,14 +54,219 @@ class Transaction(models.Model):
     transaction_date = models.DateTimeField()
     is_anomalous = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['transaction_date'], name='transaction_date_idx'),
+            # Per-customer history, date windows and keyset pagination
+            models.Index(fields=['customer', 'transaction_date', 'transaction_id'], name='transaction_customer_date_idx'),
+            # Anomalies are rare, so only they are indexed
+            models.Index(fields=['customer', 'transaction_date'], condition=Q(is_anomalous=True), name='transaction_anomalous_idx'),
+        ]
+
     def __str__(self):
         return f"{self.customer.name} - {self.product.name}"
 
 class RecommendedService(models.Model):
-    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, related_name='recommended_service')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='recommended_services')
     service_name = models.CharField(max_length=100)
     recommendation_reason = models.TextField()
+    rank = models.PositiveSmallIntegerField(default=1)
+    score = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['customer', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'rank'], name='unique_recommendation_rank'),
+        ]
 
     def __str__(self):
         return self.service_name
     
+
+class DailyRollup(models.Model):
+    day = models.DateField(unique=True)
+    new_customers = models.IntegerField(default=0)
+    transaction_count = models.IntegerField(default=0)
+    total_revenue = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    anomaly_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.day}"
+
+class DailySegmentRollup(models.Model):
+    # Signups carry no product, so new_customers is only ever recorded on the
+    # row whose category is blank.
+    day = models.DateField()
+    segment = models.CharField(max_length=50, blank=True)
+    category = models.CharField(max_length=50, blank=True)
+    new_customers = models.IntegerField(default=0)
+    transaction_count = models.IntegerField(default=0)
+    total_revenue = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    anomaly_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'segment', 'category'], name='unique_daily_segment_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.segment} - {self.category}"
+
+class DailySketch(models.Model):
+    # Mergeable summaries of one day's transactions per customer segment; see
+    # customer.sketches. A day whose transactions were rewritten is flagged
+    # stale on all of its rows and rebuilt before it is read again.
+    day = models.DateField()
+    segment = models.CharField(max_length=50, blank=True)
+    transaction_count = models.IntegerField(default=0)
+    amounts = models.BinaryField(default=b'')
+    customers = models.BinaryField(default=b'')
+    stale = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'segment'], name='unique_daily_sketch'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.segment}"
+
+class DataVersion(models.Model):
+    # Bumped on every write to the analytics source tables; cached analytics
+    # responses are keyed on it, so a bump makes every older entry unreachable.
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+    # Time of the last bump; the Last-Modified of the conditional GET responses
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+class ChurnScore(models.Model):
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='churn_scores')
+    scored_at = models.DateTimeField()
+    probability = models.FloatField()
+    recency_days = models.FloatField()
+    frequency = models.IntegerField()
+    monetary = models.DecimalField(max_digits=18, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', '-scored_at'], name='churn_customer_scored_idx'),
+            models.Index(fields=['scored_at'], name='churn_scored_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id} - {self.probability:.2f}"
+
+class ProductRiskExposure(models.Model):
+    # Amount-weighted average Product.risk_factor of each customer's
+    # transactions, per category and overall. The volume and weighted sums
+    # they are derived from are kept so that writes can adjust them in place.
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='risk_exposure')
+    loan_exposure = models.FloatField(null=True)
+    deposit_exposure = models.FloatField(null=True)
+    banking_exposure = models.FloatField(null=True)
+    overall_exposure = models.FloatField(null=True)
+    transaction_volume = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    transaction_count = models.IntegerField(default=0)
+    weighted_volume = models.DecimalField(max_digits=22, decimal_places=4, default=0)
+    loan_volume = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    loan_weighted = models.DecimalField(max_digits=22, decimal_places=4, default=0)
+    deposit_volume = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    deposit_weighted = models.DecimalField(max_digits=22, decimal_places=4, default=0)
+    banking_volume = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    banking_weighted = models.DecimalField(max_digits=22, decimal_places=4, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-overall_exposure'], name='risk_overall_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id} - {self.overall_exposure}"
+
+class CohortActivity(models.Model):
+    # Customers of a signup-month cohort and segment who transacted in a
+    # month, per product category; see customer.cohorts. Category '*'
+    # counts customers active in any category.
+    cohort = models.DateField()
+    month = models.DateField()
+    segment = models.CharField(max_length=50, blank=True)
+    category = models.CharField(max_length=50, blank=True)
+    customers = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cohort', 'month', 'segment', 'category'], name='unique_cohort_activity'),
+        ]
+        indexes = [
+            models.Index(fields=['month'], name='cohort_activity_month'),
+        ]
+
+    def __str__(self):
+        return f"{self.cohort} - {self.month} - {self.segment} - {self.category}"
+
+class CohortMonth(models.Model):
+    # Activity months CohortActivity covers; stale ones are rebuilt by
+    # `manage.py build_cohorts`, or by a read for the most recent ones.
+    month = models.DateField(unique=True)
+    stale = models.BooleanField(default=False)
+    built_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.month:%Y-%m}"
+
+class SegmentationRun(models.Model):
+    # One row per RFM segmentation run. Incremental runs re-score customers
+    # added or transacting after the last run's watermarks, against that
+    # run's quantile edges.
+    started_at = models.DateTimeField()
+    incremental = models.BooleanField(default=False)
+    last_customer_id = models.BigIntegerField(default=0)
+    last_transaction_id = models.BigIntegerField(default=0)
+    edges = models.JSONField(default=dict)
+    scored = models.IntegerField(default=0)
+    changed = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"{self.started_at:%Y-%m-%d %H:%M} - {self.changed}/{self.scored}"
+
+class Job(models.Model):
+    # A report computed by the `run_jobs` worker instead of the request; see
+    # customer.jobs. Finished results are stored compressed on disk until
+    # expires_at.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, default='queued', choices=[
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+        ('expired', 'Expired'),
+    ])
+    progress = models.FloatField(default=0)
+    error = models.TextField(blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    filename = models.CharField(max_length=100, blank=True)
+    result_size = models.BigIntegerField(null=True, blank=True)  # compressed bytes
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.pk} - {self.status}"
@@ -0,0 +1,65 @@
+import base64
+import binascii
+
+from dateutil import parser
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class CursorError(ValueError):
+    """Raised for a cursor or page size the client sent that cannot be used."""
+
+
+def encode_cursor(transaction_date, transaction_id):
+    raw = f"{transaction_date.isoformat()}|{transaction_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date_part, id_part = raw.rsplit('|', 1)
+        return parser.isoparse(date_part), int(id_part)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise CursorError("Invalid cursor")
+
+
+def parse_page_size(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        page_size = int(value)
+    except ValueError:
+        raise CursorError("Invalid page_size. Use a positive integer.")
+    if page_size < 1:
+        raise CursorError("Invalid page_size. Use a positive integer.")
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def keyset_page(transactions, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Return ``(rows, next_cursor)`` for transactions newest first, ordered by
+    ``(transaction_date, transaction_id)`` descending.
+
+    Each page seeks past the last seen key instead of using OFFSET, so with
+    an index on ``(customer, transaction_date, transaction_id)`` a deep page
+    costs the same as the first one.
+    """
+    transactions = transactions.order_by('-transaction_date', '-transaction_id')
+    if cursor:
+        last_date, last_id = decode_cursor(cursor)
+        transactions = transactions.filter(
+            Q(transaction_date__lt=last_date)
+            | Q(transaction_date=last_date, transaction_id__lt=last_id)
+        )
+
+    # Fetch one extra row to know whether another page exists
+    rows = list(transactions[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['transaction_date'], last['transaction_id'])
+    return rows, next_cursor
@@ -0,0 +1,223 @@
+import numpy as np
+from django.db import transaction
+
+from .models import Customer, Product, RecommendedService, Transaction
+
+DEFAULT_TOP_N = 3
+DEFAULT_CHUNK_SIZE = 10000
+HOLDING = np.dtype([('customer', np.int64), ('item', np.int64)])
+
+
+def load_holdings():
+    """
+    Return ``(customer_ids, item_index, items, categories)``: one entry per
+    distinct (customer, product name) pair, where a customer holds a product
+    if it is registered to them or they transacted on it. Products are
+    identified by name, since each Product row belongs to a single customer.
+    The rows stream straight into NumPy arrays.
+    """
+    items = {}
+    categories = []
+
+    def item(name, category):
+        if name not in items:
+            items[name] = len(items)
+            categories.append(category)
+        return items[name]
+
+    def holdings(rows):
+        return np.fromiter(
+            ((customer_id, item(name, category)) for customer_id, name, category in rows.iterator(chunk_size=10000)),
+            dtype=HOLDING,
+        )
+
+    registered = holdings(Product.objects.values_list('customer_id', 'name', 'category'))
+    transacted = holdings(
+        Transaction.objects
+        .filter(product__isnull=False)
+        .values_list('customer_id', 'product__name', 'product__category')
+        .distinct()
+        .order_by()
+    )
+    # Sorted by customer, then item
+    pairs = np.unique(np.concatenate([registered, transacted]))
+    return pairs['customer'], pairs['item'], list(items), categories
+
+
+def _chunks(customer_index, size):
+    # ``customer_index`` is sorted; yield (first, last) positions per chunk of customers
+    boundaries = np.searchsorted(customer_index, np.arange(0, customer_index[-1] + size + 1, size))
+    for start, stop in zip(boundaries[:-1], boundaries[1:]):
+        if stop > start:
+            yield start, stop
+
+
+def _expand(starts, lengths):
+    """Positions ``starts[i], ..., starts[i] + lengths[i] - 1`` for every i, concatenated."""
+    total = int(lengths.sum())
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + np.arange(total) - offsets
+
+
+def _sum_by_key(keys, weights=None):
+    """Distinct ``keys``, sorted, with the summed ``weights`` (or counts) of each."""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=weights, minlength=len(unique))
+
+
+def _lookup(keys, values, wanted):
+    # ``values`` of sorted, non-empty ``keys`` at ``wanted``, 0 where absent
+    index = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    return np.where(keys[index] == wanted, values[index], 0)
+
+
+def _cooccurring(customer_index, item_index, start, stop, item_count):
+    """Encoded item pairs ``a * item_count + b`` held together by the customers of one block, with their counts."""
+    _, first, held = np.unique(customer_index[start:stop], return_index=True, return_counts=True)
+    per_holding = np.repeat(held, held)
+    left = np.repeat(np.arange(stop - start), per_holding)
+    right = _expand(np.repeat(first, held), per_holding)
+    items = item_index[start:stop]
+    return _sum_by_key(items[left] * item_count + items[right])
+
+
+def build(top_n=DEFAULT_TOP_N, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Rebuild RecommendedService for every customer. Returns the number of
+    customers that received recommendations.
+
+    The item x item co-occurrence counts are accumulated sparsely, as
+    encoded item pairs, from blocks of ``chunk_size`` customers, so memory
+    grows with the pairs that actually occur rather than with the square of
+    the catalogue. Every block is then scored against the cosine-normalized
+    counts; products a customer already holds are never recommended.
+    """
+    customer_ids, item_index, items, categories = load_holdings()
+    item_count = len(items)
+    if not item_count:
+        return 0
+    unique_customers, customer_index = np.unique(customer_ids, return_inverse=True)
+
+    # Pass 1: co-occurrence counts, sorted by source item then target item,
+    # summed over the blocks once they are all counted
+    block_keys, block_counts = [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+    for start, stop in _chunks(customer_index, chunk_size):
+        keys, counts = _cooccurring(customer_index, item_index, start, stop, item_count)
+        block_keys.append(keys)
+        block_counts.append(counts)
+    pair_keys, pair_counts = _sum_by_key(np.concatenate(block_keys), np.concatenate(block_counts))
+    pair_sources, pair_targets = np.divmod(pair_keys, item_count)
+    diagonal = pair_sources == pair_targets
+    holders = np.zeros(item_count)
+    holders[pair_sources[diagonal]] = pair_counts[diagonal]
+    similarity = pair_counts / np.sqrt(holders[pair_sources] * holders[pair_targets])
+    similarity[diagonal] = 0
+    # Row ``i`` of the similarity matrix: pair_targets/similarity[row_starts[i]:row_starts[i + 1]]
+    row_starts = np.searchsorted(pair_sources, np.arange(item_count + 1))
+    popularity = holders / max(len(unique_customers), 1)
+    by_popularity = np.argsort(-popularity, kind='stable')
+
+    def reasons(held_items, holdings_start, rows, targets):
+        # The held product most similar to each target explains it, the first one on ties
+        held_counts = holdings_start[rows + 1] - holdings_start[rows]
+        held = held_items[_expand(holdings_start[rows], held_counts)]
+        recommendation = np.repeat(np.arange(len(rows)), held_counts)
+        shared = _lookup(pair_keys, similarity, held * item_count + targets[recommendation])
+        order = np.lexsort((-shared, recommendation))
+        sources = held[order][np.searchsorted(recommendation[order], np.arange(len(rows)))]
+        cooccurrence = _lookup(pair_keys, pair_counts, sources * item_count + targets)
+        for source, target, count in zip(sources.tolist(), targets.tolist(), cooccurrence.tolist()):
+            if not count:
+                yield _popular_reason(popularity[target], categories[target])
+            else:
+                share = count / holders[source] * 100
+                yield f"{share:.0f}% of customers holding {items[source]} also hold {items[target]} ({categories[target]})."
+
+    # Pass 2: score each block and replace its recommendations
+    written = 0
+    for start, stop in _chunks(customer_index, chunk_size):
+        local = customer_index[start:stop] - customer_index[start]
+        held_items = item_index[start:stop]
+        block_size = int(local[-1]) + 1
+        # Every item similar to one a customer holds, plus enough of the most
+        # popular ones to fill in when fewer than ``top_n`` of those are left
+        neighbours = row_starts[held_items + 1] - row_starts[held_items]
+        positions = _expand(row_starts[held_items], neighbours)
+        held_count = np.bincount(local, minlength=block_size)
+        fill = np.minimum(held_count + top_n, item_count)
+        fill_positions = _expand(np.zeros(block_size, dtype=np.int64), fill)
+        keys, scores = _sum_by_key(
+            np.concatenate([
+                np.repeat(local, neighbours) * item_count + pair_targets[positions],
+                np.repeat(np.arange(block_size), fill) * item_count + by_popularity[fill_positions],
+            ]),
+            np.concatenate([similarity[positions], np.zeros(len(fill_positions))]),
+        )
+        candidates, candidate_items = np.divmod(keys, item_count)
+        # Popularity breaks ties and fills in when nothing co-occurs
+        scores += 1e-3 * popularity[candidate_items]
+        keep = ~np.isin(keys, local * item_count + held_items)
+        candidates, candidate_items, scores = candidates[keep], candidate_items[keep], scores[keep]
+        order = np.lexsort((candidate_items, -scores, candidates))
+        candidates, candidate_items, scores = candidates[order], candidate_items[order], scores[order]
+        ranks = np.arange(len(candidates)) - np.searchsorted(candidates, candidates)
+
+        top = ranks < top_n
+        rows, targets, scores, ranks = candidates[top], candidate_items[top], scores[top], ranks[top]
+        first = customer_index[start]
+        holdings_start = np.searchsorted(local, np.arange(block_size + 1))
+        recommendations = [
+            RecommendedService(
+                customer_id=int(unique_customers[first + row]),
+                service_name=items[target],
+                recommendation_reason=reason,
+                rank=rank + 1,
+                score=score,
+            )
+            for row, target, score, rank, reason in zip(
+                rows.tolist(), targets.tolist(), scores.tolist(), ranks.tolist(),
+                reasons(held_items, holdings_start, rows, targets),
+            )
+        ]
+        block_customers = unique_customers[first:customer_index[stop - 1] + 1].tolist()
+        with transaction.atomic():
+            RecommendedService.objects.filter(customer_id__in=block_customers).delete()
+            RecommendedService.objects.bulk_create(recommendations, batch_size=1000)
+        written += len(block_customers)
+
+    # Customers holding nothing get the most popular products
+    popular = by_popularity[:top_n]
+    cold = []
+    for customer_id in Customer.objects.order_by('customer_id').values_list('customer_id', flat=True).iterator(chunk_size=chunk_size):
+        index = np.searchsorted(unique_customers, customer_id)
+        if index < len(unique_customers) and unique_customers[index] == customer_id:
+            continue
+        cold.append(customer_id)
+        if len(cold) >= chunk_size:
+            written += _write_popular(cold, popular, popularity, items, categories)
+            cold = []
+    if cold:
+        written += _write_popular(cold, popular, popularity, items, categories)
+    return written
+
+
+def _popular_reason(share, category):
+    return f"Popular choice: held by {share * 100:.0f}% of customers ({category})."
+
+
+def _write_popular(customer_ids, popular, popularity, items, categories):
+    recommendations = [
+        RecommendedService(
+            customer_id=customer_id,
+            service_name=items[target],
+            recommendation_reason=_popular_reason(popularity[target], categories[target]),
+            rank=rank,
+            score=float(popularity[target]),
+        )
+        for customer_id in customer_ids
+        for rank, target in enumerate(popular, start=1)
+    ]
+    with transaction.atomic():
+        RecommendedService.objects.filter(customer_id__in=customer_ids).delete()
+        RecommendedService.objects.bulk_create(recommendations, batch_size=1000)
+    return len(customer_ids)
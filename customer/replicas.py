@@ -0,0 +1,185 @@
+"""
+Read-replica routing for the analytics views.
+
+Views decorated with ``replica_reads`` read from one of the databases listed
+in CUSTOMER_REPLICAS['DATABASES'] while its lag stays under
+MAX_LAG_SECONDS; everything else, every write and every read after a write
+in the same request or inside a transaction goes to the primary. Lag is
+the age of the heartbeat row the replica last received from the primary,
+checked at most every CHECK_INTERVAL_SECONDS per process, so a replica
+that stops replicating is dropped once its reads would be too stale.
+
+Heartbeats come from ``python manage.py sync_replicas``, which for SQLite
+replicas also copies the primary over, so a replica can be tried locally
+(see customerinsights/settings/development.py).
+"""
+import asyncio
+import contextvars
+import functools
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils import timezone
+
+from . import cache
+from .models import DataVersion
+
+HEARTBEAT = 'replica-heartbeat'
+# Set after a write request, so the client reads its own writes until every
+# usable replica must have caught up
+PIN_COOKIE = 'primary_pin'
+
+DEFAULT_CONFIG = {
+    'DATABASES': [],
+    'MAX_LAG_SECONDS': 30,
+    'CHECK_INTERVAL_SECONDS': 5,
+}
+
+
+def get_config():
+    return {**DEFAULT_CONFIG, **getattr(settings, 'CUSTOMER_REPLICAS', {})}
+
+
+class _ReadState:
+    # Shared by the threads a request fans out to, so a write in one pins them all
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_reads = contextvars.ContextVar('customer_replica_reads', default=None)
+
+
+@contextmanager
+def _replica_context(request):
+    if not get_config()['DATABASES'] or request.COOKIES.get(PIN_COOKIE):
+        yield
+        return
+    token = _reads.set(_ReadState())
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+@contextmanager
+def primary():
+    """
+    Read from the primary inside a ``replica_reads`` view, for lazy
+    refreshes that rebuild derived rows from what they read: a lagging
+    replica would have them write stale rows to the primary. Once they
+    wrote anything, the rest of the request reads the primary as well,
+    where those rows are.
+    """
+    outer = _reads.get()
+    if outer is None:
+        yield
+        return
+    inner = _ReadState(pinned=True)
+    token = _reads.set(inner)
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+        if inner.wrote:
+            outer.pinned = True
+
+
+def replica_reads(method):
+    """Let a view method (sync or async) read from a replica."""
+    if asyncio.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(view, request, *args, **kwargs):
+            with _replica_context(request):
+                return await method(view, request, *args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        with _replica_context(request):
+            return method(view, request, *args, **kwargs)
+    return wrapper
+
+
+_heartbeats = {}  # alias -> (checked at, heartbeat time or None)
+_heartbeats_lock = threading.Lock()
+
+
+def replica_lag(alias):
+    """Seconds since the last heartbeat ``alias`` has received, or None when unknown or unreachable."""
+    now = time.monotonic()
+    with _heartbeats_lock:
+        checked_at, heartbeat = _heartbeats.get(alias, (None, None))
+    if checked_at is None or now - checked_at >= get_config()['CHECK_INTERVAL_SECONDS']:
+        try:
+            heartbeat = (
+                DataVersion.objects.using(alias).filter(name=HEARTBEAT)
+                .values_list('updated_at', flat=True).first()
+            )
+        except DatabaseError:
+            heartbeat = None
+        with _heartbeats_lock:
+            _heartbeats[alias] = (now, heartbeat)
+    if heartbeat is None:
+        return None
+    return max((timezone.now() - heartbeat).total_seconds(), 0.0)
+
+
+def usable_replicas():
+    config = get_config()
+    return [
+        alias for alias in config['DATABASES']
+        if (lag := replica_lag(alias)) is not None and lag <= config['MAX_LAG_SECONDS']
+    ]
+
+
+class ReplicaRouter:
+    """Send the reads of ``replica_reads`` views to a fresh replica and all writes to the primary."""
+
+    def db_for_read(self, model, **hints):
+        state = _reads.get()
+        if state is None or state.pinned or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        replicas = usable_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _reads.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *get_config()['DATABASES']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema with the data
+        if db in get_config()['DATABASES']:
+            return False
+        return None
+
+
+def heartbeat():
+    """Record the current time on the primary; replicas measure their lag against it."""
+    cache.bump_data_version(HEARTBEAT)
+
+
+def copy_sqlite(alias):
+    """Copy the SQLite primary onto the SQLite replica ``alias``, in place and consistently."""
+    source = sqlite3.connect(connections[DEFAULT_DB_ALIAS].settings_dict['NAME'])
+    target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+    try:
+        # Open replica connections see the new pages on their next read
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
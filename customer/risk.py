@@ -0,0 +1,208 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Abs
+from django.utils import timezone
+
+from .models import ProductRiskExposure, Transaction
+
+CATEGORY_FIELDS = {
+    'Loan': 'loan',
+    'Deposit': 'deposit',
+    'Banking': 'banking',
+}
+SUM_FIELDS = ('transaction_volume', 'transaction_count', 'weighted_volume') + tuple(
+    f'{prefix}_{name}' for prefix in CATEGORY_FIELDS.values() for name in ('volume', 'weighted')
+)
+EXPOSURE_FIELDS = tuple(f'{prefix}_exposure' for prefix in CATEGORY_FIELDS.values()) + ('overall_exposure',)
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_TOP_RISK = 20
+MAX_TOP_RISK = 500
+CENT = Decimal('0.01')
+
+
+def _grouped(transactions):
+    # Refunds/negative amounts still carry exposure, so volumes use Abs(amount)
+    return (
+        transactions
+        .filter(product__isnull=False)
+        .values('customer_id', 'product__category')
+        .annotate(
+            count=Count('pk'),
+            volume=Sum(Abs('amount')),
+            weighted=Sum(Abs('amount') * F('product__risk_factor')),
+        )
+        .order_by('customer_id')
+    )
+
+
+def _add(sums, category, count, volume, weighted):
+    sums['transaction_count'] += count
+    sums['transaction_volume'] += volume
+    sums['weighted_volume'] += weighted
+    prefix = CATEGORY_FIELDS.get(category)
+    if prefix:
+        sums[f'{prefix}_volume'] += volume
+        sums[f'{prefix}_weighted'] += weighted
+
+
+def _derive(exposure):
+    for prefix in CATEGORY_FIELDS.values():
+        volume, weighted = getattr(exposure, f'{prefix}_volume'), getattr(exposure, f'{prefix}_weighted')
+        setattr(exposure, f'{prefix}_exposure', round(float(weighted / volume), 4) if volume else None)
+    volume = exposure.transaction_volume
+    exposure.overall_exposure = round(float(exposure.weighted_volume / volume), 4) if volume else None
+    return exposure
+
+
+def _exposure(customer_id, rows):
+    sums = dict.fromkeys(SUM_FIELDS, 0)
+    for row in rows:
+        # SQLite sums decimals as floats
+        volume = Decimal(row['volume'] or 0).quantize(CENT)
+        weighted = Decimal(row['weighted'] or 0).quantize(CENT * CENT)
+        _add(sums, row['product__category'], row['count'], volume, weighted)
+    return _derive(ProductRiskExposure(customer_id=customer_id, **sums))
+
+
+def refresh(customer_ids=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Recompute exposures for ``customer_ids`` (all customers when None) in a
+    single grouped pass over their transactions. Returns the rows written.
+    Writes keep the exposures up to date through ``apply()``; this is for
+    rebuilding them.
+    """
+    transactions = Transaction.objects.all()
+    existing = ProductRiskExposure.objects.all()
+    if customer_ids is not None:
+        customer_ids = set(customer_ids)
+        if not customer_ids:
+            return 0
+        transactions = transactions.filter(customer_id__in=customer_ids)
+        existing = existing.filter(customer_id__in=customer_ids)
+
+    written = 0
+    batch = []
+    current, rows = None, []
+    with transaction.atomic():
+        # Customers that lost all their product transactions simply get no row
+        existing.delete()
+        for row in _grouped(transactions).iterator(chunk_size=10000):
+            if row['customer_id'] != current and rows:
+                batch.append(_exposure(current, rows))
+                rows = []
+                if len(batch) >= batch_size:
+                    ProductRiskExposure.objects.bulk_create(batch)
+                    written += len(batch)
+                    batch = []
+            current = row['customer_id']
+            rows.append(row)
+        if rows:
+            batch.append(_exposure(current, rows))
+        ProductRiskExposure.objects.bulk_create(batch)
+    return written + len(batch)
+
+
+def _apply(deltas):
+    with transaction.atomic():
+        existing = ProductRiskExposure.objects.select_for_update().in_bulk(list(deltas))
+        created, updated, emptied = [], [], []
+        now = timezone.now()
+        for customer_id, sums in deltas.items():
+            exposure = existing.get(customer_id)
+            if exposure is None:
+                exposure = ProductRiskExposure(customer_id=customer_id)
+                created.append(exposure)
+            else:
+                updated.append(exposure)
+            for name, delta in sums.items():
+                setattr(exposure, name, getattr(exposure, name) + delta)
+            exposure.updated_at = now
+            if exposure.transaction_count <= 0:
+                emptied.append(customer_id)
+            _derive(exposure)
+        emptied = set(emptied)
+        ProductRiskExposure.objects.bulk_create([row for row in created if row.customer_id not in emptied])
+        ProductRiskExposure.objects.bulk_update(
+            [row for row in updated if row.customer_id not in emptied], SUM_FIELDS + EXPOSURE_FIELDS + ('updated_at',),
+        )
+        ProductRiskExposure.objects.filter(customer_id__in=emptied).delete()
+
+
+def apply(deltas):
+    """
+    Adjust the exposures by ``deltas``, ``{customer_id: {sum field: delta}}``,
+    rederiving the averages; rows left without transactions are dropped.
+    """
+    deltas = {
+        customer_id: sums for customer_id, sums in deltas.items() if any(sums.values())
+    }
+    if not deltas:
+        return
+    try:
+        _apply(deltas)
+    except IntegrityError:
+        # Another writer created one of the rows in the meantime
+        _apply(deltas)
+
+
+def _deltas():
+    return defaultdict(lambda: dict.fromkeys(SUM_FIELDS, 0))
+
+
+def _add_transaction(deltas, values, sign):
+    if values is None or values['risk_factor'] is None:
+        # Transactions without a product carry no exposure
+        return
+    volume = abs(Decimal(values['amount']))
+    _add(deltas[values['customer_id']], values['category'], sign, sign * volume, sign * volume * values['risk_factor'])
+
+
+def record_change(previous, current):
+    """
+    Apply one transaction write given its values before (None when it is
+    new) and after (None when deleted); both include ``category`` and
+    ``risk_factor`` of the product.
+    """
+    deltas = _deltas()
+    _add_transaction(deltas, previous, -1)
+    _add_transaction(deltas, current, 1)
+    apply(deltas)
+
+
+def record_transactions(rows, sign=1):
+    """Add (or with ``sign=-1`` remove) transaction values dicts as ``record_change`` takes them."""
+    deltas = _deltas()
+    for values in rows:
+        _add_transaction(deltas, values, sign)
+    apply(deltas)
+
+
+def move_product(transactions, previous, current):
+    """
+    Re-weigh ``transactions`` of a product whose ``category`` and
+    ``risk_factor`` changed from ``previous`` to ``current`` (None when the
+    transactions lose the product), with one grouped query.
+    """
+    grouped = transactions.values('customer_id').annotate(count=Count('pk'), volume=Sum(Abs('amount'))).order_by()
+    deltas = _deltas()
+    for row in grouped:
+        volume = Decimal(row['volume'] or 0).quantize(CENT)
+        for values, sign in ((previous, -1), (current, 1)):
+            if values is not None:
+                _add(
+                    deltas[row['customer_id']], values['category'],
+                    sign * row['count'], sign * volume, sign * volume * values['risk_factor'],
+                )
+    apply(deltas)
+
+
+def exposure_summary(exposure):
+    return {
+        "MobileBanking": exposure.banking_exposure if exposure else None,
+        "Loans": exposure.loan_exposure if exposure else None,
+        "Deposits": exposure.deposit_exposure if exposure else None,
+        "Overall": exposure.overall_exposure if exposure else None,
+    }
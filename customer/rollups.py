@@ -0,0 +1,282 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Customer, DailyRollup, DailySegmentRollup, Transaction
+
+COUNTERS = ('new_customers', 'transaction_count', 'total_revenue', 'anomaly_count')
+
+
+def to_day(value):
+    # Rollups are bucketed on the same calendar day TruncDate would use
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
+def _bump(model, keys, deltas):
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updates = {name: F(name) + delta for name, delta in deltas.items()}
+    if model.objects.filter(**keys).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas)
+    except IntegrityError:
+        # Another writer created the row in the meantime
+        model.objects.filter(**keys).update(**updates)
+
+
+def record(day, segment, category, sign=1, **deltas):
+    """Add (or with ``sign=-1`` remove) counter deltas for one day/segment/category."""
+    deltas = {name: sign * deltas.get(name, 0) for name in COUNTERS}
+    with transaction.atomic():
+        _bump(DailyRollup, {'day': day}, deltas)
+        _bump(DailySegmentRollup, {'day': day, 'segment': segment or '', 'category': category or ''}, deltas)
+
+
+def record_change(previous, current):
+    """
+    Apply one transaction write given its values before (None when it is
+    new) and after, netting out the counters of a bucket it stays in.
+    """
+    per_segment = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for values, sign in ((previous, -1), (current, 1)):
+        if values is None:
+            continue
+        bucket = per_segment[(to_day(values['transaction_date']), values['segment'] or '', values['category'] or '')]
+        bucket['transaction_count'] += sign
+        bucket['total_revenue'] += sign * Decimal(values['amount'])
+        bucket['anomaly_count'] += sign if values['is_anomalous'] else 0
+    if not any(any(deltas.values()) for deltas in per_segment.values()):
+        return
+    per_day = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for (day, _, _), deltas in per_segment.items():
+        for name, delta in deltas.items():
+            per_day[day][name] += delta
+    with transaction.atomic():
+        for day, deltas in per_day.items():
+            _bump(DailyRollup, {'day': day}, deltas)
+        for (day, segment, category), deltas in per_segment.items():
+            _bump(DailySegmentRollup, {'day': day, 'segment': segment, 'category': category}, deltas)
+
+
+def record_signup(signup_date, segment, sign=1):
+    record(to_day(signup_date), segment, '', sign=sign, new_customers=1)
+
+
+def _bump_many(model, key_fields, buckets):
+    """
+    Add ``{key tuple: {counter: delta}}`` to many rows in a few queries.
+    Keys start with the day.
+
+    Missing rows are inserted first (which, on SQLite, also takes the write
+    lock), then the rows are read under select_for_update and rewritten with
+    bulk_update, so concurrent increments are not lost.
+    """
+    model.objects.bulk_create(
+        [model(**dict(zip(key_fields, key))) for key in buckets],
+        ignore_conflicts=True,
+    )
+    rows = []
+    for row in model.objects.select_for_update().filter(day__in={key[0] for key in buckets}):
+        deltas = buckets.get(tuple(getattr(row, name) for name in key_fields))
+        if deltas is None:
+            continue
+        for name, delta in deltas.items():
+            setattr(row, name, getattr(row, name) + delta)
+        rows.append(row)
+    model.objects.bulk_update(rows, COUNTERS, batch_size=500)
+
+
+def _bump_all(per_day, per_segment, chunk_size):
+    if not per_day and not per_segment:
+        return
+    with transaction.atomic():
+        for model, key_fields, buckets in (
+            (DailyRollup, ('day',), per_day),
+            (DailySegmentRollup, ('day', 'segment', 'category'), per_segment),
+        ):
+            keys = list(buckets)
+            for start in range(0, len(keys), chunk_size):
+                _bump_many(model, key_fields, {key: buckets[key] for key in keys[start:start + chunk_size]})
+
+
+def record_transactions(rows, sign=1, chunk_size=200):
+    """Apply many transactions at once with a few queries per ``chunk_size`` buckets."""
+    per_day = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    per_segment = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for values in rows:
+        day = to_day(values['transaction_date'])
+        amount = sign * Decimal(values['amount'])
+        anomalies = sign if values['is_anomalous'] else 0
+        for bucket in (per_day[(day,)], per_segment[(day, values['segment'] or '', values['category'] or '')]):
+            bucket['transaction_count'] += sign
+            bucket['total_revenue'] += amount
+            bucket['anomaly_count'] += anomalies
+
+    _bump_all(per_day, per_segment, chunk_size)
+
+
+def record_anomaly_changes(rows, chunk_size=200):
+    """Apply flipped ``is_anomalous`` flags; each row carries its new value."""
+    per_day = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    per_segment = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for values in rows:
+        day = to_day(values['transaction_date'])
+        delta = 1 if values['is_anomalous'] else -1
+        per_day[(day,)]['anomaly_count'] += delta
+        per_segment[(day, values['segment'] or '', values['category'] or '')]['anomaly_count'] += delta
+    _bump_all(per_day, per_segment, chunk_size)
+
+
+def transaction_buckets(queryset):
+    """Group transactions by day/segment/category with the rollup counters."""
+    return (
+        queryset
+        .annotate(day=TruncDate('transaction_date'))
+        .values('day', 'customer__segment', 'product__category')
+        .annotate(
+            transaction_count=Count('transaction_id'),
+            total_revenue=Sum('amount'),
+            anomaly_count=Count('transaction_id', filter=Q(is_anomalous=True)),
+        )
+        .order_by()
+    )
+
+
+def move_transactions(queryset, old_segment, new_segment, old_category=None, new_category=None, chunk_size=200):
+    """
+    Re-bucket already-counted transactions after their customer's segment or
+    their product's category changed. Arguments left as None mean "keep each
+    transaction's current segment (or category)".
+    """
+    per_segment = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for row in transaction_buckets(queryset):
+        segment, category = row['customer__segment'] or '', row['product__category'] or ''
+        old = (
+            row['day'],
+            segment if old_segment is None else old_segment or '',
+            category if old_category is None else old_category or '',
+        )
+        new = (
+            row['day'],
+            segment if new_segment is None else new_segment or '',
+            category if new_category is None else new_category or '',
+        )
+        if old == new:
+            continue
+        for key, sign in ((old, -1), (new, 1)):
+            for name in ('transaction_count', 'total_revenue', 'anomaly_count'):
+                per_segment[key][name] += sign * row[name]
+    _bump_all({}, per_segment, chunk_size)
+
+
+def remove_transactions(queryset, chunk_size=200):
+    """Take counted transactions out of the rollups in bulk; call before deleting them."""
+    per_day = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    per_segment = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for row in transaction_buckets(queryset):
+        key = (row['day'], row['customer__segment'] or '', row['product__category'] or '')
+        for bucket in (per_day[(row['day'],)], per_segment[key]):
+            for name in ('transaction_count', 'total_revenue', 'anomaly_count'):
+                bucket[name] -= row[name]
+    _bump_all(per_day, per_segment, chunk_size)
+
+
+def move_customers(changes, batch_size=500, chunk_size=200):
+    """
+    Re-bucket the transactions and signups of many customers whose segment
+    is about to change; ``changes`` maps customer id to (old, new) segment.
+    Call before writing the new segments. Customers are grouped by their
+    (old, new) pair so each batch needs one grouped query per pair.
+    """
+    pairs = defaultdict(list)
+    for customer_id, (old_segment, new_segment) in changes.items():
+        if old_segment != new_segment:
+            pairs[(old_segment or '', new_segment or '')].append(customer_id)
+
+    per_segment = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for (old_segment, new_segment), customer_ids in pairs.items():
+        for start in range(0, len(customer_ids), batch_size):
+            batch = customer_ids[start:start + batch_size]
+            for row in transaction_buckets(Transaction.objects.filter(customer_id__in=batch)):
+                for segment, sign in ((old_segment, -1), (new_segment, 1)):
+                    bucket = per_segment[(row['day'], segment, row['product__category'] or '')]
+                    for name in ('transaction_count', 'total_revenue', 'anomaly_count'):
+                        bucket[name] += sign * row[name]
+            signups = (
+                Customer.objects.filter(customer_id__in=batch)
+                .annotate(day=TruncDate('signup_date'))
+                .values('day')
+                .annotate(new_customers=Count('customer_id'))
+                .order_by()
+            )
+            for row in signups:
+                per_segment[(row['day'], old_segment, '')]['new_customers'] -= row['new_customers']
+                per_segment[(row['day'], new_segment, '')]['new_customers'] += row['new_customers']
+
+    _bump_all({}, per_segment, chunk_size)
+
+
+def rebuild(start=None, end=None, batch_size=1000):
+    """
+    Recompute rollups from the raw tables for days in [start, end] (both
+    optional, inclusive). Returns the number of daily rows written.
+    """
+    transactions = Transaction.objects.all()
+    customers = Customer.objects.all()
+    daily = DailyRollup.objects.all()
+    segmented = DailySegmentRollup.objects.all()
+    if start:
+        transactions = transactions.filter(transaction_date__date__gte=start)
+        customers = customers.filter(signup_date__date__gte=start)
+        daily = daily.filter(day__gte=start)
+        segmented = segmented.filter(day__gte=start)
+    if end:
+        transactions = transactions.filter(transaction_date__date__lte=end)
+        customers = customers.filter(signup_date__date__lte=end)
+        daily = daily.filter(day__lte=end)
+        segmented = segmented.filter(day__lte=end)
+
+    per_day = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    per_segment = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+    for row in transaction_buckets(transactions).iterator():
+        key = (row['day'], row['customer__segment'] or '', row['product__category'] or '')
+        for name in ('transaction_count', 'total_revenue', 'anomaly_count'):
+            per_day[row['day']][name] += row[name]
+            per_segment[key][name] += row[name]
+
+    signups = (
+        customers
+        .annotate(day=TruncDate('signup_date'))
+        .values('day', 'segment')
+        .annotate(new_customers=Count('customer_id'))
+        .order_by()
+    )
+    for row in signups.iterator():
+        per_day[row['day']]['new_customers'] += row['new_customers']
+        per_segment[(row['day'], row['segment'] or '', '')]['new_customers'] += row['new_customers']
+
+    with transaction.atomic():
+        daily.delete()
+        segmented.delete()
+        DailyRollup.objects.bulk_create(
+            (DailyRollup(day=day, **counters) for day, counters in per_day.items()),
+            batch_size=batch_size,
+        )
+        DailySegmentRollup.objects.bulk_create(
+            (
+                DailySegmentRollup(day=day, segment=segment, category=category, **counters)
+                for (day, segment, category), counters in per_segment.items()
+            ),
+            batch_size=batch_size,
+        )
+    return len(per_day)
@@ -0,0 +1,188 @@
+"""
+Customer search over an SQLite FTS5 trigram index of name, email and phone.
+
+The ``customer_search`` virtual table (migration 0012) mirrors those
+columns with the customer id as its rowid and is kept in sync by the
+Customer signals. The trigram tokenizer indexes every three-character
+substring, so substring, prefix (``LIKE 'ab%'``) and trigram-overlap
+queries all read the index instead of scanning the customers.
+
+``autocomplete()`` ranks in stages and stops once it has enough matches:
+names starting with the query, then names with a word starting with it,
+then substrings of any column ordered by bm25, then fuzzy matches sharing
+enough trigrams with the query. Other databases fall back to plain
+``icontains`` lookups.
+"""
+import re
+
+from django.db import connections, router
+from django.db.models.expressions import RawSQL
+
+from .models import Customer
+
+TABLE = 'customer_search'
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+CANDIDATES = 200  # rows fetched per stage before ranking
+# Share of the query's trigrams a fuzzy match must contain
+FUZZY_THRESHOLD = 0.5
+# bm25 weights of name, email and phone_number
+WEIGHTS = (10.0, 2.0, 1.0)
+
+
+def _connection(write=False):
+    alias = router.db_for_write(Customer) if write else router.db_for_read(Customer)
+    return connections[alias]
+
+
+def available(connection):
+    return connection.vendor == 'sqlite'
+
+
+def normalize(term):
+    return ' '.join((term or '').lower().split())
+
+
+def _quote(text):
+    # An FTS5 string: matched literally, whatever the characters
+    return '"' + text.replace('"', '""') + '"'
+
+
+def trigrams(text):
+    """pg_trgm-style trigrams of each word, padded so that word starts count double."""
+    grams = set()
+    for word in re.findall(r'\w+', text.lower()):
+        padded = f'  {word} '
+        grams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return grams
+
+
+def similarity(term, text):
+    """Share of the trigrams of ``term`` that ``text`` contains."""
+    wanted = trigrams(term)
+    return len(wanted & trigrams(text)) / len(wanted) if wanted else 0.0
+
+
+def index(customers):
+    """Add or refresh the index rows of ``customers`` (Customer instances)."""
+    connection = _connection(write=True)
+    if not available(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {TABLE} (rowid, name, email, phone_number) VALUES (%s, %s, %s, %s)",
+            [(customer.pk, customer.name, customer.email, customer.phone_number) for customer in customers],
+        )
+
+
+def remove(customer_ids):
+    connection = _connection(write=True)
+    if not available(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(customer_id,) for customer_id in customer_ids])
+
+
+def rebuild():
+    """Re-index every customer; for writers that bypass the Customer signals."""
+    connection = _connection(write=True)
+    if not available(connection):
+        return 0
+    customers = connection.ops.quote_name(Customer._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, name, email, phone_number) "
+            f"SELECT customer_id, name, email, phone_number FROM {customers}"
+        )
+        return cursor.rowcount
+
+
+def filter_name(customers, term):
+    """``customers`` whose name contains ``term``, through the index where it can help."""
+    term = normalize(term)
+    if len(term) < 3 or not available(connections[customers.db]):
+        return customers.filter(name__icontains=term)
+    return customers.filter(
+        pk__in=RawSQL(f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s", [f'name : {_quote(term)}'])
+    )
+
+
+def _stage(cursor, where, params, order='rank'):
+    cursor.execute(
+        f"SELECT rowid, name, email, phone_number, bm25({TABLE}, {', '.join(map(str, WEIGHTS))}) AS rank "
+        f"FROM {TABLE} WHERE {where} ORDER BY {order} LIMIT {CANDIDATES}",
+        params,
+    )
+    return cursor.fetchall()
+
+
+def _like_prefix(text):
+    # LIKE wildcards cannot be escaped without losing the index; such terms skip the LIKE stages
+    return None if '%' in text or '_' in text else text
+
+
+def autocomplete(term, limit=DEFAULT_LIMIT):
+    """
+    Up to ``limit`` ``{'customer_id', 'name', 'email', 'phone_number',
+    'match'}`` for ``term``, best first; ``match`` is prefix, word,
+    substring or fuzzy.
+    """
+    term = normalize(term)
+    if not term:
+        return []
+    connection = _connection()
+    if not available(connection):
+        rows = Customer.objects.using(connection.alias).filter(name__icontains=term).order_by('name')[:limit]
+        return [
+            {'customer_id': row.pk, 'name': row.name, 'email': row.email, 'phone_number': row.phone_number,
+             'match': 'prefix' if row.name.lower().startswith(term) else 'substring'}
+            for row in rows
+        ]
+
+    words = term.split()
+    prefix = _like_prefix(term)
+    results = {}
+
+    def add(rows, match, keep=lambda row: True):
+        for row in rows:
+            if len(results) >= limit:
+                return
+            if row[0] not in results and keep(row):
+                results[row[0]] = {
+                    'customer_id': row[0], 'name': row[1], 'email': row[2], 'phone_number': row[3], 'match': match,
+                }
+
+    def contains_words(row):
+        haystack = ' '.join(value or '' for value in row[1:4]).lower()
+        return all(word in haystack for word in words)
+
+    with connection.cursor() as cursor:
+        if prefix:
+            add(_stage(cursor, "name LIKE %s", [prefix + '%'], order='length(name), name'), 'prefix')
+        if len(results) < limit and prefix:
+            add(_stage(cursor, "name LIKE %s", ['% ' + prefix + '%'], order='length(name), name'), 'word')
+        long_words = [word for word in words if len(word) >= 3]
+        if len(results) < limit and long_words:
+            # Shorter words cannot use the trigram index; they are checked on the candidates
+            query = ' AND '.join(_quote(word) for word in long_words)
+            candidates = _stage(cursor, f"{TABLE} MATCH %s", [query])
+            # An email or phone number starting with the query beats one merely
+            # containing it, and the closer its length the better
+            candidates.sort(key=lambda row: (
+                min((len(value) for value in row[2:4] if (value or '').lower().startswith(term)), default=float('inf')),
+                row[4],
+            ))
+            add(candidates, 'substring', contains_words)
+        grams = {gram for word in long_words for gram in (word[index:index + 3] for index in range(len(word) - 2))}
+        if len(results) < limit and grams:
+            candidates = _stage(cursor, f"{TABLE} MATCH %s", [' OR '.join(_quote(gram) for gram in sorted(grams))])
+            scored = sorted(
+                (
+                    (max(similarity(term, row[1] or ''), similarity(term, (row[2] or '').split('@')[0])), row)
+                    for row in candidates
+                ),
+                key=lambda item: -item[0],
+            )
+            add((row for score, row in scored if score >= FUZZY_THRESHOLD), 'fuzzy')
+    return list(results.values())
@@ -0,0 +1,128 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from . import cache, cohorts, rollups, sketches
+from .churn import rfm_features
+from .models import Customer, SegmentationRun, Transaction
+
+QUANTILES = (0.2, 0.4, 0.6, 0.8)
+# Minimum mean R/F/M score (1-5) per segment, best first; override with
+# settings.CUSTOMER_SEGMENT_RULES
+DEFAULT_RULES = (
+    ('High', 3.67),
+    ('Low', 2.34),
+    ('Barely', 0),
+)
+DEFAULT_BATCH_SIZE = 1000
+
+
+def get_rules():
+    return tuple(getattr(settings, 'CUSTOMER_SEGMENT_RULES', DEFAULT_RULES))
+
+
+def quantile_edges(recency, frequency, monetary):
+    if not len(recency):
+        return {}
+    return {
+        name: np.quantile(values, QUANTILES).tolist()
+        for name, values in (('recency', recency), ('frequency', frequency), ('monetary', monetary))
+    }
+
+
+def assign(recency, frequency, monetary, edges, rules=None):
+    """Segment names for RFM arrays, scored 1-5 against the quantile ``edges``."""
+    rules = rules or get_rules()
+
+    def quintile(values, name):
+        return 1 + np.searchsorted(edges[name], values, side='right')
+
+    # Fewer days since the last transaction is better
+    score = (
+        (6 - quintile(recency, 'recency'))
+        + quintile(frequency, 'frequency')
+        + quintile(monetary, 'monetary')
+    ) / 3
+    segments = np.full(len(score), rules[-1][0], dtype=object)
+    # Apply the lowest bar first so better segments overwrite
+    for name, minimum in reversed(rules):
+        segments[score >= minimum] = name
+    return segments
+
+
+def apply_changes(changes, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Write ``{customer_id: (old, new)}`` segment changes, moving the
+    customers' rollups along and marking the days of their sketches and the
+    months of their cohort activity stale; bulk writes skip the Customer signals.
+    """
+    with transaction.atomic():
+        rollups.move_customers(changes)
+        moved = [customer_id for customer_id, (old, new) in changes.items() if old != new]
+        for start in range(0, len(moved), batch_size):
+            moved_transactions = Transaction.objects.filter(customer_id__in=moved[start:start + batch_size])
+            sketches.mark_stale_transactions(moved_transactions)
+            cohorts.mark_stale_transactions(moved_transactions)
+        # A handful of target values, so one UPDATE ... WHERE pk IN (...) per
+        # segment and batch beats bulk_update's CASE per row
+        targets = {}
+        for customer_id, (_, new_segment) in changes.items():
+            targets.setdefault(new_segment, []).append(customer_id)
+        for segment, customer_ids in targets.items():
+            for start in range(0, len(customer_ids), batch_size):
+                Customer.objects.filter(customer_id__in=customer_ids[start:start + batch_size]).update(segment=segment)
+        if changes:
+            cache.bump_data_version()
+
+
+def run(incremental=False, dry_run=False, now=None):
+    """
+    Segment customers by RFM quantiles and write the segments that changed.
+
+    A full run computes quantile edges over every customer. An incremental
+    run re-scores only customers created or transacting since the last run,
+    against the last run's edges, and falls back to a full run when there is
+    none. Returns the SegmentationRun (unsaved on a dry run).
+    """
+    now = now or timezone.now()
+    previous = SegmentationRun.objects.first() if incremental else None
+    incremental = previous is not None and bool(previous.edges)
+
+    # Watermarks first, so rows arriving during the run are picked up next time
+    marks = {
+        'last_customer_id': Customer.objects.aggregate(last=Max('customer_id'))['last'] or 0,
+        'last_transaction_id': Transaction.objects.aggregate(last=Max('transaction_id'))['last'] or 0,
+    }
+    customers = None
+    if incremental:
+        customers = Customer.objects.filter(
+            Q(customer_id__gt=previous.last_customer_id)
+            | Q(customer_id__in=Transaction.objects
+                .filter(transaction_id__gt=previous.last_transaction_id)
+                .values('customer_id'))
+        )
+
+    customer_ids, recency, frequency, monetary = rfm_features(now, customers)
+    edges = previous.edges if incremental else quantile_edges(recency, frequency, monetary)
+    segmentation_run = SegmentationRun(started_at=now, incremental=incremental, edges=edges, scored=len(customer_ids), **marks)
+    if not len(customer_ids):
+        if not dry_run:
+            segmentation_run.save()
+        return segmentation_run
+
+    segments = assign(recency, frequency, monetary, edges)
+    scored_customers = Customer.objects.all() if customers is None else customers
+    current = dict(scored_customers.values_list('customer_id', 'segment').iterator(chunk_size=10000))
+    changes = {}
+    for customer_id, segment in zip(customer_ids.tolist(), segments):
+        if customer_id in current and current[customer_id] != segment:
+            changes[customer_id] = (current[customer_id], segment)
+    segmentation_run.changed = len(changes)
+
+    if not dry_run:
+        with transaction.atomic():
+            apply_changes(changes)
+            segmentation_run.save()
+    return segmentation_run
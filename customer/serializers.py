@@ -1,10 +1,22 @@
+from django.db.models import OuterRef, Prefetch, Subquery, Sum
 from rest_framework import serializers
-from .models import Customer,Transaction, Product
+from .models import ChurnScore, Customer, ProductRiskExposure, Transaction, Product
+from .churn import GRAPH_POINTS, churn_summary, latest_scores
+from .pagination import DEFAULT_PAGE_SIZE
+from .images import variant_urls
+from .risk import exposure_summary
 
 class CustomerSerializer(serializers.ModelSerializer):
+    # Thumbnail URLs by bucket size; built from the stored name without touching the file
+    profile_image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Customer
-        fields = ['customer_id', 'name', 'email', 'phone_number', 'segment', 'signup_date','profile_image']
+        fields = ['customer_id', 'name', 'email', 'phone_number', 'segment', 'signup_date','profile_image',
+                  'profile_image_variants']
+
+    def get_profile_image_variants(self, obj):
+        return variant_urls(obj.profile_image.name)
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -32,14 +44,26 @@ class TransactionSerializer(serializers.ModelSerializer):
         fields = ['transaction_id', 'transaction_date', 'amount', 'is_anomalous']
 
 class CustomerProfileSerializer(serializers.Serializer):
+    """
+    Every per-customer section in one payload. Use ``profile_queryset`` to
+    load the customer so each section is read from prefetched rows; pass
+    ``fields`` to render only some sections.
+    """
     personal_info = serializers.SerializerMethodField()
     services_used = serializers.SerializerMethodField()
-    recommended_service = serializers.CharField()
+    recommended_service = serializers.SerializerMethodField()
     churn_probability = serializers.SerializerMethodField()
-    clv = serializers.DecimalField(max_digits=10, decimal_places=2)
-    transaction_history = TransactionSerializer(many=True)
-    customer_product_risk = serializers.JSONField()
-    segmentation = serializers.CharField()
+    clv = serializers.DecimalField(max_digits=18, decimal_places=2)
+    transaction_history = serializers.SerializerMethodField()
+    customer_product_risk = serializers.SerializerMethodField()
+    segmentation = serializers.CharField(source='segment')
+    products = ProductSerializer(many=True)
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
     def get_personal_info(self, obj):
         return {
@@ -63,5 +87,61 @@ class CustomerProfileSerializer(serializers.Serializer):
             "deposits": {"fixed": 10000, "savings": 5000},
         }
 
+    def get_recommended_service(self, obj):
+        # Ordered by rank; all() reads the prefetch cache when there is one
+        recommendation = next(iter(obj.recommended_services.all()), None)
+        return recommendation.service_name if recommendation else None
+
     def get_churn_probability(self, obj):
-        return {"value": 0.75, "graph": [0.6, 0.65, 0.75]}
+        scores = getattr(obj, 'latest_churn_scores', None)
+        return churn_summary(latest_scores(obj.customer_id) if scores is None else scores)
+
+    def get_transaction_history(self, obj):
+        transactions = getattr(obj, 'recent_transactions', None)
+        if transactions is None:
+            transactions = obj.transactions.order_by('-transaction_date', '-transaction_id')[:DEFAULT_PAGE_SIZE]
+        return TransactionSerializer(transactions, many=True).data
+
+    def get_customer_product_risk(self, obj):
+        try:
+            exposure = obj.risk_exposure
+        except ProductRiskExposure.DoesNotExist:
+            exposure = None
+        return exposure_summary(exposure)
+
+
+PROFILE_FIELDS = tuple(CustomerProfileSerializer().fields)
+
+
+def profile_queryset(fields=PROFILE_FIELDS):
+    """
+    Customers with what the requested profile ``fields`` need: a fixed
+    number of queries (at most five) however many sections are asked for.
+    """
+    customers = Customer.objects.all()
+    if 'clv' in fields:
+        customers = customers.annotate(clv=Subquery(
+            Transaction.objects.filter(customer=OuterRef('pk'))
+            .values('customer').annotate(total=Sum('amount')).values('total')
+        ))
+    if 'customer_product_risk' in fields:
+        customers = customers.select_related('risk_exposure')
+
+    prefetches = []
+    if 'products' in fields:
+        prefetches.append('products')
+    if 'recommended_service' in fields:
+        prefetches.append('recommended_services')
+    if 'churn_probability' in fields:
+        prefetches.append(Prefetch(
+            'churn_scores',
+            queryset=ChurnScore.objects.order_by('-scored_at')[:GRAPH_POINTS],
+            to_attr='latest_churn_scores',
+        ))
+    if 'transaction_history' in fields:
+        prefetches.append(Prefetch(
+            'transactions',
+            queryset=Transaction.objects.order_by('-transaction_date', '-transaction_id')[:DEFAULT_PAGE_SIZE],
+            to_attr='recent_transactions',
+        ))
+    return customers.prefetch_related(*prefetches)
@@ -0,0 +1,205 @@
+"""
+Keep the derived tables in step with writes to customers, products and
+transactions.
+
+There is one receiver per model and signal. A row's previous state is read
+once before it is written and its new state once after, and both are handed
+to every maintainer: the cache version, the daily rollups, risk exposures,
+the columnar snapshot, the daily sketches, cohort activity and the search
+index. Transactions deleted along with their customer are taken out in bulk
+when the customer goes, not one by one.
+"""
+from django.db.models import F, QuerySet
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cache, cohorts, risk, rollups, search, sketches, snapshot
+from .models import Customer, Product, Transaction
+
+
+def _transaction_values(transaction_id):
+    return (
+        Transaction.objects
+        .filter(transaction_id=transaction_id)
+        .values(
+            'customer_id', 'transaction_date', 'amount', 'is_anomalous', segment=F('customer__segment'),
+            category=F('product__category'), risk_factor=F('product__risk_factor'),
+        )
+        .first()
+    )
+
+
+def _product_values(product_id):
+    return Product.objects.filter(pk=product_id).values('name', 'category', 'risk_factor').first()
+
+
+def _days(transactions):
+    return set(transactions.annotate(day=TruncDate('transaction_date')).values_list('day', flat=True).distinct().order_by())
+
+
+def _cascaded_from_customer(origin):
+    return isinstance(origin, Customer) or (isinstance(origin, QuerySet) and origin.model is Customer)
+
+
+# Transactions: new ones are added to the sketches and cohorts and appended
+# to the snapshot; anything else makes the days involved wait for a rebuild.
+
+@receiver(pre_save, sender=Transaction)
+def remember_transaction(sender, instance, raw=False, **kwargs):
+    instance._previous = None
+    if not raw and instance.pk is not None:
+        instance._previous = _transaction_values(instance.pk)
+
+
+@receiver(post_save, sender=Transaction)
+def transaction_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        # Fixtures were not counted anywhere and may reuse exported ids
+        day = rollups.to_day(instance.transaction_date)
+        snapshot.mark_rewritten([instance.pk])
+        sketches.mark_stale([day])
+        cohorts.mark_stale([day])
+        return
+
+    previous = getattr(instance, '_previous', None)
+    current = _transaction_values(instance.pk)
+    cache.bump_data_version()
+    rollups.record_change(previous, current)
+    risk.record_change(previous, current)
+
+    if created:
+        snapshot.schedule_refresh()
+        sketches.record_transactions([current])
+        cohorts.record_transactions([current])
+        return
+    snapshot.mark_rewritten([instance.pk])
+    days = {rollups.to_day(instance.transaction_date)}
+    if previous is not None:
+        days.add(rollups.to_day(previous['transaction_date']))
+    sketches.mark_stale(days)
+    cohorts.mark_stale(days)
+
+
+@receiver(pre_delete, sender=Transaction)
+def remember_deleted_transaction(sender, instance, origin=None, **kwargs):
+    # Transactions cascaded away with their customer are handled by customer_deleting
+    instance._previous = None if _cascaded_from_customer(origin) else _transaction_values(instance.pk)
+
+
+@receiver(post_delete, sender=Transaction)
+def transaction_deleted(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    if previous is None:
+        return
+    cache.bump_data_version()
+    rollups.record_change(previous, None)
+    risk.record_change(previous, None)
+    snapshot.mark_rewritten([instance.pk])
+    day = rollups.to_day(previous['transaction_date'])
+    sketches.mark_stale([day])
+    cohorts.mark_stale([day])
+
+
+# Customers: signups are counted in the rollups; a segment or signup change
+# re-buckets the customer's transactions.
+
+@receiver(pre_save, sender=Customer)
+def remember_customer(sender, instance, raw=False, **kwargs):
+    instance._previous = None
+    if not raw and instance.pk is not None:
+        instance._previous = Customer.objects.filter(pk=instance.pk).values('signup_date', 'segment').first()
+
+
+@receiver(post_save, sender=Customer)
+def customer_saved(sender, instance, created, raw=False, **kwargs):
+    search.index([instance])
+    if raw:
+        return
+    cache.bump_data_version()
+    previous = getattr(instance, '_previous', None)
+    if previous is None:
+        rollups.record_signup(instance.signup_date, instance.segment)
+        return
+    moved = previous['segment'] != instance.segment
+    if not moved and previous['signup_date'] == instance.signup_date:
+        return
+
+    rollups.record_signup(previous['signup_date'], previous['segment'], sign=-1)
+    rollups.record_signup(instance.signup_date, instance.segment)
+    transactions = instance.transactions.all()
+    if moved:
+        rollups.move_transactions(transactions, previous['segment'], instance.segment)
+    days = _days(transactions)
+    if moved:
+        sketches.mark_stale(days)
+    # Cohorts depend on the signup month too
+    cohorts.mark_stale(days)
+
+
+@receiver(pre_delete, sender=Customer)
+def customer_deleting(sender, instance, **kwargs):
+    # The cascaded transactions still exist here; their exposure row goes with the customer
+    transactions = instance.transactions.all()
+    rollups.remove_transactions(transactions)
+    snapshot.mark_rewritten(transactions)
+    days = _days(transactions)
+    sketches.mark_stale(days)
+    cohorts.mark_stale(days)
+
+
+@receiver(post_delete, sender=Customer)
+def customer_deleted(sender, instance, **kwargs):
+    cache.bump_data_version()
+    rollups.record_signup(instance.signup_date, instance.segment, sign=-1)
+    search.remove([instance.pk])
+
+
+# Products: a category change re-buckets their transactions, a risk factor
+# change re-weighs them and a rename re-exports them to the snapshot. On
+# delete, surviving transactions lose the product.
+
+@receiver(pre_save, sender=Product)
+def remember_product(sender, instance, raw=False, **kwargs):
+    instance._previous = None
+    if not raw and instance.pk is not None:
+        instance._previous = _product_values(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    cache.bump_data_version()
+    previous = getattr(instance, '_previous', None)
+    if previous is None:
+        return
+    current = _product_values(instance.pk)
+    transactions = instance.transactions.all()
+    recategorized = previous['category'] != current['category']
+    if recategorized:
+        rollups.move_transactions(transactions, None, None, previous['category'], current['category'])
+        cohorts.mark_stale(_days(transactions))
+    if recategorized or previous['name'] != current['name']:
+        snapshot.mark_rewritten(transactions)
+    if recategorized or previous['risk_factor'] != current['risk_factor']:
+        risk.move_product(transactions, previous, current)
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance, origin=None, **kwargs):
+    # Transactions cascaded away with a deleted customer are handled by customer_deleting
+    transactions = instance.transactions.all()
+    if isinstance(origin, Customer):
+        transactions = transactions.exclude(customer=origin)
+    elif isinstance(origin, QuerySet) and origin.model is Customer:
+        transactions = transactions.exclude(customer__in=origin)
+    rollups.move_transactions(transactions, None, None, instance.category, '')
+    risk.move_product(transactions, {'category': instance.category, 'risk_factor': instance.risk_factor}, None)
+    snapshot.mark_rewritten(transactions)
+    cohorts.mark_stale(_days(transactions))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    cache.bump_data_version()
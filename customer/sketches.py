@@ -0,0 +1,351 @@
+"""
+Mergeable daily sketches of the transactions, per customer segment.
+
+Every DailySketch row holds a KLL quantile sketch of the amounts and a
+HyperLogLog of the customer ids of one day and segment. Sketches of any
+days and segments merge into a sketch of their union, so percentiles and
+distinct customers of an arbitrary range cost one indexed read of a few
+rows per day instead of a scan of the transactions.
+
+Error bounds, independent of the number of transactions:
+
+- Quantiles (KLL, K=200): the returned value's rank is within
+  RANK_ERROR (about 1.3%) of the requested one with 99% confidence, e.g.
+  "p95" lies between the true p93.7 and p96.3. Sketches that never
+  compacted (up to K transactions) are exact.
+- Distinct customers (HyperLogLog, 2^12 registers): relative standard
+  error DISTINCT_ERROR (about 1.6%); small counts are near exact.
+
+New transactions are added as they arrive. Sketches cannot subtract, so
+updates, deletes and segment changes mark the affected days stale instead,
+and ``refresh()`` rebuilds those days from the transactions before they
+are read (``python manage.py rebuild_sketches`` rebuilds any range).
+"""
+import math
+import random
+import struct
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import TruncDate
+
+from . import replicas, windows
+from .models import DailySketch, Transaction
+from .rollups import to_day
+
+K = 200
+RANK_ERROR = 2.296 / K ** 0.9723
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+DISTINCT_ERROR = 1.04 / math.sqrt(HLL_REGISTERS)
+QUANTILES = {'p50': 0.5, 'p95': 0.95, 'p99': 0.99}
+REBUILD_CHUNK = 50  # stale days rebuilt per query
+
+_random = random.Random()
+
+
+class KLL:
+    """
+    KLL quantile sketch: ``levels[h]`` holds items of weight 2**h. A level
+    over its capacity is sorted and every other item, starting at a random
+    offset, moves up a level; capacities shrink by 2/3 per level below the
+    top, so a sketch keeps about 3K items however many it has seen.
+    """
+
+    def __init__(self, levels=None, count=0):
+        self.levels = levels or [np.empty(0)]
+        self.count = count
+
+    def _capacity(self, level):
+        return max(math.ceil(K * (2 / 3) ** (len(self.levels) - level - 1)), 2)
+
+    def _compress(self):
+        while True:
+            level = next(
+                (index for index, items in enumerate(self.levels) if len(items) >= self._capacity(index)),
+                None,
+            )
+            if level is None:
+                return
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(self.levels[level])
+            kept = items[len(items) - len(items) % 2:]
+            promoted = items[_random.randint(0, 1):len(items) - len(kept):2]
+            self.levels[level] = kept
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self._compress()
+
+    @classmethod
+    def merged(cls, sketches):
+        """One sketch of everything ``sketches`` have seen, compacted once."""
+        sketches = list(sketches)
+        depth = max((len(sketch.levels) for sketch in sketches), default=1)
+        levels = [
+            np.concatenate([sketch.levels[level] for sketch in sketches if level < len(sketch.levels)] or [np.empty(0)])
+            for level in range(depth)
+        ]
+        result = cls(levels, sum(sketch.count for sketch in sketches))
+        result._compress()
+        return result
+
+    def quantiles(self, fractions):
+        """The estimated value at each fraction of ``fractions``, or None for an empty sketch."""
+        if not self.count:
+            return [None] * len(fractions)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_items), 1 << level) for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items, ranks = items[order], np.cumsum(weights[order])
+        positions = np.searchsorted(ranks, [fraction * ranks[-1] for fraction in fractions], side='left')
+        return [float(items[min(position, len(items) - 1)]) for position in positions]
+
+    def to_bytes(self):
+        sizes = [len(items) for items in self.levels]
+        header = struct.pack(f'<QI{len(sizes)}I', self.count, len(sizes), *sizes)
+        return header + np.concatenate(self.levels).astype('<f8').tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data:
+            return cls()
+        count, depth = struct.unpack_from('<QI', data)
+        sizes = struct.unpack_from(f'<{depth}I', data, 12)
+        items = np.frombuffer(data, dtype='<f8', offset=12 + 4 * depth)
+        bounds = np.cumsum((0, *sizes))
+        return cls([items[start:end].copy() for start, end in zip(bounds[:-1], bounds[1:])], count)
+
+
+def _hash64(values):
+    # splitmix64 finalizer; unsigned arithmetic wraps modulo 2**64
+    value = np.asarray(values, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    value = (value ^ (value >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    value = (value ^ (value >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return value ^ (value >> np.uint64(31))
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter; merging takes the register-wise maximum."""
+
+    def __init__(self, registers=None):
+        self.registers = np.zeros(HLL_REGISTERS, dtype=np.uint8) if registers is None else registers
+
+    def update(self, values):
+        hashes = _hash64(values)
+        index = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - HLL_PRECISION)) - 1)
+        # Leading zeros of the remaining 52 bits plus one; they convert to float exactly
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        np.maximum.at(self.registers, index, (64 - HLL_PRECISION - bit_length + 1).astype(np.uint8))
+
+    @classmethod
+    def merged(cls, sketches):
+        registers = [sketch.registers for sketch in sketches]
+        return cls(np.maximum.reduce(registers) if registers else None)
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+        estimate = alpha * HLL_REGISTERS ** 2 / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int64))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * HLL_REGISTERS and zeros:
+            # Linear counting is more accurate while many registers are empty
+            estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        return zlib.compress(self.registers.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data:
+            return cls()
+        return cls(np.frombuffer(zlib.decompress(data), dtype=np.uint8).copy())
+
+
+def _group(rows):
+    """
+    ``{(day, segment): (amounts, customer ids)}`` of transaction value dicts,
+    which carry either their ``day`` or their ``transaction_date``.
+    """
+    groups = defaultdict(lambda: ([], []))
+    for values in rows:
+        day = values['day'] if 'day' in values else to_day(values['transaction_date'])
+        amounts, customer_ids = groups[(day, values['segment'] or '')]
+        amounts.append(float(values['amount']))
+        customer_ids.append(values['customer_id'])
+    return groups
+
+
+def record_transactions(rows):
+    """
+    Add new transactions, given dicts with their transaction_date, amount,
+    customer_id and segment, to the sketches of their days. Stale days are
+    left for their rebuild.
+    """
+    groups = _group(rows)
+    if not groups:
+        return
+    with transaction.atomic():
+        # Insert missing rows first, which on SQLite also takes the write lock
+        DailySketch.objects.bulk_create(
+            [DailySketch(day=day, segment=segment) for day, segment in groups],
+            ignore_conflicts=True,
+        )
+        sketches = DailySketch.objects.select_for_update().filter(
+            day__in={day for day, _ in groups}, segment__in={segment for _, segment in groups}, stale=False,
+        )
+        updated = []
+        for sketch in sketches:
+            group = groups.get((sketch.day, sketch.segment))
+            if group is None:
+                continue
+            amounts, customers = KLL.from_bytes(bytes(sketch.amounts)), HyperLogLog.from_bytes(bytes(sketch.customers))
+            amounts.update(group[0])
+            customers.update(group[1])
+            sketch.transaction_count += len(group[0])
+            sketch.amounts, sketch.customers = amounts.to_bytes(), customers.to_bytes()
+            updated.append(sketch)
+        DailySketch.objects.bulk_update(updated, ['transaction_count', 'amounts', 'customers'])
+
+
+def mark_stale(days):
+    """Flag ``days`` for a rebuild; called for transactions that changed or went away."""
+    days = set(days)
+    if not days:
+        return
+    with transaction.atomic():
+        DailySketch.objects.bulk_create(
+            [DailySketch(day=day, segment='', stale=True) for day in days], ignore_conflicts=True,
+        )
+        DailySketch.objects.filter(day__in=days).update(stale=True)
+
+
+def mark_stale_transactions(queryset):
+    """Flag the days of the transactions in ``queryset``, e.g. after their customer changed segment."""
+    mark_stale(
+        queryset.annotate(day=TruncDate('transaction_date')).values_list('day', flat=True).distinct().order_by()
+    )
+
+
+def _build(rows):
+    """New DailySketch rows for transaction value dicts covering whole days."""
+    sketches = []
+    for (day, segment), (amounts, customer_ids) in _group(rows).items():
+        kll, hll = KLL(), HyperLogLog()
+        kll.update(amounts)
+        hll.update(customer_ids)
+        sketches.append(DailySketch(
+            day=day, segment=segment, transaction_count=len(amounts),
+            amounts=kll.to_bytes(), customers=hll.to_bytes(),
+        ))
+    return sketches
+
+
+def _values(transactions):
+    # The database buckets the days, as for the rollups
+    return transactions.values(
+        'amount', 'customer_id', day=TruncDate('transaction_date'), segment=F('customer__segment'),
+    )
+
+
+def _rebuild_days(days):
+    condition = Q()
+    for day in days:
+        condition |= windows.Window(day, 'day').q('transaction_date')
+    sketches = _build(_values(Transaction.objects.filter(condition)).iterator())
+    with transaction.atomic():
+        DailySketch.objects.filter(day__in=days).delete()
+        DailySketch.objects.bulk_create(sketches, batch_size=500)
+
+
+def refresh(window):
+    """Rebuild the stale days of ``window``; returns how many there were."""
+    with replicas.primary():
+        days = sorted(set(
+            DailySketch.objects.filter(window.q_days('day'), stale=True).values_list('day', flat=True)
+        ))
+        for start in range(0, len(days), REBUILD_CHUNK):
+            _rebuild_days(days[start:start + REBUILD_CHUNK])
+    return len(days)
+
+
+def rebuild(start=None, end=None):
+    """
+    Recompute the sketches of the days in [start, end] (both optional,
+    inclusive) from the transactions. Returns the number of days written.
+    """
+    transactions = Transaction.objects.all()
+    existing = DailySketch.objects.all()
+    if start:
+        transactions = transactions.filter(transaction_date__gte=windows.Window(start, 'day').start)
+        existing = existing.filter(day__gte=start)
+    if end:
+        transactions = transactions.filter(transaction_date__lt=windows.Window(end, 'day').end)
+        existing = existing.filter(day__lte=end)
+
+    days = set()
+    with transaction.atomic():
+        existing.delete()
+        # Ordered by date, so each day is complete once the next one starts
+        batch, current_day = [], None
+        for values in _values(transactions.order_by('transaction_date')).iterator(chunk_size=5000):
+            day = values['day']
+            if day != current_day and batch:
+                DailySketch.objects.bulk_create(_build(batch))
+                batch = []
+            current_day = day
+            days.add(day)
+            batch.append(values)
+        if batch:
+            DailySketch.objects.bulk_create(_build(batch))
+    return len(days)
+
+
+def summarize(sketches):
+    """Percentiles and distinct customers of the merged ``sketches`` (DailySketch rows)."""
+    sketches = list(sketches)
+    amounts = KLL.merged(KLL.from_bytes(bytes(sketch.amounts)) for sketch in sketches)
+    customers = HyperLogLog.merged(HyperLogLog.from_bytes(bytes(sketch.customers)) for sketch in sketches)
+    values = amounts.quantiles(list(QUANTILES.values()))
+    return {
+        'transaction_count': sum(sketch.transaction_count for sketch in sketches),
+        **{name: None if value is None else round(value, 2) for name, value in zip(QUANTILES, values)},
+        'distinct_customers': customers.estimate(),
+    }
+
+
+def distribution(window, segment=None):
+    """
+    Percentiles and distinct customers over ``window`` and per bucket of it,
+    optionally for one customer segment, from the stored daily sketches.
+    """
+    refresh(window)
+    sketches = DailySketch.objects.filter(window.q_days('day'), transaction_count__gt=0)
+    if segment is not None:
+        sketches = sketches.filter(segment=segment)
+    sketches = list(sketches.only('day', 'transaction_count', 'amounts', 'customers'))
+
+    buckets = defaultdict(list)
+    for sketch in sketches:
+        bucket = sketch.day if window.custom else windows.period_start(sketch.day, window.period)
+        buckets[bucket].append(sketch)
+    return {
+        'period': window.name,
+        'start_date': window.first_day,
+        'end_date': window.last_day,
+        'segment': segment,
+        'error_bounds': {
+            'quantile_rank_error': RANK_ERROR,
+            'distinct_customers_relative_error': DISTINCT_ERROR,
+        },
+        'summary': summarize(sketches),
+        'periods': [{'period': day, **summarize(buckets.get(day, []))} for day in window.buckets()],
+    }
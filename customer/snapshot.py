@@ -0,0 +1,507 @@
+"""
+Columnar, memory-mapped snapshot of the transactions table for analytics.
+
+The transactions are split into segments of ``SEGMENT_IDS`` consecutive ids,
+and every column of a segment is a raw NumPy file in the segment's directory
+under CUSTOMER_SNAPSHOT['DIR']. meta.json lists the segments with their row
+counts, the last exported transaction id and the data versions the files
+reflect. Readers map the files read-only, so all worker processes share the
+same page-cache pages instead of each holding a copy, and
+CustomerInsightsView and ProductUsageView aggregate them with vectorized
+operations instead of scanning the table.
+
+``manage.py refresh_snapshot`` builds it. After that, writers keep it up
+to date in a background thread, never in a request: new transactions are
+appended to the last segment, and a write that rewrites exported rows (an
+update, a delete, a product change, re-scored anomalies) bumps the data
+version of their segments, which are then exported again into new
+directories. Until that has happened, readers
+take the rows the files do not reflect yet, the stale segments and the
+transactions after the last exported id, from the ORM and combine them
+with the rest. Only ``mark_rewritten()`` without transactions, and a
+missing snapshot, make readers fall back to the ORM entirely, which is
+logged and counted in ``customer_snapshot_reads_total``; the background
+thread never rebuilds, that is left to the command as well.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Q, QuerySet, Sum
+from django.utils import timezone
+
+from . import cache, metrics
+from .models import DataVersion, Transaction
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+REWRITES = 'transaction-rewrites'
+COLUMNS = {
+    'transaction_id': np.int64,
+    'timestamp': np.int64,  # microseconds since the Unix epoch
+    'amount_cents': np.int64,
+    'customer_id': np.int32,
+    'product_id': np.int32,  # NO_PRODUCT once the product was deleted
+    'product_name': np.int32,  # index into meta['product_names']; '' for no product
+    'category': np.int8,  # index into meta['categories']; '' for no product
+    'is_anomalous': np.bool_,
+}
+NO_PRODUCT = -1
+EXPORT_CHUNK = 50000
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    'DIR': None,  # BASE_DIR / 'snapshot'
+    'SEGMENT_IDS': 1 << 16,
+}
+
+
+def get_config():
+    config = {**DEFAULT_CONFIG, **getattr(settings, 'CUSTOMER_SNAPSHOT', {})}
+    config['DIR'] = str(config['DIR'] or settings.BASE_DIR / 'snapshot')
+    return config
+
+
+def _segment_version_name(segment):
+    return f'{REWRITES}:{segment}'
+
+
+def mark_rewritten(transactions=None):
+    """
+    Record that exported rows changed, and export them again in the
+    background: those of ``transactions`` (a queryset or transaction ids,
+    read before they are deleted). With None all of them changed, and the
+    snapshot waits for ``manage.py refresh_snapshot`` to rebuild it. Called
+    from signals and bulk writers.
+    """
+    if transactions is None:
+        cache.bump_data_version(REWRITES)
+    else:
+        size = get_config()['SEGMENT_IDS']
+        if isinstance(transactions, QuerySet):
+            segments = set(
+                transactions.annotate(segment=F('transaction_id') / size)
+                .values_list('segment', flat=True).distinct().order_by()
+            )
+        else:
+            segments = {int(transaction_id) // size for transaction_id in transactions}
+        for segment in sorted(segments):
+            cache.bump_data_version(_segment_version_name(segment))
+    schedule_refresh()
+
+
+def _versions():
+    """``(data version, rewrites, {segment: version})``, in one query."""
+    data_version, rewrites, segments = 0, 0, {}
+    rows = DataVersion.objects.filter(Q(name=cache.DATA_VERSION_NAME) | Q(name__startswith=REWRITES))
+    for name, version in rows.values_list('name', 'version'):
+        if name == cache.DATA_VERSION_NAME:
+            data_version = version
+        elif name == REWRITES:
+            rewrites = version
+        else:
+            segments[int(name.rpartition(':')[2])] = version
+    return data_version, rewrites, segments
+
+
+@contextmanager
+def _locked(directory):
+    # Serializes writers across processes; readers never wait
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'lock'), 'a+b') as handle:
+        if fcntl:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _read_meta(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+    except FileNotFoundError:
+        return None
+    # Snapshots written before segments existed are rebuilt
+    return meta if 'segments' in meta else None
+
+
+def _write_meta(directory, meta):
+    # Readers see either the old or the new meta, never a partial one
+    temporary = os.path.join(directory, f'meta.{uuid.uuid4().hex}.tmp')
+    with open(temporary, 'w', encoding='utf-8') as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(temporary, os.path.join(directory, 'meta.json'))
+
+
+def _column_path(directory, entry, name):
+    return os.path.join(directory, entry['path'], f'{name}.bin')
+
+
+def _micros(value):
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _codes(names):
+    return {name: code for code, name in enumerate(names)}
+
+
+def _encode(values, names, codes):
+    # New names are added to ``names``, which the meta stores
+    for name in set(values):
+        if (name or '') not in codes:
+            codes[name or ''] = len(names)
+            names.append(name or '')
+    return [codes[name or ''] for name in values]
+
+
+def _export(after_id, last_id, meta):
+    """
+    Yield the columns of the transactions with ids in ``(after_id,
+    last_id]`` (no upper bound when None), in id order and a chunk at a time.
+    """
+    category_codes, name_codes = _codes(meta['categories']), _codes(meta['product_names'])
+    while True:
+        rows = Transaction.objects.filter(transaction_id__gt=after_id)
+        if last_id is not None:
+            rows = rows.filter(transaction_id__lte=last_id)
+        rows = list(
+            rows.order_by('transaction_id')
+            .values_list('transaction_id', 'transaction_date', 'amount', 'customer_id', 'product_id',
+                         'product__name', 'product__category', 'is_anomalous')[:EXPORT_CHUNK]
+        )
+        if not rows:
+            return
+        ids, dates, amounts, customer_ids, product_ids, names, categories, anomalous = zip(*rows)
+        yield {
+            'transaction_id': np.array(ids, dtype=np.int64),
+            'timestamp': np.array([_micros(value) for value in dates], dtype=np.int64),
+            'amount_cents': np.array([int(value.scaleb(2)) for value in amounts], dtype=np.int64),
+            'customer_id': np.array(customer_ids, dtype=np.int32),
+            'product_id': np.array([NO_PRODUCT if value is None else value for value in product_ids], dtype=np.int32),
+            'product_name': np.array(_encode(names, meta['product_names'], name_codes), dtype=np.int32),
+            'category': np.array(_encode(categories, meta['categories'], category_codes), dtype=np.int8),
+            'is_anomalous': np.array(anomalous, dtype=np.bool_),
+        }
+        after_id = ids[-1]
+
+
+def _open_segment(directory, meta, segment):
+    entry = meta['segments'].get(str(segment))
+    if entry is None:
+        entry = meta['segments'][str(segment)] = {'path': f's{segment}-{uuid.uuid4().hex[:12]}', 'rows': 0}
+        os.makedirs(os.path.join(directory, entry['path']))
+        return {name: open(_column_path(directory, entry, name), 'w+b') for name in COLUMNS}
+    handles = {name: open(_column_path(directory, entry, name), 'r+b') for name in COLUMNS}
+    for name, handle in handles.items():
+        # Drop whatever an append that died before writing its meta left behind
+        handle.truncate(entry['rows'] * np.dtype(COLUMNS[name]).itemsize)
+        handle.seek(0, os.SEEK_END)
+    return handles
+
+
+def _export_rows(directory, meta, after_id, last_id=None):
+    """Write the transactions with ids in ``(after_id, last_id]`` to the files of their segments."""
+    size = meta['segment_ids']
+    open_segments = {}
+    try:
+        for chunk in _export(after_id, last_id, meta):
+            segments = chunk['transaction_id'] // size
+            # Ids are sorted, so every segment is one run of the chunk
+            boundaries = np.flatnonzero(np.diff(segments)) + 1
+            for start, end in zip([0, *boundaries], [*boundaries, len(segments)]):
+                segment = int(segments[start])
+                if segment not in open_segments:
+                    open_segments[segment] = _open_segment(directory, meta, segment)
+                for name, handle in open_segments[segment].items():
+                    chunk[name][start:end].tofile(handle)
+                meta['segments'][str(segment)]['rows'] += int(end - start)
+            meta['last_id'] = max(meta['last_id'], int(chunk['transaction_id'][-1]))
+    finally:
+        for handles in open_segments.values():
+            for handle in handles.values():
+                handle.close()
+    meta['rows'] = sum(entry['rows'] for entry in meta['segments'].values())
+    return meta
+
+
+def _remove_unused(directory, meta):
+    # Processes still mapping an old segment keep reading it until their
+    # next request; on POSIX the unlinked pages stay valid till then
+    used = {entry['path'] for entry in meta['segments'].values()}
+    for entry in os.listdir(directory):
+        if entry not in used and os.path.isdir(os.path.join(directory, entry)):
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+
+def rebuild():
+    """Export every transaction into new segments and switch readers over to them."""
+    config = get_config()
+    directory = config['DIR']
+    with _locked(directory):
+        # Read before exporting: later writes make the snapshot look stale, never current
+        data_version, rewrites, segment_versions = _versions()
+        meta = {
+            'segment_ids': config['SEGMENT_IDS'], 'segments': {}, 'rows': 0, 'last_id': 0,
+            'categories': [''], 'product_names': [''],
+            'data_version': data_version, 'rewrites': rewrites, 'versions': _version_keys(segment_versions),
+            'built_at': timezone.now().isoformat(),
+        }
+        meta = _export_rows(directory, meta, 0)
+        _write_meta(directory, meta)
+        _remove_unused(directory, meta)
+    return meta
+
+
+def _version_keys(segment_versions):
+    # JSON object keys are strings
+    return {str(segment): version for segment, version in segment_versions.items()}
+
+
+def _stale_segments(meta, segment_versions):
+    return sorted(
+        segment for segment, version in segment_versions.items() if meta['versions'].get(str(segment)) != version
+    )
+
+
+def update():
+    """
+    Export the stale segments again and append transactions added since the
+    last refresh. Returns the new meta, or None when there is no snapshot or
+    every exported row may have changed, so that only a rebuild brings it up
+    to date.
+    """
+    config = get_config()
+    directory = config['DIR']
+    with _locked(directory):
+        meta = _read_meta(directory)
+        data_version, rewrites, segment_versions = _versions()
+        if meta is None or meta['rewrites'] != rewrites or meta['segment_ids'] != config['SEGMENT_IDS']:
+            return None
+        stale = _stale_segments(meta, segment_versions)
+        if not stale and meta['data_version'] == data_version:
+            return meta
+        meta = {**meta, 'data_version': data_version, 'versions': _version_keys(segment_versions),
+                'segments': dict(meta['segments']), 'categories': list(meta['categories']),
+                'product_names': list(meta['product_names'])}
+        size = meta['segment_ids']
+        for segment in stale:
+            if segment * size > meta['last_id']:
+                # Not exported yet; the append below takes care of it
+                continue
+            # Into a new directory, which stays out of the meta when every row
+            # is gone: readers keep mapping the old one until the meta moves on
+            meta['segments'].pop(str(segment), None)
+            _export_rows(directory, meta, segment * size - 1, min((segment + 1) * size - 1, meta['last_id']))
+        meta = _export_rows(directory, meta, meta['last_id'])
+        _write_meta(directory, meta)
+        _remove_unused(directory, meta)
+    return meta
+
+
+def refresh(force_rebuild=False):
+    """Bring the snapshot up to date, updating it when possible; returns ``(meta, rebuilt)``."""
+    meta = None if force_rebuild else update()
+    if meta is not None:
+        return meta, False
+    return rebuild(), True
+
+
+_refresher = None
+_refresh_again = False
+_refresher_lock = threading.Lock()
+
+
+def _refresh_in_background():
+    global _refresher, _refresh_again
+    try:
+        while True:
+            with _refresher_lock:
+                if not _refresh_again:
+                    _refresher = None
+                    return
+                _refresh_again = False
+            try:
+                if update() is None:
+                    logger.warning("The transaction snapshot needs a rebuild: run `manage.py refresh_snapshot`")
+            except Exception:
+                logger.exception("Could not refresh the transaction snapshot")
+    finally:
+        connections.close_all()
+
+
+def _start_refresh():
+    global _refresher, _refresh_again
+    with _refresher_lock:
+        # Writes arriving while a refresh runs are picked up by one more round
+        _refresh_again = True
+        if _refresher is None:
+            _refresher = threading.Thread(target=_refresh_in_background, name='snapshot-refresh')
+            _refresher.start()
+
+
+def schedule_refresh():
+    """
+    Update the snapshot in a background thread once the current transaction
+    commits. Nothing happens until the snapshot was built, which is too slow
+    for a web worker.
+    """
+    config = get_config()
+    if config['ENABLED'] and os.path.exists(os.path.join(config['DIR'], 'meta.json')):
+        transaction.on_commit(_start_refresh)
+
+
+class Snapshot:
+    """
+    The read-only column arrays of the up-to-date segments of one snapshot
+    state, and ``pending``, a Q of the transactions they do not reflect
+    (None when there are none).
+    """
+
+    def __init__(self, meta, segments, pending):
+        self.meta = meta
+        self.categories = meta['categories']
+        self.product_names = meta['product_names']
+        self.segments = segments
+        self.rows = sum(len(columns['transaction_id']) for columns in segments)
+        self.pending = pending
+
+    def pending_transactions(self):
+        return Transaction.objects.filter(self.pending)
+
+
+_mapped = {}
+_mapped_lock = threading.Lock()
+_fallback_logged = None
+
+
+def _map(directory, entry):
+    # Mapping is cheap but not free, so reuse it until the segment moves on
+    key = (directory, entry['path'], entry['rows'])
+    columns = _mapped.get(key)
+    if columns is None:
+        columns = {}
+        for name, dtype in COLUMNS.items():
+            if entry['rows']:
+                columns[name] = np.memmap(_column_path(directory, entry, name), dtype=dtype, mode='r',
+                                          shape=(entry['rows'],))
+            else:
+                columns[name] = np.empty(0, dtype=dtype)
+        _mapped[key] = columns
+    return key, columns
+
+
+def _fall_back(reason):
+    global _fallback_logged
+    metrics.SNAPSHOT_READS.inc(reason)
+    if _fallback_logged != reason:
+        _fallback_logged = reason
+        logger.warning("Transaction snapshot unavailable (%s); reading transactions from the database", reason)
+    return None
+
+
+def load():
+    """
+    The current snapshot, or None while it is disabled, not built yet or
+    waiting for a rebuild. Never writes: rows the files do not reflect yet
+    are left to the ORM through ``Snapshot.pending``.
+    """
+    global _fallback_logged
+    config = get_config()
+    if not config['ENABLED']:
+        return None
+    directory = config['DIR']
+    meta = _read_meta(directory)
+    if meta is None:
+        return _fall_back('missing')
+    data_version, rewrites, segment_versions = _versions()
+    if meta['rewrites'] != rewrites or meta['segment_ids'] != config['SEGMENT_IDS']:
+        return _fall_back('rebuilding')
+
+    stale = set(_stale_segments(meta, segment_versions))
+    size = meta['segment_ids']
+    pending = [Q(transaction_id__gte=segment * size, transaction_id__lt=(segment + 1) * size) for segment in stale]
+    if meta['data_version'] != data_version:
+        pending.append(Q(transaction_id__gt=meta['last_id']))
+    segments = []
+    with _mapped_lock:
+        try:
+            keys = set()
+            for segment, entry in meta['segments'].items():
+                if int(segment) not in stale:
+                    key, columns = _map(directory, entry)
+                    keys.add(key)
+                    segments.append(columns)
+        except FileNotFoundError:
+            # A refresh replaced the segment after the meta was read
+            return _fall_back('refreshing')
+        for key in set(_mapped) - keys:
+            del _mapped[key]
+    _fallback_logged = None
+    metrics.SNAPSHOT_READS.inc('partial' if pending else 'snapshot')
+    combined = None
+    for condition in pending:
+        combined = condition if combined is None else combined | condition
+    return Snapshot(meta, segments, combined)
+
+
+def average_amount(snapshot, start, end):
+    """Mean amount of the transactions dated within ``[start, end)``, or None when there are none."""
+    count, cents = 0, 0
+    low, high = _micros(start), _micros(end)
+    for columns in snapshot.segments:
+        timestamps = columns['timestamp']
+        mask = (timestamps >= low) & (timestamps < high)
+        count += int(np.count_nonzero(mask))
+        cents += int(columns['amount_cents'][mask].sum())
+    if snapshot.pending is not None:
+        rest = snapshot.pending_transactions().filter(transaction_date__gte=start, transaction_date__lt=end).aggregate(
+            count=Count('pk'), total=Sum('amount'),
+        )
+        count += rest['count']
+        cents += int(Decimal(rest['total'] or 0).quantize(Decimal('0.01')).scaleb(2))
+    if not count:
+        return None
+    return Decimal(cents) / count / 100
+
+
+def product_usage(snapshot):
+    """``{product name: transactions}``, busiest first, as ProductUsageView returns it."""
+    counts = np.zeros(len(snapshot.product_names), dtype=np.int64)
+    for columns in snapshot.segments:
+        counts += np.bincount(columns['product_name'], minlength=len(counts))
+    usage = {name: int(count) for name, count in zip(snapshot.product_names, counts) if name and count}
+    # The ORM groups transactions without a product under None, counting 0 of them
+    if counts[0]:
+        usage[None] = 0
+    if snapshot.pending is not None:
+        rest = snapshot.pending_transactions().values('product__name').annotate(count=Count('product')).order_by()
+        for row in rest:
+            usage[row['product__name']] = usage.get(row['product__name'], 0) + row['count']
+    return dict(sorted(usage.items(), key=lambda item: -item[1]))
@@ -0,0 +1,193 @@
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import cache, cohorts, risk, rollups, search, sketches, snapshot
+from .models import (
+    ChurnScore, CohortActivity, CohortMonth, Customer, DailyRollup, DailySegmentRollup, DailySketch, Product,
+    ProductRiskExposure, RecommendedService, SegmentationRun, Transaction,
+)
+
+SEGMENTS = ('High', 'Low', 'Barely')
+SEGMENT_SHARES = (0.15, 0.50, 0.35)
+# Per segment: relative transaction rate, extra products (Poisson mean),
+# lognormal mean of log(amount), and the skew of activity over a customer's
+# lifetime (<1 towards recent, >1 towards their signup)
+SEGMENT_PROFILES = {
+    'High': {'rate': 5.0, 'products': 2.0, 'log_amount': 5.5, 'activity_skew': 0.7},
+    'Low': {'rate': 2.0, 'products': 1.0, 'log_amount': 4.0, 'activity_skew': 1.0},
+    'Barely': {'rate': 0.5, 'products': 0.3, 'log_amount': 3.0, 'activity_skew': 2.5},
+}
+# name: (category, risk factor, popularity)
+CATALOG = {
+    'Savings Account': ('Deposit', '0.10', 10),
+    'Fixed Deposit': ('Deposit', '0.20', 4),
+    'Recurring Deposit': ('Deposit', '0.15', 2),
+    'Mobile Banking': ('Banking', '0.30', 8),
+    'Internet Banking': ('Banking', '0.25', 5),
+    'Credit Card': ('Banking', '0.60', 6),
+    'Personal Loan': ('Loan', '0.80', 3),
+    'Car Loan': ('Loan', '0.50', 2),
+    'Home Loan': ('Loan', '0.40', 2),
+}
+FIRST_NAMES = ('Alice', 'Bob', 'Carol', 'David', 'Emma', 'Fiona', 'George', 'Hannah', 'Ivan', 'Julia', 'Kevin', 'Laura')
+LAST_NAMES = ('Smith', 'Johnson', 'Brown', 'Garcia', 'Miller', 'Davis', 'Wilson', 'Moore', 'Taylor', 'Scott')
+REFUND_RATE = 0.08
+ANOMALY_RATE = 0.005
+MAX_AMOUNT = 99_999_999.99
+DEFAULT_BATCH_SIZE = 10000
+# Transactions are drawn in fixed chunks, each from its own seeded
+# generator, so the data does not depend on the insert batch size
+GENERATION_CHUNK = 100000
+
+
+def _insert(model, fields, rows):
+    """Plain multi-row INSERT, bypassing model instances, signals and auto_now_add."""
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows)
+
+
+def clear():
+    """Delete every customer and everything derived from them, without signals."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Children first, so foreign keys hold at every step
+        for model in (Transaction, Product, RecommendedService, ChurnScore, ProductRiskExposure,
+                      Customer, DailyRollup, DailySegmentRollup, DailySketch, CohortActivity, CohortMonth,
+                      SegmentationRun):
+            cursor.execute(f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)}")
+        search.rebuild()
+        cache.bump_data_version()
+        snapshot.mark_rewritten()
+
+
+def _datetimes(start, seconds):
+    adapt = connection.ops.adapt_datetimefield_value
+    return [adapt(start + timedelta(seconds=value)) for value in seconds.tolist()]
+
+
+def generate(customers, transactions, seed=0, years=3, end=None, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    """
+    Insert ``customers`` customers with their products and ``transactions``
+    transactions. The same seed, sizes and ``end`` date on the same starting
+    database produce the same rows. Rollups, sketches, cohorts, the search
+    index, risk exposures and the cache version are brought up to date at
+    the end, since the inserts skip the model signals.
+
+    ``on_batch(table, inserted)`` is called after every batch.
+    """
+    if transactions and not customers:
+        raise ValueError("Transactions need at least one customer")
+    rng = np.random.default_rng(seed)
+    end = end or timezone.localdate()
+    end = timezone.make_aware(datetime.combine(end, time.min))
+    span = timedelta(days=365 * years).total_seconds()
+    start = end - timedelta(seconds=span)
+    first_customer = (Customer.objects.aggregate(last=Max('customer_id'))['last'] or 0) + 1
+    first_product = (Product.objects.aggregate(last=Max('product_id'))['last'] or 0) + 1
+    first_transaction = (Transaction.objects.aggregate(last=Max('transaction_id'))['last'] or 0) + 1
+
+    # Customers: signups grow over time
+    segment_index = rng.choice(len(SEGMENTS), size=customers, p=SEGMENT_SHARES)
+    signup = rng.power(2.0, size=customers) * span
+    first_names = rng.integers(len(FIRST_NAMES), size=customers)
+    last_names = rng.integers(len(LAST_NAMES), size=customers)
+    age_days = rng.integers(18 * 365, 80 * 365, size=customers)
+    profiles = [SEGMENT_PROFILES[segment] for segment in SEGMENTS]
+
+    # Products: at least one per customer, more for valuable segments
+    names = list(CATALOG)
+    popularity = np.array([CATALOG[name][2] for name in names], dtype=np.float64)
+    product_counts = 1 + np.minimum(rng.poisson(np.array([p['products'] for p in profiles])[segment_index]), 4)
+    product_starts = np.r_[0, np.cumsum(product_counts)[:-1]].astype(np.int64)
+    product_owners = np.repeat(np.arange(customers), product_counts)
+    product_names = rng.choice(len(names), size=len(product_owners), p=popularity / popularity.sum())
+
+    # Transactions: spread by segment rate and time since signup
+    weights = np.array([p['rate'] for p in profiles])[segment_index] * (span - signup)
+    transaction_counts = rng.multinomial(transactions, weights / weights.sum()) if customers else np.zeros(0, np.int64)
+
+    with transaction.atomic():
+        for offset in range(0, customers, batch_size):
+            stop = min(offset + batch_size, customers)
+            signups = _datetimes(start, signup[offset:stop])
+            rows = []
+            for position, index in enumerate(range(offset, stop)):
+                customer_id = first_customer + index
+                signup_day = (start + timedelta(seconds=float(signup[index]))).date()
+                rows.append((
+                    customer_id,
+                    f"{FIRST_NAMES[first_names[index]]} {LAST_NAMES[last_names[index]]}",
+                    f"customer{customer_id}@synthetic.example.com",
+                    f"555{customer_id:07d}",
+                    f"{customer_id} Synthetic St",
+                    signup_day - timedelta(days=int(age_days[index])),
+                    signups[position],
+                    SEGMENTS[segment_index[index]],
+                    'customer_images/default.jpg',
+                ))
+            _insert(Customer, ('customer_id', 'name', 'email', 'phone_number', 'address', 'date_of_birth',
+                               'signup_date', 'segment', 'profile_image'), rows)
+            if on_batch:
+                on_batch('customers', stop)
+
+        product_fields = ('product_id', 'customer', 'name', 'description', 'category', 'risk_factor')
+        for offset in range(0, len(product_owners), batch_size):
+            rows = []
+            for product_index in range(offset, min(offset + batch_size, len(product_owners))):
+                name = names[product_names[product_index]]
+                category, risk_factor, _ = CATALOG[name]
+                rows.append((first_product + product_index, first_customer + int(product_owners[product_index]),
+                             name, f"{name} ({category})", category, risk_factor))
+            _insert(Product, product_fields, rows)
+            if on_batch:
+                on_batch('products', offset + len(rows))
+
+        inserted = 0
+        customer_ends = np.cumsum(transaction_counts)
+        for chunk, chunk_start in enumerate(range(0, transactions, GENERATION_CHUNK)):
+            rng = np.random.default_rng([seed, chunk])
+            size = min(GENERATION_CHUNK, transactions - chunk_start)
+            owner = np.searchsorted(customer_ends, np.arange(chunk_start, chunk_start + size), side='right')
+            segment = segment_index[owner]
+            skew = np.array([p['activity_skew'] for p in profiles])[segment]
+            moment = signup[owner] + rng.random(size) ** skew * (span - signup[owner])
+
+            amount = rng.lognormal(np.array([p['log_amount'] for p in profiles])[segment], 1.0)
+            amount = np.where(rng.random(size) < REFUND_RATE, -amount, amount)
+            anomalous = rng.random(size) < ANOMALY_RATE
+            amount = np.where(anomalous, amount * rng.uniform(10, 50, size), amount)
+            amount = np.clip(np.round(amount, 2), -MAX_AMOUNT, MAX_AMOUNT)
+
+            # One of the customer's products, or none for about one in ten
+            product = first_product + product_starts[owner] + (rng.random(size) * product_counts[owner]).astype(np.int64)
+            has_product = rng.random(size) >= 0.1
+
+            rows = list(zip(
+                range(first_transaction + chunk_start, first_transaction + chunk_start + size),
+                (first_customer + owner).tolist(),
+                [p if keep else None for p, keep in zip(product.tolist(), has_product.tolist())],
+                [f"{value:.2f}" for value in amount.tolist()],
+                _datetimes(start, moment),
+                anomalous.tolist(),
+            ))
+            for offset in range(0, size, batch_size):
+                _insert(Transaction, ('transaction_id', 'customer', 'product', 'amount', 'transaction_date', 'is_anomalous'),
+                        rows[offset:offset + batch_size])
+                inserted += len(rows[offset:offset + batch_size])
+                if on_batch:
+                    on_batch('transactions', inserted)
+
+        rollups.rebuild()
+        sketches.rebuild()
+        cohorts.rebuild()
+        search.rebuild()
+        risk.refresh()
+        cache.bump_data_version()
+        snapshot.schedule_refresh()
+    return {'customers': customers, 'products': len(product_names), 'transactions': transactions}
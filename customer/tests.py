@@ -1,3 +1,1218 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+from collections import Counter
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.apps import apps as django_apps
+from django.db import connection, transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import Avg, Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    anomalies, cache, churn, cohorts, images, jobs, recommendations, replicas, risk, rollups, search, segmentation,
+    sketches, snapshot, windows,
+)
+from .filters import FilterError
+from .ingest import IngestResult, ingest
+from .middleware import InstrumentationMiddleware, ReplicaPinMiddleware
+from .models import (
+    ChurnScore, CohortActivity, CohortMonth, Customer, DailyRollup, DailySegmentRollup, DailySketch, Job, Product,
+    ProductRiskExposure, RecommendedService, Transaction,
+)
+from .pagination import MAX_PAGE_SIZE
+
+
+def make_customer(name='Ada', segment='High'):
+    return Customer.objects.create(
+        name=name, email=f'{name.lower()}@example.com', phone_number='555-0100', address='1 Main St',
+        date_of_birth=date(1990, 1, 1), segment=segment,
+    )
+
+
+def make_product(customer, name='Savings', category='Deposit', risk_factor='0.20'):
+    return Product.objects.create(
+        customer=customer, name=name, description='', category=category, risk_factor=Decimal(risk_factor),
+    )
+
+
+def make_transaction(customer, product=None, amount='10.00', when=None, is_anomalous=False):
+    return Transaction.objects.create(
+        customer=customer, product=product, amount=Decimal(amount),
+        transaction_date=when or timezone.now(), is_anomalous=is_anomalous,
+    )
+
+
+def moment(*args):
+    return timezone.make_aware(datetime(*args))
+
+
+def nonzero(counters):
+    # Counter's unary + would also drop the negative revenue totals
+    return {key: value for key, value in counters.items() if value}
+
+
+# Views read the analytics cache and, when enabled, the on-disk snapshot;
+# both would otherwise leak between tests.
+@override_settings(CUSTOMER_SNAPSHOT={'ENABLED': False})
+class ViewTestCase(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+
+
+class AnomalyTests(TestCase):
+    @np.errstate(divide='ignore', invalid='ignore')
+    def reference(self, amounts, method):
+        # One customer at a time, with NumPy's own statistics
+        if method == 'zscore':
+            return np.abs(amounts - amounts.mean()) / amounts.std() > 3.0
+        if method == 'iqr':
+            q1, q3 = np.quantile(amounts, [0.25, 0.75])
+            spread = q3 - q1
+            return (spread > 0) & ((amounts < q1 - 1.5 * spread) | (amounts > q3 + 1.5 * spread))
+        deviation = np.abs(amounts - np.median(amounts))
+        mad = np.median(deviation)
+        scale = mad / 0.6745 if mad > 0 else deviation.mean() * 1.2533
+        return deviation / scale > 3.5
+
+    def test_score_matches_per_customer_statistics(self):
+        rng = np.random.default_rng(0)
+        counts = rng.integers(1, 30, 200)
+        customer_ids = np.repeat(np.arange(len(counts)), counts)
+        amounts = np.round(rng.lognormal(4, 1, len(customer_ids)), 2)
+        amounts[rng.random(len(amounts)) < 0.05] *= 40
+        amounts[customer_ids == 3] = 25.0  # Identical amounts
+        for method in anomalies.METHODS:
+            flags = anomalies.score(customer_ids, amounts, method)
+            expected = np.concatenate([
+                self.reference(amounts[customer_ids == customer], method) & (count >= 5)
+                for customer, count in enumerate(counts)
+            ])
+            np.testing.assert_array_equal(flags, expected, err_msg=method)
+
+    def test_run_flags_outliers_and_keeps_rollups(self):
+        ada = make_customer()
+        transactions = [
+            make_transaction(ada, amount=amount, when=moment(2026, 3, day), is_anomalous=day == 1)
+            for day, amount in enumerate(('10.00', '11.00', '9.50', '10.50', '10.00', '950.00'), start=1)
+        ]
+        self.assertEqual(anomalies.run(dry_run=True), {'scored': 6, 'flagged': 1, 'changed': 2})
+        self.assertEqual(set(Transaction.objects.filter(is_anomalous=True)), {transactions[0]})
+
+        self.assertEqual(anomalies.run(), {'scored': 6, 'flagged': 1, 'changed': 2})
+        self.assertEqual(set(Transaction.objects.filter(is_anomalous=True)), {transactions[-1]})
+        self.assertEqual(DailyRollup.objects.get(day=date(2026, 3, 6)).anomaly_count, 1)
+        self.assertEqual(DailyRollup.objects.get(day=date(2026, 3, 1)).anomaly_count, 0)
+
+
+class ChurnTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = moment(2026, 3, 31)
+        self.ada, self.bob = make_customer('Ada'), make_customer('Bob')
+        Customer.objects.filter(pk=self.bob.pk).update(signup_date=moment(2026, 1, 30))
+        make_transaction(self.ada, amount='100.00', when=moment(2026, 3, 1))
+        make_transaction(self.ada, amount='-30.00', when=moment(2026, 3, 16))
+
+    def test_features_and_prediction(self):
+        customer_ids, recency, frequency, monetary = churn.rfm_features(self.now)
+        self.assertEqual(customer_ids.tolist(), [self.ada.pk, self.bob.pk])
+        # Bob never transacted: as recent as his signup
+        self.assertEqual(recency.tolist(), [15.0, 60.0])
+        self.assertEqual(frequency.tolist(), [2, 0])
+        self.assertEqual(monetary.tolist(), [70.0, 0.0])
+
+        # Two months without transactions; negative totals count as nothing spent
+        model = churn.get_model()
+        expected = 1 / (1 + np.exp(-(model['intercept'] + model['recency_months'] * 2)))
+        probability = churn.predict(np.array([60.0]), np.array([0]), np.array([-5.0]))
+        self.assertAlmostEqual(float(probability[0]), expected)
+
+    @override_settings(CUSTOMER_CHURN={'KEEP_RUNS': 2})
+    def test_score_all_keeps_the_latest_runs(self):
+        for days in (0, 7, 14):
+            self.assertEqual(churn.score_all(now=self.now + timedelta(days=days)), 2)
+        self.assertEqual(
+            sorted(set(ChurnScore.objects.values_list('scored_at', flat=True))),
+            [self.now + timedelta(days=7), self.now + timedelta(days=14)],
+        )
+
+        data = self.client.get(reverse('churn_probability', args=[self.ada.pk])).json()
+        latest = ChurnScore.objects.get(customer=self.ada, scored_at=self.now + timedelta(days=14))
+        self.assertEqual(data['value'], latest.probability)
+        self.assertEqual(len(data['graph']), 2)
+        # A week more without transactions each run
+        self.assertLess(data['graph'][0], data['graph'][1])
+        self.assertEqual(self.client.get(reverse('churn_probability', args=[999])).status_code, 404)
+
+
+class CustomerProfileTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ada = make_customer()
+        loan = make_product(self.ada, 'Mortgage', 'Loan', '0.80')
+        for day in range(1, 4):
+            make_transaction(self.ada, loan, '10.00', moment(2026, 3, day))
+        make_product(make_customer('Bob'), 'Savings', 'Deposit')
+        recommendations.build()
+        churn.score_all(now=moment(2026, 3, 31))
+        churn.score_all(now=moment(2026, 4, 30))
+
+    def test_profile_matches_the_section_endpoints(self):
+        url = reverse('customer_profile', args=[self.ada.pk])
+        # The customer, then products, recommendations, churn scores and transactions
+        with self.assertNumQueries(5):
+            data = self.client.get(url).json()
+        self.assertEqual(data['personal_info']['email'], 'ada@example.com')
+        self.assertEqual(data['clv'], '30.00')
+        self.assertEqual(data['segmentation'], 'High')
+        self.assertEqual([product['name'] for product in data['products']], ['Mortgage'])
+        self.assertEqual(len(data['transaction_history']), 3)
+        self.assertEqual(data['recommended_service'], 'Savings')
+        for section, name in (('churn_probability', 'churn_probability'), ('customer_product_risk', 'product_risk')):
+            self.assertEqual(data[section], self.client.get(reverse(name, args=[self.ada.pk])).json())
+
+    def test_fields(self):
+        url = reverse('customer_profile', args=[self.ada.pk])
+        with self.assertNumQueries(1):
+            data = self.client.get(url, {'fields': 'personal_info, clv'}).json()
+        self.assertEqual(set(data), {'personal_info', 'clv'})
+
+        response = self.client.get(url, {'fields': 'clv,secrets'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secrets', response.json()['error'])
+        self.assertEqual(self.client.get(reverse('customer_profile', args=[999])).status_code, 404)
+
+
+class KeysetPaginationTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = make_customer()
+        same_time = moment(2026, 3, 1, 12)
+        # Ties on transaction_date straddle the page boundaries
+        self.transactions = [make_transaction(self.customer, when=same_time) for _ in range(5)]
+        self.transactions.append(make_transaction(self.customer, when=same_time + timedelta(hours=1)))
+        self.transactions.append(make_transaction(self.customer, when=same_time - timedelta(hours=1)))
+        self.url = reverse('transaction_history', args=[self.customer.pk])
+
+    def pages(self, page_size):
+        pages, cursor = [], None
+        while True:
+            params = {'page_size': page_size, **({'cursor': cursor} if cursor else {})}
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_every_transaction_once_newest_first(self):
+        expected = [
+            transaction.pk for transaction in
+            sorted(self.transactions, key=lambda transaction: (transaction.transaction_date, transaction.pk), reverse=True)
+        ]
+        for page_size in (1, 2, 3, 6):
+            with self.subTest(page_size=page_size):
+                pages = self.pages(page_size)
+                seen = [row['transaction_id'] for page in pages for row in page['transactions']]
+                self.assertEqual(seen, expected)
+                self.assertTrue(all(len(page['transactions']) <= page_size for page in pages))
+
+    def test_exactly_full_last_page_has_no_next_cursor(self):
+        pages = self.pages(len(self.transactions))
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(len(pages[0]['transactions']), len(self.transactions))
+
+    def test_summary_only_on_first_page(self):
+        pages = self.pages(3)
+        self.assertEqual(pages[0]['summary']['total_transactions'], len(self.transactions))
+        self.assertTrue(all('summary' not in page for page in pages[1:]))
+
+    def test_invalid_cursor_and_page_size(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'not-a-cursor'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'page_size': '0'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'page_size': 'ten'}).status_code, 400)
+
+    def test_page_size_is_capped(self):
+        for _ in range(MAX_PAGE_SIZE):
+            make_transaction(self.customer, when=moment(2025, 1, 1))
+        response = self.client.get(self.url, {'page_size': MAX_PAGE_SIZE * 2})
+        self.assertEqual(len(response.data['transactions']), MAX_PAGE_SIZE)
+        self.assertIsNotNone(response.data['next_cursor'])
+
+
+class CachedResponseTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = make_customer()
+        self.product = make_product(self.customer)
+        make_transaction(self.customer, self.product)
+        self.url = reverse('product-usage')
+
+    def test_second_request_is_a_hit(self):
+        first = self.client.get(self.url)
+        second = self.client.get(self.url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_matching_etag_gets_304(self):
+        tag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=tag).status_code, 304)
+
+    def test_writes_invalidate_cached_data_and_etag(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.data, {'Savings': 1})
+
+        make_transaction(self.customer, self.product)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.data, {'Savings': 2})
+
+        self.product.name = 'Current'
+        self.product.save()
+        self.assertEqual(self.client.get(self.url).data, {'Current': 2})
+
+    def test_entries_of_another_day_are_not_served(self):
+        url, params = reverse('revenue-trends'), {'period': 'day'}
+        today = moment(2026, 3, 10, 12)
+        make_transaction(self.customer, self.product, '5.00', when=today)
+        with mock.patch('django.utils.timezone.now', return_value=today):
+            self.assertEqual(self.client.get(url, params)['X-Cache'], 'MISS')
+            self.assertEqual(self.client.get(url, params)['X-Cache'], 'HIT')
+        # Nothing was written since, but "today" is another day now
+        with mock.patch('django.utils.timezone.now', return_value=today + timedelta(days=1)):
+            response = self.client.get(url, params)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['start_date'], date(2026, 3, 11))
+        self.assertEqual(response.data['summary']['total_revenue'], 0)
+
+    def test_validators_change_at_midnight(self):
+        url = reverse('revenue-trends')
+        today = timezone.now()
+        with mock.patch('django.utils.timezone.now', return_value=today):
+            first = self.client.get(url)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+        with mock.patch('django.utils.timezone.now', return_value=today + timedelta(days=1)):
+            by_tag = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+            by_date = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual((by_tag.status_code, by_date.status_code), (200, 200))
+        self.assertNotEqual(by_tag['ETag'], first['ETag'])
+
+
+
+# The async views query from worker threads, which only see committed rows
+@override_settings(CUSTOMER_SNAPSHOT={'ENABLED': False})
+class AsyncDashboardTests(TransactionTestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_async_validators_change_at_midnight(self):
+        url = reverse('revenue-trends-async')
+        today = timezone.now()
+        with mock.patch('django.utils.timezone.now', return_value=today):
+            first = self.client.get(url)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        with mock.patch('django.utils.timezone.now', return_value=today + timedelta(days=1)):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+
+class SearchTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ('Alice Smith', 'Malice Jones', 'Bob Alison', 'Johnson Carl'):
+            make_customer(name)
+
+    def names(self, term, limit=search.DEFAULT_LIMIT):
+        return [(row['name'], row['match']) for row in search.autocomplete(term, limit)]
+
+    def test_autocomplete_stages(self):
+        self.assertEqual(
+            self.names('ali'), [('Alice Smith', 'prefix'), ('Bob Alison', 'word'), ('Malice Jones', 'substring')],
+        )
+        self.assertEqual(self.names('ali', limit=1), [('Alice Smith', 'prefix')])
+        self.assertEqual(self.names('alice smi'), [('Alice Smith', 'prefix')])
+        self.assertEqual(self.names('jhonson'), [('Johnson Carl', 'fuzzy')])
+        self.assertEqual(self.names('50%_"x'), [])
+
+    def test_filter_name_matches_icontains(self):
+        customers = Customer.objects.all()
+        for term in ('a', 'al', 'LICE', 'alice s', 'son', 'xyz'):
+            self.assertEqual(
+                set(search.filter_name(customers, term)), set(customers.filter(name__icontains=term)), term,
+            )
+
+    def test_index_follows_writes(self):
+        customer = make_customer('Zebulon Quixote')
+        self.assertEqual(self.names('quixo'), [('Zebulon Quixote', 'word')])
+        customer.name, customer.email = 'Zara Moss', 'zara@example.com'
+        customer.save()
+        self.assertEqual(self.names('quixo'), [])
+        customer.delete()
+        self.assertEqual(self.names('zara'), [])
+
+        # Bulk writes skip the signals until the index is rebuilt
+        Customer.objects.filter(name='Bob Alison').update(name='Robert Alison')
+        self.assertEqual(self.names('robert'), [])
+        self.assertEqual(search.rebuild(), 4)
+        self.assertEqual(self.names('robert'), [('Robert Alison', 'prefix')])
+
+    def test_view(self):
+        url = reverse('customer-search')
+        response = self.client.get(url, {'q': 'alice', 'limit': 1})
+        self.assertEqual(response.json()['results'][0]['name'], 'Alice Smith')
+        for params in ({}, {'q': 'al', 'limit': 'x'}, {'q': 'al', 'limit': search.MAX_LIMIT + 1}):
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+
+
+class InstrumentationTests(ViewTestCase):
+    def scrape(self):
+        text = self.client.get(reverse('metrics')).content.decode()
+        return {
+            series: float(value)
+            for series, value in (line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+        }
+
+    def test_server_timing_and_metrics(self):
+        ada = make_customer()
+        before = self.scrape()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('customer_personal_info', args=[ada.pk]))
+        # The next request resets the captured queries
+        count = len(queries)
+        self.assertIn(f'desc="{count} queries"', response['Server-Timing'])
+
+        after = self.scrape()
+        series = 'customer_requests_total{route="customer_personal_info",method="GET",status="200"}'
+        self.assertEqual(after[series] - before.get(series, 0), 1)
+        series = 'customer_request_queries_sum{route="customer_personal_info"}'
+        self.assertEqual(after[series] - before.get(series, 0), count)
+
+    def test_streamed_responses_are_reported_once_closed(self):
+        make_customer()
+        series = 'customer_requests_total{route="customer-export",method="GET",status="200"}'
+        before = self.scrape().get(series, 0)
+        response = self.client.get(reverse('customer-export'))
+        self.assertEqual(self.scrape().get(series, 0), before)
+        self.assertIn(b'ada@example.com', b''.join(response.streaming_content))
+        response.close()
+        self.assertEqual(self.scrape()[series], before + 1)
+
+    @override_settings(CUSTOMER_INSTRUMENTATION={'SLOW_QUERY_MS': 0})
+    def test_slow_queries_are_logged(self):
+        ada = make_customer()
+        with self.assertLogs('customer.instrumentation', 'WARNING') as logs:
+            self.client.get(reverse('customer_personal_info', args=[ada.pk]))
+        self.assertIn('GET customer_personal_info', logs.output[0])
+
+
+@override_settings(CUSTOMER_REPLICAS={'DATABASES': ['replica'], 'MAX_LAG_SECONDS': 30})
+class ReplicaRoutingTests(TransactionTestCase):
+    # Transactions keep every read on the primary, so no TestCase
+    def setUp(self):
+        self.router = replicas.ReplicaRouter()
+        self.request = RequestFactory().get('/')
+        lag = mock.patch('customer.replicas.replica_lag', return_value=1.0)
+        self.lag = lag.start()
+        self.addCleanup(lag.stop)
+
+    def read(self):
+        return self.router.db_for_read(Customer)
+
+    def test_reads_go_to_a_fresh_replica(self):
+        self.assertIsNone(self.read())
+        with replicas._replica_context(self.request):
+            self.assertEqual(self.read(), 'replica')
+            with transaction.atomic():
+                self.assertIsNone(self.read())
+            self.lag.return_value = 31.0
+            self.assertEqual(self.read(), 'default')
+            self.lag.return_value = None
+            self.assertEqual(self.read(), 'default')
+
+    def test_writes_pin_the_request_to_the_primary(self):
+        with replicas._replica_context(self.request):
+            with replicas.primary():
+                self.assertIsNone(self.read())
+            # Lazy refreshes that only read leave the replica in use
+            self.assertEqual(self.read(), 'replica')
+            with replicas.primary():
+                self.assertEqual(self.router.db_for_write(Customer), 'default')
+            self.assertIsNone(self.read())
+
+        self.request.COOKIES[replicas.PIN_COOKIE] = '1'
+        with replicas._replica_context(self.request):
+            self.assertIsNone(self.read())
+
+    def test_pin_cookie_after_successful_writes(self):
+        def view(request):
+            return HttpResponse(status=201 if request.method == 'POST' else 400)
+
+        middleware = ReplicaPinMiddleware(view)
+        self.assertIn(replicas.PIN_COOKIE, middleware(RequestFactory().post('/')).cookies)
+        self.assertNotIn(replicas.PIN_COOKIE, middleware(RequestFactory().put('/')).cookies)
+        self.assertNotIn(replicas.PIN_COOKIE, middleware(RequestFactory().get('/')).cookies)
+
+
+# The primary stands in for a replica that received its heartbeats
+@override_settings(CUSTOMER_REPLICAS={'DATABASES': ['default'], 'MAX_LAG_SECONDS': 30, 'CHECK_INTERVAL_SECONDS': 60})
+class ReplicaLagTests(TestCase):
+    def setUp(self):
+        replicas._heartbeats.clear()
+        self.addCleanup(replicas._heartbeats.clear)
+
+    def test_lag_from_the_heartbeat(self):
+        self.assertIsNone(replicas.replica_lag('default'))
+        self.assertEqual(replicas.usable_replicas(), [])
+        replicas.heartbeat()
+        # Checked at most every CHECK_INTERVAL_SECONDS
+        self.assertIsNone(replicas.replica_lag('default'))
+        replicas._heartbeats.clear()
+        self.assertLess(replicas.replica_lag('default'), 5)
+        self.assertEqual(replicas.usable_replicas(), ['default'])
+
+
+class AsyncMiddlewareTests(TransactionTestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_middleware_follows_the_handler_mode(self):
+        async def async_view(request):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(InstrumentationMiddleware(async_view)))
+        self.assertFalse(iscoroutinefunction(InstrumentationMiddleware(lambda request: HttpResponse())))
+        with override_settings(CUSTOMER_REPLICAS={'DATABASES': ['default']}):
+            self.assertTrue(iscoroutinefunction(ReplicaPinMiddleware(async_view)))
+
+    def test_async_pin(self):
+        async def created(request):
+            return HttpResponse(status=201)
+
+        with override_settings(CUSTOMER_REPLICAS={'DATABASES': ['default']}):
+            middleware = ReplicaPinMiddleware(created)
+        response = async_to_sync(middleware)(RequestFactory().post('/'))
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+        response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+    def test_async_view_queries_are_counted(self):
+        make_transaction(make_customer(), when=timezone.now())
+        response = async_to_sync(self.async_client.get)(reverse('revenue-trends-async'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        # At least one per aggregate of the plan, each run in an executor thread
+        queries = int(response['Server-Timing'].split('desc="')[1].split()[0])
+        self.assertGreaterEqual(queries, 4)
+
+
+class RollupTests(TestCase):
+    def live(self):
+        counters = Counter()
+        buckets = (
+            Transaction.objects.annotate(day=TruncDate('transaction_date'))
+            .values('day', 'customer__segment', 'product__category')
+            .annotate(
+                transaction_count=Count('pk'), total_revenue=Sum('amount'),
+                anomaly_count=Count('pk', filter=Q(is_anomalous=True)),
+            )
+            .order_by()
+        )
+        for row in buckets:
+            key = (row['day'], row['customer__segment'] or '', row['product__category'] or '')
+            for name in ('transaction_count', 'total_revenue', 'anomaly_count'):
+                counters[key + (name,)] += row[name]
+        signups = (
+            Customer.objects.annotate(day=TruncDate('signup_date')).values('day', 'segment')
+            .annotate(new_customers=Count('pk')).order_by()
+        )
+        for row in signups:
+            counters[(row['day'], row['segment'], '', 'new_customers')] += row['new_customers']
+        return nonzero(counters)
+
+    def stored(self):
+        counters = Counter()
+        for row in DailySegmentRollup.objects.all():
+            for name in rollups.COUNTERS:
+                counters[(row.day, row.segment, row.category, name)] += getattr(row, name)
+        return nonzero(counters)
+
+    def stored_daily(self):
+        counters = Counter()
+        for row in DailyRollup.objects.all():
+            for name in rollups.COUNTERS:
+                counters[(row.day, name)] += getattr(row, name)
+        return nonzero(counters)
+
+    def assertRollupsMatch(self):
+        live = self.live()
+        self.assertEqual(self.stored(), live)
+        daily = Counter()
+        for (day, segment, category, name), value in live.items():
+            daily[(day, name)] += value
+        self.assertEqual(self.stored_daily(), nonzero(daily))
+
+    def test_writes_keep_rollups_equal_to_live_aggregates(self):
+        ada, bob = make_customer('Ada', 'High'), make_customer('Bob', 'Low')
+        savings, loan = make_product(ada), make_product(bob, 'Mortgage', 'Loan', '0.80')
+        transaction = make_transaction(ada, savings, '10.00', moment(2026, 3, 1, 23, 30))
+        make_transaction(bob, loan, '-4.50', moment(2026, 3, 2), is_anomalous=True)
+        self.assertRollupsMatch()
+
+        transaction.amount = Decimal('25.00')
+        transaction.is_anomalous = True
+        transaction.save()
+        transaction.customer, transaction.product = bob, None
+        transaction.transaction_date = moment(2026, 1, 15)
+        transaction.save()
+        self.assertRollupsMatch()
+
+        transaction.delete()
+        self.assertRollupsMatch()
+
+        ada.segment = 'Barely'
+        ada.save()
+        make_transaction(ada, loan, '7.25', moment(2026, 2, 28))
+        self.assertRollupsMatch()
+
+        loan.category = 'Banking'
+        loan.save()
+        self.assertRollupsMatch()
+
+        loan.delete()
+        self.assertRollupsMatch()
+
+        bob.delete()
+        self.assertRollupsMatch()
+
+    def test_rebuild_matches_live_aggregates(self):
+        ada = make_customer()
+        make_transaction(ada, make_product(ada), '3.00', moment(2026, 3, 1))
+        DailyRollup.objects.all().delete()
+        DailySegmentRollup.objects.all().delete()
+        rollups.rebuild()
+        self.assertRollupsMatch()
+
+    def test_backfill_migration_matches_live_aggregates(self):
+        ada, bob = make_customer('Ada', 'High'), make_customer('Bob', 'Low')
+        make_transaction(ada, make_product(ada), '3.00', moment(2026, 3, 1), is_anomalous=True)
+        make_transaction(bob, None, '-4.50', moment(2026, 3, 2))
+        DailyRollup.objects.all().delete()
+        DailySegmentRollup.objects.all().delete()
+        import_module('customer.migrations.0014_backfill_rollups').backfill_rollups(django_apps, None)
+        self.assertRollupsMatch()
+
+
+class RiskTests(TestCase):
+    def setUp(self):
+        self.ada, self.bob = make_customer('Ada'), make_customer('Bob')
+        self.loan = make_product(self.ada, 'Mortgage', 'Loan', '0.80')
+        self.savings = make_product(self.bob, 'Savings', 'Deposit', '0.10')
+        make_transaction(self.ada, self.loan, '100.00', moment(2026, 3, 1))
+        make_transaction(self.ada, self.savings, '-50.00', moment(2026, 3, 2))
+        make_transaction(self.bob, self.savings, '20.00', moment(2026, 3, 3))
+        make_transaction(self.bob, None, '5.00', moment(2026, 3, 4))
+
+    def exposures(self):
+        fields = [field.name for field in ProductRiskExposure._meta.fields if field.name != 'updated_at']
+        return sorted(ProductRiskExposure.objects.values_list(*fields))
+
+    def test_backfill_migration_matches_refresh(self):
+        risk.refresh()
+        refreshed = self.exposures()
+        self.assertEqual(
+            ProductRiskExposure.objects.get(customer=self.ada).overall_exposure, round((80 + 5) / 150, 4),
+        )
+        ProductRiskExposure.objects.all().delete()
+        import_module('customer.migrations.0015_risk_exposure_sums').backfill_sums(django_apps, None)
+        self.assertEqual(self.exposures(), refreshed)
+
+    def assertExposuresMatchRefresh(self):
+        stored = self.exposures()
+        risk.refresh()
+        self.assertEqual(stored, self.exposures())
+
+    def test_writes_keep_exposures_equal_to_a_refresh(self):
+        self.assertExposuresMatchRefresh()
+
+        transaction = make_transaction(self.bob, self.loan, '33.33', moment(2026, 3, 5))
+        self.assertExposuresMatchRefresh()
+
+        transaction.amount, transaction.product = Decimal('-12.34'), self.savings
+        transaction.save()
+        self.assertExposuresMatchRefresh()
+
+        self.loan.risk_factor = Decimal('0.65')
+        self.loan.save()
+        self.assertExposuresMatchRefresh()
+
+        self.savings.category = 'Banking'
+        self.savings.save()
+        self.assertExposuresMatchRefresh()
+
+        transaction.delete()
+        self.assertExposuresMatchRefresh()
+
+        self.loan.delete()
+        self.assertExposuresMatchRefresh()
+        # Ada's loan transactions lost their product
+        self.assertIsNone(ProductRiskExposure.objects.get(customer=self.ada).loan_exposure)
+
+    def test_ingest_keeps_exposures_equal_to_a_refresh(self):
+        lines = [
+            'customer_id,product_id,amount,transaction_date',
+            f'{self.bob.pk},{self.loan.pk},70.00,2026-03-05T10:00:00Z',
+            f'{self.ada.pk},{self.savings.pk},-1.50,2026-03-06T10:00:00Z',
+        ]
+        self.assertEqual(ingest(io.StringIO('\n'.join(lines) + '\n'), 'csv').ingested, 2)
+        self.assertExposuresMatchRefresh()
+
+        response = self.client.get(reverse('product_risk', args=[self.bob.pk]))
+        exposure = ProductRiskExposure.objects.get(customer=self.bob)
+        self.assertEqual(response.json()['Loans'], exposure.loan_exposure)
+        self.assertEqual(response.json()['Overall'], exposure.overall_exposure)
+
+
+class IngestTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = make_customer()
+        self.product = make_product(self.customer)
+        self.url = reverse('transaction-ingest')
+
+    def upload(self, content, name='transactions.csv'):
+        return self.client.post(self.url, {'file': SimpleUploadedFile(name, content)})
+
+    def test_rejects_are_reported_by_line_and_the_rest_ingested(self):
+        content = (
+            "customer_id,product_id,amount,transaction_date,is_anomalous\n"
+            f"{self.customer.pk},{self.product.pk},12.50,2026-03-01T10:00:00,false\n"
+            f"999999,,1.00,2026-03-01T10:00:00,false\n"
+            f"{self.customer.pk},999999,1.00,2026-03-01T10:00:00,false\n"
+            f"{self.customer.pk},,lots,2026-03-01T10:00:00,false\n"
+            f"{self.customer.pk},,1.00,yesterday,false\n"
+            f"{self.customer.pk},,1.00,2026-03-01T10:00:00,maybe\n"
+            f"{self.customer.pk},,2.00,2026-03-02T10:00:00,\n"
+        )
+        response = self.upload(content.encode())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['ingested'], 2)
+        self.assertEqual(response.data['failed'], 5)
+        errors = {error['line']: error['error'] for error in response.data['errors']}
+        self.assertEqual(sorted(errors), [3, 4, 5, 6, 7])
+        self.assertEqual(errors[3], "Customer 999999 does not exist")
+        self.assertEqual(errors[4], "Product 999999 does not exist")
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(DailyRollup.objects.aggregate(total=Sum('total_revenue'))['total'], Decimal('14.50'))
+
+    def test_only_rejects_is_a_400(self):
+        response = self.upload(b'customer_id,amount,transaction_date\n,1.00,2026-03-01\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['failed'], 1)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_undecodable_upload_is_a_400(self):
+        response = self.upload(b'customer_id,amount,transaction_date\n\xff\xfe,1.00,2026-03-01\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('UTF-8', response.data['error'])
+
+    def test_ndjson_rows_that_are_not_objects_are_rejected(self):
+        content = f'{{"customer_id": {self.customer.pk}, "amount": "3", "transaction_date": "2026-03-01"}}\nnot json\n'
+        response = self.upload(content.encode(), name='transactions.ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['ingested'], response.data['failed']), (1, 1))
+
+    def test_every_reject_is_written_but_only_some_kept(self):
+        lines = ['customer_id,amount,transaction_date'] + ['999999,1.00,2026-03-01'] * 5
+        errors_file = io.StringIO()
+        result = ingest(io.StringIO('\n'.join(lines) + '\n'), 'csv', result=IngestResult(errors_file, kept_errors=2))
+        self.assertEqual(result.failed, 5)
+        self.assertEqual(len(result.errors), 2)
+        self.assertEqual(len(errors_file.getvalue().splitlines()), 6)
+
+
+class WindowTests(TestCase):
+    def test_compare_splits_rows_at_the_window_edges(self):
+        customer = make_customer()
+        window = windows.Window(date(2026, 3, 1), 'month')
+        previous = window.previous()
+        self.assertEqual(previous.first_day, date(2026, 2, 1))
+        for when, amount in (
+            (window.start, '1.00'),                                # first instant: current
+            (window.end - timedelta(microseconds=1), '2.00'),      # last instant: current
+            (window.end, '100.00'),                                # after: neither
+            (window.start - timedelta(microseconds=1), '4.00'),    # just before: previous
+            (previous.start, '8.00'),                              # first instant of previous
+            (previous.start - timedelta(microseconds=1), '100.00'),
+        ):
+            make_transaction(customer, amount=amount, when=when)
+
+        result = windows.compare(
+            Transaction.objects.all(), 'transaction_date', window,
+            count=(Count, 'pk'), total=(Sum, 'amount'),
+        )
+        self.assertEqual(result['current'], {'count': 2, 'total': Decimal('3.00')})
+        self.assertEqual(result['previous'], {'count': 2, 'total': Decimal('12.00')})
+
+    def test_compare_on_day_fields(self):
+        make_customer()
+        window = windows.Window(date(2026, 3, 1), 'day', 3)
+        for day in (date(2026, 3, 3), date(2026, 3, 4), date(2026, 2, 26), date(2026, 2, 25)):
+            DailyRollup.objects.create(day=day, transaction_count=1)
+        result = windows.compare(
+            DailyRollup.objects.all(), 'day', window, days=True, transactions=(Sum, 'transaction_count'),
+        )
+        self.assertEqual(result, {'current': {'transactions': 1}, 'previous': {'transactions': 1}})
+
+    def test_fill_lists_every_bucket_oldest_first(self):
+        window = windows.Window(date(2025, 11, 1), 'month', 4)
+        rows = [
+            {'period': moment(2026, 1, 1), 'revenue': 5},
+            {'period': date(2025, 11, 1), 'revenue': 3},
+        ]
+        filled = windows.fill(rows, window, {'revenue': 0})
+        self.assertEqual(
+            [(row['period'], row['revenue']) for row in filled],
+            [(date(2025, 11, 1), 3), (date(2025, 12, 1), 0), (moment(2026, 1, 1), 5), (date(2026, 2, 1), 0)],
+        )
+
+    def test_shift_and_current_across_year_edges(self):
+        self.assertEqual(windows.shift(date(2025, 12, 1), 'month', 1), date(2026, 1, 1))
+        self.assertEqual(windows.shift(date(2026, 1, 1), 'month', -13), date(2024, 12, 1))
+        window = windows.current('week', 2, now=moment(2026, 1, 1, 8))  # a Thursday
+        self.assertEqual((window.first_day, window.last_day), (date(2025, 12, 22), date(2026, 1, 4)))
+
+    def test_custom_window_includes_both_days(self):
+        window = windows.custom('2026-02-27', '2026-03-01')
+        self.assertEqual((window.count, window.end_day, window.name), (3, date(2026, 3, 2), 'custom'))
+        with self.assertRaises(FilterError):
+            windows.custom('2026-03-02', '2026-03-01')
+
+
+class SketchTests(TestCase):
+    def setUp(self):
+        self.ada, self.bob = make_customer('Ada', 'High'), make_customer('Bob', 'Low')
+        self.window = windows.Window(date(2026, 3, 1), 'month')
+        self.transactions = [
+            make_transaction(customer, amount=amount, when=moment(2026, 3, day, 12))
+            for customer, amount, day in (
+                (self.ada, '10.00', 1), (self.ada, '30.00', 1), (self.bob, '20.00', 1),
+                (self.bob, '-5.00', 2), (self.ada, '99.00', 31),
+            )
+        ]
+
+    def distributions(self):
+        return [sketches.distribution(self.window, segment) for segment in (None, 'High', 'Low', 'Barely')]
+
+    def assertSketchesMatchRebuild(self):
+        stored = self.distributions()
+        sketches.rebuild()
+        self.assertEqual(stored, self.distributions())
+
+    def test_writes_keep_sketches_equal_to_a_rebuild(self):
+        summary = sketches.distribution(self.window)['summary']
+        self.assertEqual((summary['transaction_count'], summary['distinct_customers'], summary['p50']), (5, 2, 20.0))
+        self.assertSketchesMatchRebuild()
+
+        make_transaction(self.bob, amount='7.00', when=moment(2026, 3, 2, 8))
+        self.assertSketchesMatchRebuild()
+
+        first = self.transactions[0]
+        first.amount, first.transaction_date = Decimal('500.00'), moment(2026, 3, 15)
+        first.save()
+        self.assertSketchesMatchRebuild()
+
+        self.transactions[2].delete()
+        self.assertSketchesMatchRebuild()
+
+        self.ada.segment = 'Barely'
+        self.ada.save()
+        self.assertSketchesMatchRebuild()
+
+        self.bob.delete()
+        self.assertSketchesMatchRebuild()
+
+    def test_days_seeded_stale_are_built_on_read(self):
+        # As after 0017 on a database whose transactions predate the sketches
+        DailySketch.objects.all().delete()
+        import_module('customer.migrations.0017_seed_daily_sketches').seed_sketches(django_apps, None)
+        self.assertEqual(DailySketch.objects.filter(stale=True).count(), 3)
+        summary = sketches.distribution(self.window)['summary']
+        self.assertEqual((summary['transaction_count'], summary['distinct_customers']), (5, 2))
+        self.assertFalse(DailySketch.objects.filter(stale=True).exists())
+
+
+class CohortTests(TestCase):
+    def setUp(self):
+        self.ada, self.bob = make_customer('Ada', 'High'), make_customer('Bob', 'Low')
+        for customer, signup in ((self.ada, moment(2025, 1, 10)), (self.bob, moment(2025, 2, 3))):
+            customer.signup_date = signup
+            customer.save()
+        self.loan = make_product(self.ada, 'Loan', 'Loan')
+        self.card = make_product(self.bob, 'Card', 'Card')
+        self.transactions = [
+            make_transaction(customer, product, when=when)
+            for customer, product, when in (
+                (self.ada, self.loan, moment(2025, 1, 12)), (self.ada, None, moment(2025, 3, 1, 12)),
+                (self.bob, self.card, moment(2025, 2, 5)), (self.bob, self.card, moment(2025, 4, 20)),
+                (self.ada, self.loan, moment(2025, 4, 2)),
+            )
+        ]
+
+    def activity(self):
+        return set(CohortActivity.objects.values_list('cohort', 'month', 'segment', 'category', 'customers'))
+
+    def assertActivityMatchesRebuild(self):
+        cohorts.refresh()
+        stored = self.activity()
+        cohorts.rebuild()
+        self.assertEqual(stored, self.activity())
+
+    def test_writes_keep_activity_equal_to_a_rebuild(self):
+        cohorts.rebuild()
+        self.assertIn((date(2025, 1, 1), date(2025, 4, 1), 'High', 'Loan', 1), self.activity())
+
+        make_transaction(self.bob, self.card, when=moment(2025, 5, 1, 12))
+        self.assertActivityMatchesRebuild()
+
+        moved = self.transactions[1]
+        moved.transaction_date = moment(2025, 2, 14)
+        moved.save()
+        self.assertActivityMatchesRebuild()
+
+        self.transactions[3].delete()
+        self.assertActivityMatchesRebuild()
+
+        self.loan.category = 'Mortgage'
+        self.loan.save()
+        self.assertActivityMatchesRebuild()
+
+        self.ada.segment = 'Low'
+        self.ada.save()
+        self.assertActivityMatchesRebuild()
+
+        self.bob.delete()
+        self.assertActivityMatchesRebuild()
+
+    @override_settings(CUSTOMER_COHORTS={'READ_REBUILD_MONTHS': 1})
+    def test_reads_rebuild_only_the_latest_stale_months(self):
+        cohorts.rebuild()
+        built = self.activity()
+        cohorts.mark_stale([date(2025, 1, 1), date(2025, 3, 1), date(2025, 4, 1)])
+
+        cohorts.retention({'date_from': '2025-01-01T00:00:00Z', 'date_to': '2025-06-01T00:00:00Z'})
+        stale = set(CohortMonth.objects.filter(stale=True).values_list('month', flat=True))
+        self.assertEqual(stale, {date(2025, 1, 1), date(2025, 3, 1)})
+
+        self.assertEqual(cohorts.refresh(), 2)
+        self.assertFalse(CohortMonth.objects.filter(stale=True).exists())
+        self.assertEqual(self.activity(), built)
+
+    def test_months_seeded_stale_are_built_by_refresh(self):
+        # As after 0018 on a database whose transactions were never built
+        cohorts.rebuild()
+        built = self.activity()
+        CohortActivity.objects.all().delete()
+        CohortMonth.objects.all().delete()
+        import_module('customer.migrations.0018_seed_cohort_months').seed_cohort_months(django_apps, None)
+        self.assertEqual(CohortMonth.objects.filter(stale=True).count(), 4)
+        cohorts.refresh()
+        self.assertFalse(CohortMonth.objects.filter(stale=True).exists())
+        self.assertEqual(self.activity(), built)
+
+
+class RecommendationTests(TestCase):
+    def test_build(self):
+        self.assertEqual(recommendations.build(), 0)
+
+        names = ('Ada', 'Bob', 'Cy', 'Dee', 'Eve', 'Fay', 'Gus')
+        ada, bob, cy, dee, eve, fay, gus = (make_customer(name) for name in names)
+        for customer in (ada, bob, cy, gus):
+            make_product(customer, 'Savings', 'Deposit')
+        loan = make_product(ada, 'Loan', 'Loan')
+        make_product(bob, 'Loan', 'Loan')
+        make_product(dee, 'Card', 'Card')
+        # Transacting on a product counts as holding it
+        make_transaction(fay, loan)
+
+        # Small blocks, so that the co-occurrences are summed across them
+        self.assertEqual(recommendations.build(top_n=1, chunk_size=2), 7)
+        recommended = {
+            row.customer.name: (row.service_name, row.recommendation_reason)
+            for row in RecommendedService.objects.select_related('customer')
+        }
+        self.assertEqual(recommended, {
+            'Ada': ('Card', "Popular choice: held by 17% of customers (Card)."),
+            'Bob': ('Card', "Popular choice: held by 17% of customers (Card)."),
+            'Cy': ('Loan', "50% of customers holding Savings also hold Loan (Loan)."),
+            'Gus': ('Loan', "50% of customers holding Savings also hold Loan (Loan)."),
+            'Fay': ('Savings', "67% of customers holding Loan also hold Savings (Deposit)."),
+            'Dee': ('Savings', "Popular choice: held by 67% of customers (Deposit)."),
+            # Holds nothing
+            'Eve': ('Savings', "Popular choice: held by 67% of customers (Deposit)."),
+        })
+
+
+class SegmentationTests(TestCase):
+    def setUp(self):
+        self.now = moment(2026, 3, 31)
+        # Customer i transacted i + 1 times, for more and more recently
+        self.customers = []
+        for index in range(5):
+            customer = make_customer(f'C{index}', 'Low')
+            customer.signup_date = moment(2025, 6, 1)
+            customer.save()
+            for count in range(index + 1):
+                make_transaction(customer, amount='10.00', when=self.now - timedelta(days=10 - 2 * index, hours=count))
+            self.customers.append(customer)
+
+    def segments(self):
+        return list(Customer.objects.order_by('customer_id').values_list('segment', flat=True))
+
+    def segment_rollups(self):
+        # Buckets a customer moved out of stay behind, zeroed
+        return sorted(row for row in DailySegmentRollup.objects.values_list(
+            'day', 'segment', 'category', 'new_customers', 'transaction_count', 'total_revenue', 'anomaly_count',
+        ) if any(row[3:]))
+
+    def test_full_run(self):
+        dry = segmentation.run(dry_run=True, now=self.now)
+        self.assertEqual((dry.pk, dry.scored, dry.changed), (None, 5, 4))
+        self.assertEqual(self.segments(), ['Low'] * 5)
+
+        segmentation_run = segmentation.run(now=self.now)
+        # Mean quintiles 1, 2, 3, 4 and 5
+        self.assertEqual(self.segments(), ['Barely', 'Barely', 'Low', 'High', 'High'])
+        self.assertFalse(segmentation_run.incremental)
+
+        # Rollups moved with the customers, sketches were flagged for a rebuild
+        stored = self.segment_rollups()
+        rollups.rebuild()
+        self.assertEqual(stored, self.segment_rollups())
+        window = windows.Window(date(2026, 3, 1), 'month')
+        high = sketches.distribution(window, 'High')
+        sketches.rebuild()
+        self.assertEqual(high, sketches.distribution(window, 'High'))
+        self.assertEqual(high['summary']['distinct_customers'], 2)
+
+    def test_incremental_run_scores_new_activity_against_the_last_edges(self):
+        first = segmentation.run(now=self.now)
+        for _ in range(6):
+            make_transaction(self.customers[0], amount='500.00', when=self.now - timedelta(hours=1))
+        newcomer = make_customer('New', 'Low')
+
+        segmentation_run = segmentation.run(incremental=True, now=self.now)
+        self.assertTrue(segmentation_run.incremental)
+        self.assertEqual(segmentation_run.edges, first.edges)
+        self.assertEqual(segmentation_run.scored, 2)
+        self.assertEqual(self.segments(), ['High', 'Barely', 'Low', 'High', 'High', 'Barely'])
+        self.assertEqual(Customer.objects.get(pk=newcomer.pk).segment, 'Barely')
+
+
+class ImageVariantTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media = self.settings(MEDIA_ROOT=self.media)
+        media.enable()
+        self.addCleanup(media.disable)
+        os.makedirs(os.path.join(self.media, 'customer_images'))
+        Image.new('RGB', (900, 600), (200, 10, 10)).save(os.path.join(self.media, 'customer_images', 'ada.jpg'))
+        Image.new('RGBA', (600, 900), (0, 0, 0, 128)).save(os.path.join(self.media, 'customer_images', 'bob.png'))
+        self.url = reverse('image-variant', kwargs={'name': 'customer_images/ada.jpg'})
+
+    def image(self, response):
+        return Image.open(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_variants(self):
+        response = self.client.get(self.url, {'size': 100})
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        # Rounded up to the next bucket
+        self.assertEqual(self.image(response).size, (160, 107))
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertEqual(self.client.get(self.url, {'size': 100}, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        bob = reverse('image-variant', kwargs={'name': 'customer_images/bob.png'})
+        response = self.client.get(bob, {'size': 40, 'format': 'jpeg'})
+        self.assertEqual((response['Content-Type'], self.image(response).size), ('image/jpeg', (27, 40)))
+
+        # Rendered once per size and format, then served from disk
+        rendered = [files for _, _, files in os.walk(os.path.join(self.media, images.VARIANT_DIR)) if files]
+        self.assertEqual(sorted(name.split('-')[1] for files in rendered for name in files), ['160.webp', '40.jpeg'])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(self.url, {'size': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'format': 'gif'}).status_code, 400)
+        for name in ('customer_images/nope.jpg', '../settings.py', f'{images.VARIANT_DIR}/ada.jpg'):
+            self.assertEqual(self.client.get(reverse('image-variant', kwargs={'name': name})).status_code, 404, name)
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        # Small segments, so that the writes below span several of them
+        settings = override_settings(CUSTOMER_SNAPSHOT={'ENABLED': True, 'DIR': self.dir, 'SEGMENT_IDS': 4})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.customer = make_customer()
+        self.savings, self.loan = make_product(self.customer), make_product(self.customer, 'Mortgage', 'Loan')
+        self.transactions = [
+            make_transaction(self.customer, product, amount, moment(2026, month, day))
+            for product, amount, month, day in (
+                (self.savings, '10.00', 3, 1), (self.savings, '20.50', 3, 2), (self.loan, '-7.25', 3, 3),
+                (None, '4.00', 2, 10), (self.loan, '100.00', 2, 11), (self.savings, '0.10', 3, 31),
+            )
+        ]
+
+    def assertSnapshotMatchesDatabase(self):
+        current = snapshot.load()
+        self.assertIsNotNone(current)
+        usage = Transaction.objects.values('product__name').annotate(count=Count('product')).order_by()
+        self.assertEqual(snapshot.product_usage(current), {row['product__name']: row['count'] for row in usage})
+        for month in (2, 3):
+            window = windows.Window(date(2026, month, 1), 'month')
+            average = Transaction.objects.filter(window.q('transaction_date')).aggregate(average=Avg('amount'))['average']
+            stored = snapshot.average_amount(current, window.start, window.end)
+            self.assertAlmostEqual(float(stored or 0), float(average or 0), places=6)
+        return current
+
+    def test_writes_are_read_through_until_the_update_exports_them(self):
+        snapshot.rebuild()
+        self.assertIsNone(self.assertSnapshotMatchesDatabase().pending)
+
+        make_transaction(self.customer, self.loan, '3.00', moment(2026, 3, 5))
+        first = self.transactions[0]
+        first.amount = Decimal('11.00')
+        first.save()
+        self.transactions[4].delete()
+        self.savings.name = 'Current'
+        self.savings.save()
+        self.assertIsNotNone(self.assertSnapshotMatchesDatabase().pending)
+
+        snapshot.update()
+        self.assertIsNone(self.assertSnapshotMatchesDatabase().pending)
+
+        self.loan.delete()
+        self.customer.delete()
+        snapshot.update()
+        self.assertEqual(snapshot.product_usage(self.assertSnapshotMatchesDatabase()), {})
+
+    def test_background_refresh_waits_for_the_first_build(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            make_transaction(self.customer)
+        self.assertEqual(callbacks, [])
+        with self.assertLogs('customer.snapshot', 'WARNING'):
+            self.assertIsNone(snapshot.load())
+
+        snapshot.rebuild()
+        with self.captureOnCommitCallbacks() as callbacks:
+            make_transaction(self.customer)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_background_refresh_never_rebuilds(self):
+        snapshot.rebuild()
+        snapshot.mark_rewritten()
+        with mock.patch.object(snapshot, 'rebuild') as rebuild, self.assertLogs('customer.snapshot', 'WARNING'):
+            snapshot._refresh_again = True
+            snapshot._refresh_in_background()
+            self.assertIsNone(snapshot.load())
+        rebuild.assert_not_called()
+
+
+class RevenueTrendsTests(ViewTestCase):
+    def test_growth_skips_the_empty_buckets_around_the_revenue(self):
+        customer = make_customer()
+        make_transaction(customer, amount='40.00', when=moment(2026, 1, 10))
+        make_transaction(customer, amount='50.00', when=moment(2026, 1, 20))
+        make_transaction(customer, amount='30.00', when=moment(2026, 3, 5))
+        response = self.client.get(
+            reverse('revenue-trends'), {'period': 'custom', 'start_date': '2026-01-01', 'end_date': '2026-03-31'},
+        )
+        self.assertEqual(response.status_code, 200)
+        revenue = response.data['revenue_trends']['revenue_by_period']
+        self.assertEqual(len(revenue), 90)
+        self.assertEqual(revenue[0]['total_revenue'], 0)
+        # From the 40.00 of Jan 10 to the 30.00 of Mar 5
+        self.assertAlmostEqual(float(response.data['summary']['revenue_growth']), -25.0)
+
+    def test_no_growth_without_revenue(self):
+        response = self.client.get(reverse('revenue-trends'), {'period': 'month'})
+        self.assertNotIn('revenue_growth', response.data['summary'])
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        settings = override_settings(
+            CUSTOMER_JOBS={'DIR': self.dir, 'PROGRESS_INTERVAL_SECONDS': 0},
+            CUSTOMER_SNAPSHOT={'ENABLED': False},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_submit_validates_parameters(self):
+        with self.assertRaises(FilterError):
+            jobs.submit('customer-export', {'output': 'xml'})
+        self.assertFalse(Job.objects.exists())
+
+    def test_claim_takes_oldest_queued_job_once(self):
+        first = jobs.submit('revenue-trends', {'period': 'month'})
+        second = jobs.submit('revenue-trends', {'period': 'week'})
+        Job.objects.filter(pk=first.pk).update(created_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(jobs.claim('worker-1'), first.pk)
+        self.assertEqual(jobs.claim('worker-2'), second.pk)
+        self.assertIsNone(jobs.claim('worker-3'))
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.worker), (jobs.RUNNING, 'worker-1'))
+
+    def test_claimed_job_runs_to_a_stored_result(self):
+        job = jobs.submit('revenue-trends', {'period': 'month', 'background': 'true'})
+        self.assertNotIn('background', job.params)
+        self.assertEqual(jobs.execute(jobs.claim('worker')), jobs.SUCCEEDED)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), (jobs.SUCCEEDED, 1.0))
+        self.assertTrue(b''.join(jobs.read_result(jobs.result_path(job.pk))).startswith(b'{'))
+
+    def test_cancel_queued_job_is_never_claimed(self):
+        job = jobs.submit('revenue-trends', {})
+        self.assertTrue(jobs.cancel(job))
+        self.assertEqual(job.status, jobs.CANCELLED)
+        self.assertIsNone(jobs.claim('worker'))
+        self.assertFalse(jobs.cancel(job))
+
+    def test_cancelled_running_job_stops_and_leaves_no_result(self):
+        job = jobs.submit('revenue-trends', {})
+        jobs.claim('worker')
+        jobs.cancel(job)
+        self.assertEqual(jobs.execute(job.pk), jobs.CANCELLED)
+        self.assertEqual(os.listdir(self.dir), [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, jobs.CANCELLED)
+
+    def test_finished_job_cannot_be_cancelled(self):
+        job = jobs.submit('revenue-trends', {})
+        jobs.execute(jobs.claim('worker'))
+        self.assertFalse(jobs.cancel(job))
+        self.assertEqual(job.status, jobs.SUCCEEDED)
@@ -1,32 +1,59 @@
 from django.urls import path
+from .async_views import AsyncCustomerInsightsView, AsyncRevenueTrendsView
 from .views import (
     CustomerListView, 
+    CustomerSearchView,
+    CustomerExportView,
     ProductUsageView, 
     CustomerInsightsView, 
     RevenueTrendsView,
+    TransactionDistributionView,
+    CohortRetentionView,
+    JobDetailView,
+    JobResultView,
+    AnalyticsCacheStatsView,
+    MetricsView,
+    ImageVariantView,
+    CustomerProfileView,
     CustomerPersonalInfoView,
     ServicesUsedView,
     RecommendedServiceView,
     ChurnProbabilityView,
     TransactionHistoryView,
     CustomerProductRiskView,
+    TopRiskCustomersView,
     CustomerSegmentationView,
     CustomerByProductView,
-    ProductListView
+    ProductListView,
+    TransactionIngestView
 )
 
 urlpatterns = [
     path('customers/', CustomerListView.as_view(), name='customer-list'),
+    path('customers/search/', CustomerSearchView.as_view(), name='customer-search'),
+    path('customers/export/', CustomerExportView.as_view(), name='customer-export'),
     path('customers/<int:customer_id>/products/', ProductListView.as_view(), name='customer-products'),
+    path('transactions/ingest/', TransactionIngestView.as_view(), name='transaction-ingest'),
     path('products/usage/', ProductUsageView.as_view(), name='product-usage'),
     path('products/<str:product_name>/customers/', CustomerByProductView.as_view(), name='customers-by-product'),
     path('customers/insights/', CustomerInsightsView.as_view(), name='customer-insights'),
     path('revenue/trends/', RevenueTrendsView.as_view(), name='revenue-trends'),
+    path('revenue/distribution/', TransactionDistributionView.as_view(), name='transaction-distribution'),
+    path('cohorts/retention/', CohortRetentionView.as_view(), name='cohort-retention'),
+    path('jobs/<uuid:job_id>/', JobDetailView.as_view(), name='job-detail'),
+    path('jobs/<uuid:job_id>/result/', JobResultView.as_view(), name='job-result'),
+    path('async/customers/insights/', AsyncCustomerInsightsView.as_view(), name='customer-insights-async'),
+    path('async/revenue/trends/', AsyncRevenueTrendsView.as_view(), name='revenue-trends-async'),
+    path('cache/stats/', AnalyticsCacheStatsView.as_view(), name='analytics-cache-stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('images/<path:name>', ImageVariantView.as_view(), name='image-variant'),
+    path('customer/<int:customer_id>/profile/', CustomerProfileView.as_view(), name='customer_profile'),
     path('customer/<int:customer_id>/personal_info/', CustomerPersonalInfoView.as_view(), name='customer_personal_info'),
     path('customer/<int:customer_id>/services_used/', ServicesUsedView.as_view(), name='services_used'),
     path('customer/<int:customer_id>/recommended_service/', RecommendedServiceView.as_view(), name='recommended_service'),
     path('customer/<int:customer_id>/churn_probability/', ChurnProbabilityView.as_view(), name='churn_probability'),
     path('customer/<int:customer_id>/transactions/', TransactionHistoryView.as_view(), name='transaction_history'),
     path('customer/<int:customer_id>/product_risk/', CustomerProductRiskView.as_view(), name='product_risk'),
+    path('risk/top/', TopRiskCustomersView.as_view(), name='top-risk-customers'),
     path('customer/<int:customer_id>/segmentation/', CustomerSegmentationView.as_view(), name='segmentation'),
 ]
@@ -1,99 +1,152 @@
+import csv
+import io
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.db.models import Count, Avg, Sum, Max
-from .models import Customer, Product, Transaction
-from .serializers import CustomerSerializer,ProductSerializer
-from django.utils import timezone 
+from django.db.models import Count, Sum
+from .models import Customer, Job, Product, Transaction, RecommendedService, ProductRiskExposure
+from .serializers import CustomerSerializer,ProductSerializer, CustomerProfileSerializer, PROFILE_FIELDS, profile_queryset
+from .filters import FilterError, filter_customers
+from .analytics import summarize_customers
+from . import cohorts, dashboards, exports, images, jobs, metrics, search, sketches, snapshot, windows
+from .exports import EXPORT_FORMATS, export_queryset
+from .cache import cached_response, stats as analytics_cache_stats
+from .churn import churn_summary, latest_scores as latest_churn_scores
+from .ingest import INGEST_FORMATS, IngestResult, ingest
+from .risk import DEFAULT_TOP_RISK, MAX_TOP_RISK, exposure_summary
+from .pagination import CursorError, keyset_page, parse_page_size
+from .replicas import replica_reads
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from rest_framework import status 
-from datetime import datetime, timedelta, date
-from django.db.models import Q
-from django.db.models.functions import TruncDate, TruncWeek, TruncMonth, TruncYear
-from dateutil import parser 
+from django.db.models import Q, F, Value
+from django.db.models.functions import Lower
 
-class CustomerListView(APIView):
-    def get(self, request):
-        # Get query parameters
-        segment = request.query_params.get('segment')
-        date_from = request.query_params.get('date_from')
-        date_to = request.query_params.get('date_to')
-        min_spent = request.query_params.get('min_spent')
-        has_anomalies = request.query_params.get('has_anomalies')
-        period = request.query_params.get('period', 'all') 
-        customer_name = request.query_params.get('customer_name')
-
-        # Base queryset with annotations
-        customers = Customer.objects.annotate(
-            total_transactions=Count('transactions'),
-            total_spent=Sum('transactions__amount'),
-            last_transaction_date=Max('transactions__transaction_date')
-        )
+def wants_background(request):
+    return request.query_params.get('background', '').lower() in ('1', 'true', 'yes')
+
+
+def submit_job(kind, request):
+    """Queue ``kind`` for the request's parameters and answer 202 with the job to poll."""
+    try:
+        job = jobs.submit(kind, request.query_params)
+    except FilterError as exc:
+        return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    response = Response(describe_job(job), status=status.HTTP_202_ACCEPTED)
+    response['Location'] = reverse('job-detail', args=[job.pk])
+    return response
 
-        # Apply filters based on segment
-        if segment:
-            customers = customers.filter(segment=segment)
-
-        # Apply filters based on the specified period for signup_date
-        if period != 'all':
-            today = timezone.now()
-            if period == 'day':
-                start_date = today - timedelta(days=1)
-                end_date = today
-            elif period == 'week':
-                start_date = today - timedelta(days=today.weekday())  # Start of the week (Monday)
-                end_date = start_date + timedelta(days=6)  # End of the week (Sunday)
-            elif period == 'month':
-                start_date = today.replace(day=1)  # Start of the month
-                end_date = (start_date + timedelta(days=32)).replace(day=1) - timedelta(days=1)  # End of the month
-            else:
-                return Response({"error": "Invalid period specified"}, status=status.HTTP_400_BAD_REQUEST)
-
-            customers = customers.filter(signup_date__range=[start_date, end_date])
-
-        # Apply filters based on transaction dates if provided
-        if date_from and date_to:
-            try:
-                date_from = parser.isoparse(date_from)  # Parse ISO 8601 date format
-                date_to = parser.isoparse(date_to)
-                customers = customers.filter(transactions__transaction_date__range=[date_from, date_to])
-            except ValueError:
-                return Response({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Apply filters based on minimum spent amount if provided
-        if min_spent:
-            try:
-                customers = customers.filter(total_spent__gte=float(min_spent))
-            except ValueError:
-                return Response({"error": "Invalid amount"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Filter customers with anomalies in transactions if specified
-        if has_anomalies is not None:  # Check for presence of the parameter
-            customers = customers.filter(transactions__is_anomalous=True).distinct()
+def describe_job(job):
+    data = jobs.describe(job)
+    if job.status == jobs.SUCCEEDED:
+        data['result_url'] = reverse('job-result', args=[job.pk])
+    return data
 
-        if customer_name:
-            customers = customers.filter(name__icontains=customer_name)
+
+class CustomerListView(APIView):
+    @replica_reads
+    @cached_response('customer-list')
+    def get(self, request):
+        try:
+            customers = filter_customers(request.query_params)
+        except FilterError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Fetch once; the serializer and every analytics metric reuse these rows
+        customers = list(customers.order_by('customer_id'))
 
         # Serialize customer data
         serializer = CustomerSerializer(customers, many=True)
 
         # Prepare analytics data
-        analytics = {
-            'total_customers': customers.count(),
-            'segment_distribution': dict(customers.values_list('segment').annotate(count=Count('segment'))),
-            'average_customer_value': customers.aggregate(avg=Avg('total_spent'))['avg'],
-            'customer_acquisition_trend': dict(
-                customers.values('signup_date__month')
-                .annotate(count=Count('customer_id'))
-                .order_by('signup_date__month')
-            )
-        }
+        analytics = summarize_customers(customers)
 
         return Response({
             'analytics': analytics,
             'customers': serializer.data
         })
 
+class CustomerSearchView(APIView):
+    # Autocomplete: ranked matches from the search index, without the
+    # transaction annotations of CustomerListView
+    @replica_reads
+    @cached_response('customer-search')
+    def get(self, request):
+        term = request.query_params.get('q', '').strip()
+        if not term:
+            return Response({"error": "q is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', search.DEFAULT_LIMIT))
+        except ValueError:
+            return Response({"error": "Invalid limit"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= search.MAX_LIMIT:
+            return Response({"error": f"limit must be between 1 and {search.MAX_LIMIT}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'query': term, 'results': search.autocomplete(term, limit)})
+
+class CustomerExportView(APIView):
+    @replica_reads
+    def get(self, request):
+        if wants_background(request):
+            return submit_job('customer-export', request)
+        # `format` is reserved by DRF's content negotiation, hence `output`
+        export_format = request.query_params.get('output', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response({"error": "Invalid output format. Use csv or ndjson"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            customers = export_queryset(request.query_params)
+        except FilterError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        # Rows are fetched while streaming, after the view has returned; pick the database now
+        customers = customers.using(customers.db)
+
+        response = StreamingHttpResponse(
+            exports.render(exports.export_rows(customers), export_format),
+            content_type=EXPORT_FORMATS[export_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="customers.{export_format}"'
+        return response
+
+class TransactionIngestView(APIView):
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "Upload the transactions as a 'file' field."}, status=status.HTTP_400_BAD_REQUEST)
+
+        input_format = request.query_params.get('input_format') or upload.name.rsplit('.', 1)[-1].lower()
+        if input_format not in INGEST_FORMATS:
+            return Response({"error": "Invalid input format. Use csv or ndjson"}, status=status.HTTP_400_BAD_REQUEST)
+
+        result = IngestResult()
+        body = {}
+        try:
+            ingest(io.TextIOWrapper(upload.file, encoding='utf-8', newline=''), input_format, result=result)
+        except (UnicodeDecodeError, csv.Error) as exc:
+            # Batches before the unreadable part stay ingested
+            body["error"] = f"Could not read the upload as UTF-8 {input_format}: {exc}"
+        body.update({
+            "ingested": result.ingested,
+            "failed": result.failed,
+            "errors": [
+                {"line": line_number, "error": message}
+                for line_number, message, row in result.errors
+            ],
+        })
+        created = result.ingested and "error" not in body
+        return Response(body, status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
 class ProductUsageView(APIView):
+    @replica_reads
+    @cached_response('product-usage')
     def get(self, request, *args, **kwargs):
+        current = snapshot.load()
+        if current is not None:
+            return Response(snapshot.product_usage(current))
+
         product_usage = (
             Transaction.objects.values('product__name')
             .annotate(count=Count('product'))
@@ -121,7 +174,9 @@ class ProductListView(APIView):
 class CustomerByProductView(APIView):
     def get(self, request, product_name):
         # Retrieve customers associated with the given product name
-        customers = Customer.objects.filter(products__name__iexact=product_name)
+        # Compare lowercased names so product_name_lower_idx can be used
+        products = Product.objects.alias(name_lower=Lower('name')).filter(name_lower=Lower(Value(product_name)))
+        customers = Customer.objects.filter(customer_id__in=products.values('customer_id'))
 
         # Check if any customers were found
         if not customers.exists():
@@ -133,219 +188,132 @@ class CustomerByProductView(APIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 class CustomerInsightsView(APIView):
+    @replica_reads
+    @cached_response('customer-insights')
     def get(self, request, *args, **kwargs):
-        today = timezone.now()
-        period = request.query_params.get('period', 'week') 
-
-        if period == 'day':
-            start_date = today - timedelta(days=1)
-            end_date = today
-        elif period == 'week':
-            start_date = today - timedelta(days=today.weekday())
-            end_date = start_date + timedelta(days=6)
-        elif period == 'month':
-            start_date = today.replace(day=1)
-            end_date = (start_date + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-        else:
-            return Response({"error": "Invalid period specified"}, status=400)
-
-        # Last period range
-        if period == 'day':
-            last_period_start = start_date - timedelta(days=1)
-            last_period_end = start_date
-        elif period == 'week':
-            last_period_start = start_date - timedelta(days=7)
-            last_period_end = last_period_start + timedelta(days=6)
-        elif period == 'month':
-            last_period_start = (start_date - timedelta(days=1)).replace(day=1)
-            last_period_end = start_date - timedelta(days=1)
-
-        # Count customers for the current and previous periods
-        current_period_customers = Customer.objects.filter(signup_date__range=(start_date, end_date)).count()
-        last_period_customers = Customer.objects.filter(signup_date__range=(last_period_start, last_period_end)).count()
-
-        # Calculate WoW Change for customers
-        if last_period_customers > 0:
-            wow_change = ((current_period_customers - last_period_customers) / last_period_customers) * 100
+        try:
+            plan = dashboards.customer_insights(request.query_params)
+        except FilterError as exc:
+            return Response({"error": str(exc)}, status=400)
+        return Response(dashboards.run(plan))
+    
+class RevenueTrendsView(APIView):
+    # See customer.async_views for the variant running the queries concurrently
+    @replica_reads
+    @cached_response('revenue-trends')
+    def get(self, request, *args, **kwargs):
+        if wants_background(request):
+            return submit_job('revenue-trends', request)
+        try:
+            plan = dashboards.revenue_trends(request.query_params)
+        except FilterError as exc:
+            return Response({"error": str(exc)}, status=400)
+        return Response(dashboards.run(plan))
+
+class JobDetailView(APIView):
+    # Read from the primary: a replica may not have seen the job yet
+    def get(self, request, job_id):
+        return Response(describe_job(get_object_or_404(Job, pk=job_id)))
+
+    def delete(self, request, job_id):
+        job = get_object_or_404(Job, pk=job_id)
+        if not jobs.cancel(job):
+            return Response({"error": f"Job already {job.status}"}, status=status.HTTP_409_CONFLICT)
+        return Response(describe_job(job))
+
+class JobResultView(APIView):
+    def get(self, request, job_id):
+        job = get_object_or_404(Job, pk=job_id)
+        if job.status == jobs.EXPIRED:
+            return Response({"error": "The job result has expired"}, status=status.HTTP_410_GONE)
+        if job.status != jobs.SUCCEEDED:
+            return Response({"error": f"Job is {job.status}", **describe_job(job)}, status=status.HTTP_409_CONFLICT)
+
+        path = jobs.result_path(job.pk)
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            # Stored compressed; hand the file over as it is
+            response = FileResponse(open(path, 'rb'), content_type=job.content_type)
+            response['Content-Encoding'] = 'gzip'
         else:
-            wow_change = None 
+            response = StreamingHttpResponse(jobs.read_result(path), content_type=job.content_type)
+        response['Vary'] = 'Accept-Encoding'
+        if job.filename:
+            response['Content-Disposition'] = f'attachment; filename="{job.filename}"'
+        return response
+
+class TransactionDistributionView(APIView):
+    # p50/p95/p99 amounts and distinct customers merged from the daily sketches
+    @replica_reads
+    @cached_response('transaction-distribution')
+    def get(self, request, *args, **kwargs):
+        try:
+            window = windows.from_params(request.query_params, default='month')
+        except FilterError as exc:
+            return Response({"error": str(exc)}, status=400)
+        return Response(sketches.distribution(window, request.query_params.get('segment')))
+
+class CohortRetentionView(APIView):
+    # Precomputed by customer.cohorts; the most recent months touched since the last read are rebuilt first
+    @replica_reads
+    @cached_response('cohort-retention')
+    def get(self, request, *args, **kwargs):
+        try:
+            data = cohorts.retention(request.query_params)
+        except FilterError as exc:
+            return Response({"error": str(exc)}, status=400)
+        return Response(data)
 
-        # Calculate average revenue for this period and last period
-        avg_revenue_this_period = Transaction.objects.filter(
-            transaction_date__range=(start_date, end_date)
-        ).aggregate(avg_revenue=Avg('amount'))['avg_revenue'] or 0
+class AnalyticsCacheStatsView(APIView):
+    def get(self, request, *args, **kwargs):
+        return Response(analytics_cache_stats())
 
-        avg_revenue_last_period = Transaction.objects.filter(
-            transaction_date__range=(last_period_start, last_period_end)
-        ).aggregate(avg_revenue=Avg('amount'))['avg_revenue'] or 0
+class MetricsView(APIView):
+    # Prometheus scrape target for customer.middleware.InstrumentationMiddleware
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
-        # Calculate percentage change in revenue
-        if avg_revenue_last_period > 0:
-            revenue_change_percentage = ((avg_revenue_this_period - avg_revenue_last_period) / avg_revenue_last_period) * 100
-        else:
-            revenue_change_percentage = None  
-
-        response_data = {
-            "wow_change": wow_change,
-            "average_revenue": {
-                "current": avg_revenue_this_period,
-                "last_period": avg_revenue_last_period,
-                "revenue_change_percentage": revenue_change_percentage,
-            },
-            "current_period_customers": current_period_customers,
-            "last_period_customers": last_period_customers,
-        }
+class ImageVariantView(APIView):
+    # ?size=80&format=webp; the variant is rendered once and then served from disk
+    def perform_content_negotiation(self, request, force=False):
+        # ?format= names the image format here, not a DRF renderer; errors stay JSON
+        return super().perform_content_negotiation(request, force=True)
 
-        return Response(response_data)
-    
-class RevenueTrendsView(APIView):
-    def get(self, request, *args, **kwargs):
-        # Get parameters
-        period = request.query_params.get('period', 'day')  
-        custom_start = request.query_params.get('start_date')
-        custom_end = request.query_params.get('end_date')
-        
-        # Initialize base querysets
-        customer_qs = Customer.objects.all()
-        transaction_qs = Transaction.objects.all()
-        
-        # Set up date trunc mapping
-        date_trunc_mapping = {
-            'day': TruncDate('signup_date'),
-            'week': TruncWeek('signup_date'),
-            'month': TruncMonth('signup_date'),
-            'year': TruncYear('signup_date')
-        }
-        
-        transaction_trunc_mapping = {
-            'day': TruncDate('transaction_date'),
-            'week': TruncWeek('transaction_date'),
-            'month': TruncMonth('transaction_date'),
-            'year': TruncYear('transaction_date')
-        }
-        
-        # Apply date filtering
-        if period == 'custom' and custom_start and custom_end:
-            try:
-                start_date = datetime.strptime(custom_start, '%Y-%m-%d')
-                end_date = datetime.strptime(custom_end, '%Y-%m-%d')
-                
-                customer_qs = customer_qs.filter(
-                    signup_date__range=[start_date, end_date + timedelta(days=1)]
-                )
-                transaction_qs = transaction_qs.filter(
-                    transaction_date__range=[start_date, end_date + timedelta(days=1)]
-                )
-            except ValueError:
+    def get(self, request, name, *args, **kwargs):
+        image_format = request.query_params.get('format', images.DEFAULT_FORMAT)
+        try:
+            path, etag, modified = images.variant(name, request.query_params.get('size', images.SIZES[-1]), image_format)
+        except images.ImageNotFound as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_404_NOT_FOUND)
+        except images.ImageError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        etag = f'"{etag}"'
+        response = get_conditional_response(request, etag=etag, last_modified=int(modified))
+        if response is None:
+            response = FileResponse(open(path, 'rb'), content_type=images.FORMATS[image_format])
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        patch_cache_control(response, public=True, max_age=images.MAX_AGE)
+        return response
+
+class CustomerProfileView(APIView):
+    def get(self, request, customer_id, *args, **kwargs):
+        # ?fields=personal_info,churn_probability skips the other sections and their queries
+        fields = PROFILE_FIELDS
+        if request.query_params.get('fields'):
+            fields = [name.strip() for name in request.query_params['fields'].split(',') if name.strip()]
+            unknown = sorted(set(fields) - set(PROFILE_FIELDS))
+            if unknown:
                 return Response(
-                    {"error": "Invalid date format. Use YYYY-MM-DD"},
-                    status=400
+                    {"error": f"Invalid fields: {', '.join(unknown)}. Choose from {', '.join(PROFILE_FIELDS)}."},
+                    status=status.HTTP_400_BAD_REQUEST,
                 )
-        else:
-            now = timezone.now()
-            if period == 'week':
-                start_date = now - timedelta(days=now.weekday())
-            elif period == 'month':
-                start_date = now.replace(day=1)
-            elif period == 'year':
-                start_date = now.replace(month=1, day=1)
-            else:  # day
-                start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            
-            customer_qs = customer_qs.filter(signup_date__gte=start_date)
-            transaction_qs = transaction_qs.filter(transaction_date__gte=start_date)
-        
-        # Get trends based on period
-        trunc_date = date_trunc_mapping.get(period, TruncDate('signup_date'))
-        trunc_transaction = transaction_trunc_mapping.get(period, TruncDate('transaction_date'))
-        
-        # Customer trends with cumulative calculation
-        customer_count_trend = (
-            customer_qs
-            .annotate(period=trunc_date)
-            .values('period')
-            .annotate(new_customers=Count('customer_id'))
-            .order_by('period')
-        )
-        
-        # Calculate cumulative customers manually
-        cumulative_customers = []
-        running_total = 0
-        for item in customer_count_trend:
-            running_total += item['new_customers']
-            cumulative_customers.append({
-                'period': item['period'],
-                'new_customers': item['new_customers'],
-                'cumulative_customers': running_total
-            })
-        
-        # Revenue trends
-        revenue_trend = (
-            transaction_qs
-            .annotate(period=trunc_transaction)
-            .values('period')
-            .annotate(
-                total_revenue=Sum('amount'),
-                average_transaction=Avg('amount'),
-                transaction_count=Count('transaction_id'),
-                anomaly_count=Count('transaction_id', filter=Q(is_anomalous=True))
-            )
-            .order_by('period')
-        )
-        
-        # Calculate segment distribution over time
-        segment_trend = (
-            customer_qs
-            .annotate(period=trunc_date)
-            .values('period', 'segment')
-            .annotate(count=Count('customer_id'))
-            .order_by('period', 'segment')
-        )
-        
-        # Calculate product category performance
-        product_trend = (
-            transaction_qs
-            .annotate(period=trunc_transaction)
-            .values('period', 'product__category')
-            .annotate(
-                revenue=Sum('amount'),
-                transaction_count=Count('transaction_id')
-            )
-            .order_by('period', 'product__category')
-        )
-        
-        # Calculate summary metrics
-        summary = {
-            'total_customers': customer_qs.count(),
-            'total_revenue': transaction_qs.aggregate(total=Sum('amount'))['total'] or 0,
-            'average_transaction': transaction_qs.aggregate(avg=Avg('amount'))['avg'] or 0,
-            'anomaly_rate': (
-                transaction_qs.filter(is_anomalous=True).count() /
-                float(transaction_qs.count()) if transaction_qs.exists() else 0
-            ) * 100  # Convert to percentage
-        }
-        
-        # Add revenue growth metrics
-        if revenue_trend:
-            first_revenue = next(iter(revenue_trend))['total_revenue']
-            last_revenue = list(revenue_trend)[-1]['total_revenue']
-            revenue_growth = ((last_revenue - first_revenue) / first_revenue * 100) if first_revenue else 0
-            summary['revenue_growth'] = revenue_growth
-        
-        response_data = {
-            'period': period,
-            'summary': summary,
-            'customer_trends': {
-                'count_trend': cumulative_customers,
-                'segment_distribution': list(segment_trend)
-            },
-            'revenue_trends': {
-                'revenue_by_period': list(revenue_trend),
-                'product_performance': list(product_trend)
-            }
-        }
-        
-        return Response(response_data)
+
+        customer = profile_queryset(fields).filter(customer_id=customer_id).first()
+        if customer is None:
+            return Response({"error": "Customer not found"}, status=404)
+        return Response(CustomerProfileSerializer(customer, fields=fields).data)
+
 
 class CustomerPersonalInfoView(APIView):
     def get(self, request, customer_id, *args, **kwargs):
@@ -378,21 +346,34 @@ class ServicesUsedView(APIView):
 
 class RecommendedServiceView(APIView):
     def get(self, request, customer_id, *args, **kwargs):
-        recommended_service = "Loan Against Fixed Deposit"  
-        return Response({"recommended_service": recommended_service})
+        # Precomputed by the build_recommendations command
+        recommendations = list(
+            RecommendedService.objects.filter(customer_id=customer_id)
+            .values('service_name', 'recommendation_reason', 'rank', 'score')
+        )
+        if not recommendations and not Customer.objects.filter(customer_id=customer_id).exists():
+            return Response({"error": "Customer not found"}, status=404)
+        return Response({
+            "recommended_service": recommendations[0]['service_name'] if recommendations else None,
+            "recommendations": recommendations,
+        })
 
 class ChurnProbabilityView(APIView):
     def get(self, request, customer_id, *args, **kwargs):
-        churn_probability = {"value": 0.7, "graph": [0.6, 0.65, 0.7]}  
-        return Response(churn_probability)
+        # Precomputed by the score_churn command; an indexed lookup of the latest scores
+        scores = list(latest_churn_scores(customer_id))
+        if not scores and not Customer.objects.filter(customer_id=customer_id).exists():
+            return Response({"error": "Customer not found"}, status=404)
+        return Response(churn_summary(scores))
 
 class TransactionHistoryView(APIView):
     def get(self, request, customer_id, *args, **kwargs):
         try:
             # Get time period from query parameters
-            period = request.query_params.get('period', 'all')  # Default to all
-            custom_start = request.query_params.get('start_date')
-            custom_end = request.query_params.get('end_date')
+            try:
+                window = windows.from_params(request.query_params, default='all', allow_all=True)
+            except FilterError as exc:
+                return Response({"error": str(exc)}, status=400)
             amount= request.query_params.get('amount')
             anomalous = request.query_params.get('anomalous')
             
@@ -402,40 +383,9 @@ class TransactionHistoryView(APIView):
             # Base query
             transactions = Transaction.objects.filter(customer=customer)
             
-            # Get current datetime
-            now = timezone.now()
-            
             # Apply time period filter
-            if period == 'day':
-                start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-                transactions = transactions.filter(transaction_date__gte=start_date)
-            
-            elif period == 'week':
-                start_date = now - timedelta(days=now.weekday())
-                start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                transactions = transactions.filter(transaction_date__gte=start_date)
-            
-            elif period == 'month':
-                start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-                transactions = transactions.filter(transaction_date__gte=start_date)
-            
-            elif period == 'year':
-                start_date = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-                transactions = transactions.filter(transaction_date__gte=start_date)
-            
-            elif period == 'custom' and custom_start and custom_end:
-                try:
-                    start_date = datetime.strptime(custom_start, '%Y-%m-%d')
-                    end_date = datetime.strptime(custom_end, '%Y-%m-%d')
-                    transactions = transactions.filter(
-                        transaction_date__gte=start_date,
-                        transaction_date__lte=end_date + timedelta(days=1)
-                    )
-                except ValueError:
-                    return Response(
-                        {"error": "Invalid date format. Use YYYY-MM-DD"},
-                        status=400
-                    )
+            if window is not None:
+                transactions = transactions.filter(window.q('transaction_date'))
             
             if amount:
                 try:
@@ -452,31 +402,42 @@ class TransactionHistoryView(APIView):
                 elif anomalous.lower() == 'false':
                     transactions = transactions.filter(is_anomalous=False)
             
-            # Calculate summary statistics
-            summary = {
-                'total_transactions': transactions.count(),
-                'total_amount': transactions.aggregate(Sum('amount'))['amount__sum'] or 0,
-                'anomalous_transactions': transactions.filter(is_anomalous=True).count(),
-                'period': period,
+            cursor = request.query_params.get('cursor')
+            try:
+                page_size = parse_page_size(request.query_params.get('page_size'))
+                # Keyset page with the product columns joined in, not fetched per row
+                page, next_cursor = keyset_page(
+                    transactions.values(
+                        'transaction_id', 'transaction_date', 'amount', 'is_anomalous',
+                        product_name=F('product__name'), product_category=F('product__category'),
+                    ),
+                    cursor=cursor,
+                    page_size=page_size,
+                )
+            except CursorError as exc:
+                return Response({"error": str(exc)}, status=400)
+            
+            response_data = {
+                'transactions': page,
+                'next_cursor': next_cursor,
             }
             
-            # Get transaction details
-            transaction_data = [
-                {
-                    "transaction_id": t.transaction_id,
-                    "transaction_date": t.transaction_date,
-                    "amount": t.amount,
-                    "is_anomalous": t.is_anomalous,
-                    "product_name": t.product.name if t.product else None,
-                    "product_category": t.product.category if t.product else None,
+            # Calculate summary statistics in one conditional aggregate. Only the
+            # first page carries it so that following pages stay constant-time.
+            if not cursor:
+                totals = transactions.aggregate(
+                    total_transactions=Count('transaction_id'),
+                    total_amount=Sum('amount'),
+                    anomalous_transactions=Count('transaction_id', filter=Q(is_anomalous=True)),
+                )
+                response_data['summary'] = {
+                    'total_transactions': totals['total_transactions'],
+                    'total_amount': totals['total_amount'] or 0,
+                    'anomalous_transactions': totals['anomalous_transactions'],
+                    'period': window.name if window else 'all',
                 }
-                for t in transactions.order_by('-transaction_date')
-            ]
             
-            return Response({
-                'summary': summary,
-                'transactions': transaction_data
-            })
+            return Response(response_data)
             
         except Customer.DoesNotExist:
             return Response({"error": "Customer not found"}, status=404)
@@ -484,12 +445,39 @@ class TransactionHistoryView(APIView):
 
 class CustomerProductRiskView(APIView):
     def get(self, request, customer_id, *args, **kwargs):
-        customer_product_risk = {
-            "MobileBanking": 0.2,
-            "Loans": 0.8,
-            "Deposits": 0.1,
-        }
-        return Response(customer_product_risk)
+        # Materialized by the risk signals / refresh_risk_exposure command
+        exposure = ProductRiskExposure.objects.filter(customer_id=customer_id).first()
+        if exposure is None and not Customer.objects.filter(customer_id=customer_id).exists():
+            return Response({"error": "Customer not found"}, status=404)
+        return Response(exposure_summary(exposure))
+
+
+class TopRiskCustomersView(APIView):
+    @replica_reads
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = int(request.query_params.get('limit', DEFAULT_TOP_RISK))
+        except ValueError:
+            return Response({"error": "Invalid limit"}, status=400)
+        if limit < 1:
+            return Response({"error": "Invalid limit"}, status=400)
+
+        exposures = (
+            ProductRiskExposure.objects
+            .filter(overall_exposure__isnull=False)
+            .select_related('customer')
+            .order_by('-overall_exposure')[:min(limit, MAX_TOP_RISK)]
+        )
+        return Response([
+            {
+                "customer_id": exposure.customer_id,
+                "name": exposure.customer.name,
+                "segment": exposure.customer.segment,
+                "transaction_volume": exposure.transaction_volume,
+                **exposure_summary(exposure),
+            }
+            for exposure in exposures
+        ])
 
 
 class CustomerSegmentationView(APIView):
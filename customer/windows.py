@@ -0,0 +1,189 @@
+"""
+Time windows shared by the analytics views.
+
+A window is a half-open ``[start, end)`` range between local midnights: the
+current day/week/month/year, the last N of them, or a custom range of
+whole days. Consecutive windows neither overlap nor leave gaps, so the
+window before one is simply its length shifted back, and current-vs-
+previous metrics come from one conditional aggregate over both.
+"""
+from datetime import date, datetime, time, timedelta
+
+from django.db.models import Q
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek, TruncYear
+from django.utils import timezone
+
+# A module import: customer.filters uses this module too
+from . import filters
+
+PERIODS = ('day', 'week', 'month', 'year')
+TRUNCATE = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth, 'year': TruncYear}
+MAX_PERIODS = 366
+
+
+def _midnight(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _local_date(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    return value
+
+
+def period_start(value, period):
+    """The first day of the ``period`` containing ``value`` (a date or datetime)."""
+    day = _local_date(value)
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def shift(day, period, count):
+    """The first day of the period ``count`` periods after (before, if negative) the one starting on ``day``."""
+    if period == 'week':
+        return day + timedelta(weeks=count)
+    if period == 'month':
+        index = day.year * 12 + day.month - 1 + count
+        return date(index // 12, index % 12 + 1, 1)
+    if period == 'year':
+        return date(day.year + count, 1, 1)
+    return day + timedelta(days=count)
+
+
+class Window:
+    """
+    ``count`` consecutive whole periods from ``first_day``, bucketed by
+    ``period``. Custom ranges are a number of days bucketed by day and
+    report ``'custom'`` as their period.
+    """
+
+    def __init__(self, first_day, period, count=1, custom=False):
+        self.first_day = first_day
+        self.period = period
+        self.count = count
+        self.custom = custom
+        self.end_day = shift(first_day, period, count)
+
+    @property
+    def name(self):
+        return 'custom' if self.custom else self.period
+
+    @property
+    def last_day(self):
+        return self.end_day - timedelta(days=1)
+
+    @property
+    def start(self):
+        return _midnight(self.first_day)
+
+    @property
+    def end(self):
+        return _midnight(self.end_day)
+
+    def previous(self):
+        """The window of the same length right before this one."""
+        return Window(shift(self.first_day, self.period, -self.count), self.period, self.count, self.custom)
+
+    def with_previous(self):
+        """This window and the one before it as a single window."""
+        return Window(self.previous().first_day, self.period, self.count * 2, self.custom)
+
+    def q(self, field):
+        """Rows whose DateTimeField ``field`` falls in the window."""
+        return Q(**{f'{field}__gte': self.start, f'{field}__lt': self.end})
+
+    def q_days(self, field):
+        """Rows whose DateField ``field`` falls in the window."""
+        return Q(**{f'{field}__gte': self.first_day, f'{field}__lt': self.end_day})
+
+    def buckets(self):
+        """The first day of every bucket, oldest first."""
+        return [shift(self.first_day, self.period, index) for index in range(self.count)]
+
+    def truncate(self, field):
+        return TRUNCATE[self.period](field)
+
+    def __repr__(self):
+        return f"<Window {self.name} {self.first_day}..{self.last_day}>"
+
+
+def current(period, count=1, now=None):
+    """The ``count`` periods ending with the one that contains ``now``."""
+    first_day = shift(period_start(now or timezone.now(), period), period, 1 - count)
+    return Window(first_day, period, count)
+
+
+def custom(start_date, end_date):
+    """The days from ``start_date`` to ``end_date`` (YYYY-MM-DD strings), both included."""
+    try:
+        first_day = datetime.strptime(start_date, '%Y-%m-%d').date()
+        last_day = datetime.strptime(end_date, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise filters.FilterError("Invalid date format. Use YYYY-MM-DD")
+    if last_day < first_day:
+        raise filters.FilterError("end_date is before start_date")
+    return Window(first_day, 'day', (last_day - first_day).days + 1, custom=True)
+
+
+def from_params(params, default='day', periods=PERIODS, allow_all=False, count=1):
+    """
+    The window selected by the ``period`` (one of ``periods``, ``custom``
+    with ``start_date``/``end_date``, or ``all`` if allowed, giving None)
+    and ``periods`` (how many periods back, default ``count``) query parameters.
+    """
+    period = params.get('period', default)
+    if allow_all and period == 'all':
+        return None
+    if period == 'custom':
+        if not params.get('start_date') or not params.get('end_date'):
+            raise filters.FilterError("A custom period needs start_date and end_date (YYYY-MM-DD)")
+        return custom(params['start_date'], params['end_date'])
+    if period not in periods:
+        raise filters.FilterError("Invalid period specified")
+    try:
+        count = int(params.get('periods', count))
+    except ValueError:
+        raise filters.FilterError("Invalid periods")
+    if not 1 <= count <= MAX_PERIODS:
+        raise filters.FilterError(f"periods must be between 1 and {MAX_PERIODS}")
+    return current(period, count)
+
+
+def compare(queryset, field, window, days=False, **metrics):
+    """
+    ``{'current': {...}, 'previous': {...}}`` values of ``metrics`` over
+    ``window`` and the window before it, from one scan of ``queryset``
+    restricted to both. ``metrics`` map names to ``(aggregate, expression)``
+    such as ``(Count, 'pk')``; ``days`` says ``field`` is a DateField.
+    """
+    previous = window.previous()
+    condition = (lambda part: part.q_days(field)) if days else (lambda part: part.q(field))
+    aggregates = {
+        f'{label}__{name}': function(expression, filter=condition(part))
+        for label, part in (('current', window), ('previous', previous))
+        for name, (function, expression) in metrics.items()
+    }
+    row = queryset.filter(condition(window.with_previous())).aggregate(**aggregates)
+    return {label: {name: row[f'{label}__{name}'] for name in metrics} for label in ('current', 'previous')}
+
+
+def change(current, previous):
+    """Percentage change, or None without a previous value to compare with."""
+    if not previous:
+        return None
+    return (current - previous) / previous * 100
+
+
+def fill(rows, window, empty, key='period'):
+    """
+    One row per bucket of ``window``, oldest first: ``rows`` keyed on the
+    bucket start in ``key`` (a date or datetime), and a copy of ``empty``
+    for every bucket without one.
+    """
+    by_bucket = {_local_date(row[key]): row for row in rows}
+    return [by_bucket.get(day) or {key: day, **empty} for day in window.buckets()]
@@ -2,6 +2,9 @@
 ASGI config for customerinsights project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with ``uvicorn customerinsights.asgi:application``; the async
+dashboard views in customer.async_views only run their queries concurrently
+under ASGI.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -11,6 +14,6 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'customerinsights.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'customerinsights.settings.base')
 
 application = get_asgi_application()
@@ -44,6 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its total time covers the other middleware too
+    'customer.middleware.InstrumentationMiddleware',
+    'customer.middleware.ReplicaPinMiddleware',
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -82,9 +85,87 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep each worker's connection open between requests
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas: analytics views read from the aliases listed here (add them
+# to DATABASES too) while their heartbeat lag stays within MAX_LAG_SECONDS.
+# Heartbeats, and copies for SQLite replicas, come from `manage.py sync_replicas`.
+DATABASE_ROUTERS = ['customer.replicas.ReplicaRouter']
+CUSTOMER_REPLICAS = {
+    'DATABASES': [],
+    'MAX_LAG_SECONDS': 30,
+    'CHECK_INTERVAL_SECONDS': 5,
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Analytics responses, keyed on a data version bumped by every write.
+    # LocMemCache evicts least recently used entries past MAX_ENTRIES; to share
+    # entries between workers use 'customer.cache.LRUFileBasedCache' with a
+    # LOCATION directory instead.
+    'analytics': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'customer-analytics',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 500,
+        },
+    },
+}
+
+CUSTOMER_ANALYTICS_CACHE = 'analytics'
+
+# Churn scoring runs kept in ChurnScore: each score_churn deletes the runs
+# before the latest KEEP_RUNS, enough for the profile graph. None keeps them all.
+CUSTOMER_CHURN = {
+    'KEEP_RUNS': 12,
+}
+
+# Retention reads rebuild at most READ_REBUILD_MONTHS stale months, the most
+# recent ones, before answering; run `manage.py build_cohorts` after large
+# imports or edits, e.g. from cron, for the rest. None rebuilds them all.
+CUSTOMER_COHORTS = {
+    'READ_REBUILD_MONTHS': 2,
+}
+
+# Per-request query counts and timings: Server-Timing headers, histograms
+# at /api/metrics/ and a 'customer.instrumentation' warning for every query
+# slower than SLOW_QUERY_MS. ENABLED = False removes the middleware.
+CUSTOMER_INSTRUMENTATION = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'SLOW_QUERY_MS': 200,
+}
+
+# Memory-mapped columns of the transactions table that the dashboards group
+# with NumPy. Build it with `manage.py refresh_snapshot`; after that, writes
+# append new transactions and re-export the SEGMENT_IDS-id segments of edited
+# ones in a background thread.
+CUSTOMER_SNAPSHOT = {
+    'ENABLED': True,
+    'DIR': BASE_DIR / 'snapshot',
+    'SEGMENT_IDS': 1 << 16,
+}
+
+# Background jobs: reports requested with background=true are queued in the
+# database and run by `manage.py run_jobs`; their compressed results are kept
+# in DIR for RESULT_TTL_SECONDS.
+CUSTOMER_JOBS = {
+    'DIR': BASE_DIR / 'job_results',
+    'WORKERS': 2,
+    'RESULT_TTL_SECONDS': 24 * 3600,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -1,3 +1,13 @@
 from .base import *
 
-DEBUG=True
\ No newline at end of file
+DEBUG=True
+
+# A local read replica, refreshed with `python manage.py sync_replicas --interval 10`
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': BASE_DIR / 'db.replica.sqlite3',
+    'CONN_MAX_AGE': 60,
+    'CONN_HEALTH_CHECKS': True,
+    'TEST': {'MIRROR': 'default'},
+}
+CUSTOMER_REPLICAS = {**CUSTOMER_REPLICAS, 'DATABASES': ['replica']}